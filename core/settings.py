@@ -55,6 +55,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "portal.metrics.RequestMetricsMiddleware",    # REQUEST_METRICS_ENABLED=False 时不挂载
+    "portal.slowlog.SlowQueryMiddleware",         # SLOW_QUERY_THRESHOLD_MS=0 时不挂载
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -64,6 +66,10 @@ MIDDLEWARE = [
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
+# WhiteNoise 只有同步实现：ASGI（SERVER_MODE=asgi）下它会让每个请求都切到线程里跑，抵消异步视图的好处。
+# docker-compose 部署里 /static 由 Caddy 直接出，可以设 WHITENOISE_MIDDLEWARE=False 把它拿掉
+if not env.bool("WHITENOISE_MIDDLEWARE", default=True):
+    MIDDLEWARE.remove("whitenoise.middleware.WhiteNoiseMiddleware")
 
 ROOT_URLCONF = "core.urls"
 TEMPLATES = [
@@ -90,10 +96,60 @@ DATABASES = {
 
 AUTH_USER_MODEL = "accounts.User"
 
+# ───── 缓存 ────────────────────────────────────────────────────────────
+# CACHE_URL 示例：
+#   locmemcache://                 进程内（默认；每个 worker 各一份，不共享）
+#   filecache:///public/cache      本机文件（多 worker 共享）
+#   redis://redis:6379/1           Redis（多 worker / 多机共享，推荐线上）
+CACHES = {
+    "default": env.cache("CACHE_URL", default="locmemcache://"),
+}
+# 命名空间缓存的命中/未命中统计（后台 ops-a9d4b1/cache-stats/ 查看）；默认关：
+# 每次读写都多一次 incr，Redis 下热路径的往返翻倍，只在排查命中率时临时打开
+CACHE_STATS_ENABLED = env.bool("CACHE_STATS_ENABLED", default=False)
+ATTENDANCE_MATRIX_CACHE_TIMEOUT = env.int("ATTENDANCE_MATRIX_CACHE_TIMEOUT", default=600)
+
+# ───── 请求耗时统计 ────────────────────────────────────────────────────
+# 按 URL 名记录 耗时 / SQL 条数 / SQL 耗时（最近 N 个样本存在共享缓存），后台 ops-a9d4b1/request-metrics/ 查看
+REQUEST_METRICS_ENABLED = env.bool("REQUEST_METRICS_ENABLED", default=False)
+REQUEST_METRICS_WINDOW = env.int("REQUEST_METRICS_WINDOW", default=200)
+# 响应头加 Server-Timing（app / db），浏览器 devtools 的 Timing 面板可见
+REQUEST_METRICS_SERVER_TIMING = env.bool("REQUEST_METRICS_SERVER_TIMING", default=False)
+# 慢查询：超过阈值的 SQL + 调用位置 + EXPLAIN 存进 SlowQuery 表（后台 Slow queries 查看）；0=关闭
+SLOW_QUERY_THRESHOLD_MS = env.float("SLOW_QUERY_THRESHOLD_MS", default=0)
+SLOW_QUERY_MAX_ROWS = env.int("SLOW_QUERY_MAX_ROWS", default=500)
+SLOW_QUERY_EXPLAIN_ASYNC = env.bool("SLOW_QUERY_EXPLAIN_ASYNC", default=True)
+
+# ───── 家长公告收件箱 ──────────────────────────────────────────────────
+# 公告发布 / 报名变化后的收件箱扇出登记为后台任务，由 run_export_worker 执行（失败重试，重启不丢）；
+# False=事务提交后在请求里同步执行（没有跑 worker 的部署，如 Render）
+NOTICE_FANOUT_ASYNC = env.bool("NOTICE_FANOUT_ASYNC", default=True)
+
+# ───── 全文检索 ────────────────────────────────────────────────────────
+# 后台评论 / 公告 / 学习资料搜索（portal/search.py）：最多返回条数、单次查询超时（毫秒）
+SEARCH_MAX_RESULTS = env.int("SEARCH_MAX_RESULTS", default=200)
+SEARCH_TIMEOUT_MS = env.int("SEARCH_TIMEOUT_MS", default=500)
+
+# ───── 签到表查询 ──────────────────────────────────────────────────────
+# 旧报名回填完（manage.py backfill_enrollment_slots 无未解决行）后可打开：
+# 签到表/导出只按 course_slot / sub_group 等值过滤，不再兼容空 course_slot、空 sub_group
+ENROLLMENT_STRICT_SLOT_FILTER = env.bool("ENROLLMENT_STRICT_SLOT_FILTER", default=False)
+
+# ───── 后台导出任务 ────────────────────────────────────────────────────
+# 大导出登记到 ExportJob 表，由 `manage.py run_export_worker`（compose 里的 export-worker）生成文件
+EXPORT_WORKER_POLL_SECONDS = env.float("EXPORT_WORKER_POLL_SECONDS", default=2.0)
+EXPORT_JOB_RETENTION_DAYS = env.int("EXPORT_JOB_RETENTION_DAYS", default=7)
+# RUNNING 任务的心跳间隔；心跳超过 STALE 秒没刷新 = worker 已死，放回队列（每 MAINTENANCE 秒检查一次）
+EXPORT_JOB_HEARTBEAT_SECONDS = env.int("EXPORT_JOB_HEARTBEAT_SECONDS", default=30)
+EXPORT_JOB_STALE_SECONDS = env.int("EXPORT_JOB_STALE_SECONDS", default=300)
+EXPORT_WORKER_MAINTENANCE_SECONDS = env.int("EXPORT_WORKER_MAINTENANCE_SECONDS", default=300)
+
 # ───── 静态/媒体存储 ────────────────────────────────────────────────────
 # 容器内 STATIC_ROOT/MEDIA_ROOT → /public/…（docker-compose 已把 ./public 挂载为 /public）
 STATIC_ROOT = Path("/public/static")
 MEDIA_ROOT = Path("/public/media")
+# 含个人信息的文件（导入暂存 / 导出结果）：不在 /public 下，Caddy 不会对外提供，只经后台视图下载
+PRIVATE_MEDIA_ROOT = Path(env("PRIVATE_MEDIA_ROOT", default=str(BASE_DIR / "private")))
 STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 
 # ───── 区域/本地化 ─────────────────────────────────────────────────────
@@ -25,6 +25,9 @@ from django.contrib.auth import views as auth_views
 
 
 urlpatterns = [
+    path("ops-a9d4b1/cache-stats/", admin.site.admin_view(p.ops_cache_stats), name="ops_cache_stats"),
+    path("ops-a9d4b1/request-metrics/", admin.site.admin_view(p.ops_request_metrics), name="ops_request_metrics"),
+    path("ops-a9d4b1/search/", admin.site.admin_view(p.ops_search), name="ops_search"),
     path("ops-a9d4b1/", admin.site.urls),   # 访问路径 /ops/，反向名用 admin:index
     path("admin/", custom_admin_view),
     path("", p.home, name="home"),
@@ -46,6 +49,7 @@ urlpatterns = [
     # 助教表格/打勾
     path("assistant/attendance/table/", p.attendance_table, name="assistant_attendance_table"),
     path("assistant/attendance/mark/",  p.attendance_mark,  name="assistant_attendance_mark"),
+    path("assistant/attendance/mark_batch/", p.attendance_mark_batch, name="assistant_attendance_mark_batch"),
     # 助教批量 & 导出
     path("assistant/attendance/mark_week_bulk/", p.attendance_mark_week_bulk, name="attendance_mark_week_bulk"),
     path("assistant/attendance/clear_week_bulk/", p.attendance_clear_week_bulk, name="attendance_clear_week_bulk"),
@@ -53,6 +57,7 @@ urlpatterns = [
 
     # 家长课程通知和课程资料
     path("parent/notices/",    p.parent_notices,    name="parent_notices"),
+    path("parent/notices/unread/", p.parent_notices_unread, name="parent_notices_unread"),
     path("parent/resources/",  p.parent_resources,  name="parent_resources"),
     path(
         "parent/subgroup/comment/",
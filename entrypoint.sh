@@ -3,4 +3,15 @@ set -e
 python manage.py migrate --noinput
 python manage.py collectstatic --noinput
 # 2 核机建议 3 workers；可按 2*CPU+1 调整
-exec gunicorn core.wsgi:application --bind 0.0.0.0:8000 --workers 3 --timeout 60
+WEB_WORKERS="${WEB_WORKERS:-3}"
+case "${SERVER_MODE:-wsgi}" in
+  asgi)
+    # 异步 worker：JSON 接口（级联 / 签到表 / 打勾 / 评论历史）是异步视图，等数据库时不占线程
+    exec gunicorn core.asgi:application -k uvicorn_worker.UvicornWorker \
+      --bind 0.0.0.0:8000 --workers "$WEB_WORKERS" --timeout 60 ;;
+  wsgi)
+    exec gunicorn core.wsgi:application --bind 0.0.0.0:8000 --workers "$WEB_WORKERS" --timeout 60 ;;
+  *)
+    echo "unknown SERVER_MODE: $SERVER_MODE (wsgi / asgi)" >&2
+    exit 1 ;;
+esac
@@ -4,16 +4,155 @@ from django import forms
 from django.urls import reverse
 from django.urls import path
 from django.http import JsonResponse
-from django.db.models import Q, F
+from django.db.models import Case, Q, F, When
 from django.utils.translation import gettext_lazy as _
 from django.contrib.auth import get_user_model
 from django.contrib.admin import DateFieldListFilter
+from django.contrib.admin.views.main import ORDER_VAR, ChangeList
 from django.http import HttpResponse
 from django.utils import timezone
 from django.templatetags.static import static
-import csv
 import calendar
-from .models import ParentComment, AssistantComment
+from .exports import EXPORT_CHUNK_SIZE, available_formats, get_exporter
+from .comments import campus_choices_for_comments
+from .export_jobs import enqueue_export
+from .imports import ImportFileError, import_enrollments
+from .search import search_ids
+from .models import Comment, ParentComment, AssistantComment, ExportJob, SlowQuery
+from django.contrib import messages
+from django.contrib.admin import helpers
+from django.http import FileResponse, Http404, HttpResponseNotAllowed
+from django.shortcuts import get_object_or_404, redirect
+from django.utils.html import format_html
+from django.core.exceptions import PermissionDenied
+from django.template.response import TemplateResponse
+import os
+import re
+import secrets
+from datetime import timedelta
+from .storage import private_storage, purge_older_than
+
+# 暂存名单的 token：只能是 imports/ 下我们自己生成的文件名（不含路径分隔符 / ..）
+IMPORT_TOKEN_RE = re.compile(r"imports/[0-9a-f]{16}-[\w.-]+")
+
+class FullTextSearchMixin:
+    """
+    后台搜索框走全文索引（portal/search.py），不再对 search_fields 做 icontains 扫描；
+    search_fields 只用来显示搜索框
+    - 结果按相关度排序；点了列头排序（?o=）时按列头
+    - 命中最多 SEARCH_MAX_RESULTS 条，超出时提示只显示了前 N 条
+    """
+    search_kind = None
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        ids, timed_out, truncated = search_ids(search_term, self.search_kind)
+        if timed_out:
+            messages.warning(request, "搜索超时，请换更具体的关键词。")
+        elif truncated:
+            messages.warning(request, f"匹配超过 {len(ids)} 条，只显示相关度最高的 {len(ids)} 条，"
+                                      f"请换更具体的关键词或加筛选。")
+        queryset = queryset.filter(pk__in=ids)
+        if ids and ORDER_VAR not in request.GET:
+            # ChangeList 先排序后搜索：这里换成相关度顺序
+            queryset = queryset.order_by(Case(*[When(pk=pk, then=i) for i, pk in enumerate(ids)]))
+        return queryset, False
+
+
+# —— 各模型 __str__ 会访问的外键 ——
+# 下拉选项 / 筛选项 / 自动补全 / inline 都按这张表 select_related，页面查询数不随行数增长
+STR_RELATED = {
+    Semester: ("campus",),
+    Course: ("campus",),
+    CourseSlot: ("course", "semester"),
+    SubGroup: ("course_slot__course", "course_slot__semester"),
+    Student: ("parent",),
+    Enrollment: ("student", "parent", "course__campus", "course_slot"),
+    ClassNotice: ("course_slot__course", "course_slot__semester", "sub_group"),
+    LearningResource: ("sub_group__course_slot__course", "sub_group__course_slot__semester"),
+    Comment: ("user", "sub_group__course_slot__course", "sub_group__course_slot__semester"),
+}
+
+
+def with_str_related(qs):
+    related = STR_RELATED.get(qs.model._meta.concrete_model)
+    return qs.select_related(*related) if related else qs
+
+
+def _str_choices(field, ordering, **filters):
+    qs = with_str_related(field.related_model._default_manager.filter(**filters))
+    if ordering:
+        qs = qs.order_by(*ordering)
+    return [(obj.pk, str(obj)) for obj in qs]
+
+
+def slot_hours_label(slot):
+    """'Tue 16:00-18:00'：只用时段本表字段的短标签（weekday 1=Mon）"""
+    if not slot:
+        return "-"
+    return f"{calendar.day_abbr[(slot.weekday - 1) % 7]} {slot.start_time:%H:%M}-{slot.end_time:%H:%M}"
+
+
+class StrRelatedFieldListFilter(admin.RelatedFieldListFilter):
+    """外键筛选：选项一次查完（默认实现每个选项的 __str__ 再各查一次外键）"""
+
+    def field_choices(self, field, request, model_admin):
+        return _str_choices(field, self.field_admin_ordering(field, request, model_admin))
+
+
+class StrRelatedOnlyFieldListFilter(admin.RelatedOnlyFieldListFilter):
+    """同上，只列出当前数据里出现过的值"""
+
+    def field_choices(self, field, request, model_admin):
+        pk_qs = (model_admin.get_queryset(request).distinct()
+                 .values_list("%s__pk" % self.field_path, flat=True))
+        return _str_choices(field, self.field_admin_ordering(field, request, model_admin), pk__in=pk_qs)
+
+
+class StrRelatedChangeList(ChangeList):
+    """
+    ChangeList 看到 queryset 已有 select_related（with_str_related 加的）就不会再套 list_select_related：
+    在列表页把 get_list_select_related 的结果并进来，编辑页 / 自动补全 / 批量操作不多 join
+    """
+
+    def get_queryset(self, request, exclude_parameters=None):
+        qs = super().get_queryset(request, exclude_parameters)
+        if qs.query.select_related and isinstance(self.list_select_related, (list, tuple)):
+            qs = qs.select_related(*self.list_select_related)
+        return qs
+
+
+class StrRelatedMixin:
+    """
+    ModelAdmin / Inline 共用：
+    - get_queryset 带上本模型 __str__ 需要的外键（编辑页标题、自动补全结果）
+    - 列表页另外并上 list_select_related（StrRelatedChangeList）
+    - 外键下拉的 queryset 带上选项 __str__ 需要的外键
+    """
+
+    def get_queryset(self, request):
+        return with_str_related(super().get_queryset(request))
+
+    def get_changelist(self, request, **kwargs):
+        return StrRelatedChangeList
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        formfield = super().formfield_for_foreignkey(db_field, request, **kwargs)
+        if formfield is not None and hasattr(formfield, "queryset"):
+            formfield.queryset = with_str_related(formfield.queryset)
+        return formfield
+
+
+class SharedChoicesInlineMixin(StrRelatedMixin):
+    """inline 的每一行都会重新渲染下拉：选项在构建表单类时求值一次，各行共用"""
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        formfield = super().formfield_for_foreignkey(db_field, request, **kwargs)
+        if formfield is not None and hasattr(formfield, "queryset"):
+            formfield.choices = [(getattr(value, "value", value), label) for value, label in formfield.choices]
+        return formfield
+
 # —— 过滤：周次（1~10）——
 class WeekNoListFilter(admin.SimpleListFilter):
     title = "Week"
@@ -34,7 +173,7 @@ class CampusAdmin(admin.ModelAdmin):
 
 @admin.register(Semester)
 class SemesterAdmin(admin.ModelAdmin):
-    list_display = ("id","name","campus","start_date","week_count","is_active")
+    list_display = ("id","name","campus","start_date","week_count","holiday_weeks","is_active")
     list_filter = ("campus","is_active")
 
 @admin.register(Course)
@@ -43,16 +182,17 @@ class CourseAdmin(admin.ModelAdmin):
     list_filter = ("campus","is_active")
 
 @admin.register(CourseSlot)
-class SlotAdmin(admin.ModelAdmin):
+class SlotAdmin(StrRelatedMixin, admin.ModelAdmin):
     list_display = ("id","course","semester","weekday","start_time","end_time")
-    list_filter = ("semester","course","weekday")
+    list_select_related = ("course__campus", "semester__campus")
+    list_filter = (("semester", StrRelatedFieldListFilter), ("course", StrRelatedFieldListFilter), "weekday")
     # 关键：给自动补全提供可检索字段
     search_fields = (
         "course__title",            # 课程名
         "course__campus__name",     # 校区
         "semester__name",           # 学期名
     )
-class EnrollmentInline(admin.TabularInline):
+class EnrollmentInline(SharedChoicesInlineMixin, admin.TabularInline):
     model = Enrollment
     fk_name = "sub_group"      # 用 Enrollment.sub_group 关联
     extra = 0                  # 不额外多显示空行
@@ -68,16 +208,17 @@ class EnrollmentInline(admin.TabularInline):
 
     # 如果想显示 course_slot 的可读文本，可以定义个方法
     def enrollment_course_slot(self, obj):
-        slot = obj.course_slot
-        if not slot:
-            return "-"
-        return f"{slot.get_weekday_display()} {slot.start_time:%H:%M}-{slot.end_time:%H:%M}"
+        return slot_hours_label(obj.course_slot)
     enrollment_course_slot.short_description = "时段"
 
+    def get_queryset(self, request):
+        # 只读列 student / course 显示的是它们的 __str__
+        return super().get_queryset(request).select_related("student__parent", "course__campus")
+
 @admin.register(SubGroup)
-class SubGroupAdmin(admin.ModelAdmin):
+class SubGroupAdmin(StrRelatedMixin, admin.ModelAdmin):
     list_display = ("id","name","course_slot")
-    list_filter = ("course_slot",)
+    list_filter = (("course_slot", StrRelatedFieldListFilter),)
     # 关键：给自动补全提供可检索字段
     search_fields = (
         "name",                                 # 子班名称
@@ -91,7 +232,7 @@ class SubGroupAdmin(admin.ModelAdmin):
     student_count.short_description = "人数"
 
 @admin.register(Student)
-class StudentAdmin(admin.ModelAdmin):
+class StudentAdmin(StrRelatedMixin, admin.ModelAdmin):
     list_display = ("id","full_name","parent","birth_date","is_active")
     list_filter = ("is_active",)
     search_fields = ("full_name","parent__username")
@@ -110,6 +251,7 @@ class EnrollmentAdminForm(forms.ModelForm):
 
         # 仅显示家长
         self.fields["parent"].queryset = User.objects.filter(role="PARENT", is_active=True)
+        self.fields["course"].queryset = with_str_related(self.fields["course"].queryset)
 
         # ------- 关键：把 GET 里的初始值也算进去 -------
         data = self.data if self.is_bound else (self.request.GET if self.request else None)
@@ -118,14 +260,15 @@ class EnrollmentAdminForm(forms.ModelForm):
         # —— Student 依赖 Parent ——
         parent_id = data.get("parent") if data and data.get("parent") else getattr(self.instance, "parent_id", None)
         if parent_id:
-            self.fields["student"].queryset = Student.objects.filter(parent_id=parent_id, is_active=True).order_by("full_name")
+            self.fields["student"].queryset = with_str_related(
+                Student.objects.filter(parent_id=parent_id, is_active=True).order_by("full_name"))
         else:
             self.fields["student"].queryset = Student.objects.none()
 
         # —— Semester 依赖 Course ——
         course_id = data.get("course") if data and data.get("course") else getattr(self.instance, "course_id", None)
         if course_id:
-            self.fields["semester"].queryset = (
+            self.fields["semester"].queryset = with_str_related(
                 Semester.objects.filter(courseslot__course_id=course_id)
                 .distinct().order_by("-start_date")
             )
@@ -135,7 +278,7 @@ class EnrollmentAdminForm(forms.ModelForm):
         # —— CourseSlot 依赖 Course + Semester ——
         sem_id = data.get("semester") if data and data.get("semester") else getattr(self.instance, "semester_id", None)
         if course_id and sem_id:
-            self.fields["course_slot"].queryset = (
+            self.fields["course_slot"].queryset = with_str_related(
                 CourseSlot.objects.filter(course_id=course_id, semester_id=sem_id)
                 .order_by("weekday", "start_time")
             )
@@ -145,7 +288,7 @@ class EnrollmentAdminForm(forms.ModelForm):
         # —— SubGroup 依赖 CourseSlot ——
         slot_id = data.get("course_slot") if data and data.get("course_slot") else getattr(self.instance, "course_slot_id", None)
         if slot_id:
-            self.fields["sub_group"].queryset = SubGroup.objects.filter(course_slot_id=slot_id)
+            self.fields["sub_group"].queryset = with_str_related(SubGroup.objects.filter(course_slot_id=slot_id))
         else:
             self.fields["sub_group"].queryset = SubGroup.objects.none()
 
@@ -159,14 +302,37 @@ class EnrollmentAdminForm(forms.ModelForm):
 
 # ========== Admin ==========
 @admin.register(Enrollment)
-class EnrollmentAdmin(admin.ModelAdmin):
+class EnrollmentAdmin(StrRelatedMixin, admin.ModelAdmin):
     form = EnrollmentAdminForm
 
-    list_display = ("id", "student", "parent", "course", "semester", "course_slot", "sub_group",
-                    "status", "paid_status", "created_at")
-    list_filter  = ("semester", "course", "course_slot", "status", "paid_status")
+    # 时段 / 细分班 用只取本表字段的短标签（课程、学期已经单独成列）
+    list_display = ("id", "student", "parent", "course", "semester", "slot_label", "sub_group_label",
+                    "status", "paid_status", "attendance_counts", "attendance_rate", "created_at")
+    list_select_related = ("student__parent", "parent", "course__campus", "semester__campus",
+                           "course_slot", "sub_group", "attendance_summary")
+    list_filter  = (("semester", StrRelatedFieldListFilter), ("course", StrRelatedFieldListFilter),
+                    ("course_slot", StrRelatedFieldListFilter), "status", "paid_status")
     search_fields = ("student__full_name", "parent__username")
 
+    @admin.display(description="Course slot", ordering="course_slot__weekday")
+    def slot_label(self, obj):
+        return slot_hours_label(obj.course_slot)
+
+    @admin.display(description="Sub group", ordering="sub_group__name")
+    def sub_group_label(self, obj):
+        return obj.sub_group.name if obj.sub_group_id else "-"
+
+    # 出勤次数来自汇总表（随列表一起 JOIN 出来）；还没点过名的报名没有汇总行
+    @admin.display(description="P / A / L")
+    def attendance_counts(self, obj):
+        summary = getattr(obj, "attendance_summary", None)
+        return f"{summary.present} / {summary.absent} / {summary.late}" if summary else "-"
+
+    @admin.display(description="Attendance", ordering="attendance_summary__present")
+    def attendance_rate(self, obj):
+        summary = getattr(obj, "attendance_summary", None)
+        return f"{summary.rate}%" if summary and summary.rate is not None else "-"
+
     # 关键：把 request 传给表单（便于初始过滤）
     def get_form(self, request, obj=None, **kwargs):
         Form = super().get_form(request, obj, **kwargs)
@@ -189,9 +355,49 @@ class EnrollmentAdmin(admin.ModelAdmin):
             path("related/semesters/",  self.admin_site.admin_view(self.related_semesters),  name="enroll_related_semesters"),
             path("related/slots/",      self.admin_site.admin_view(self.related_slots),      name="enroll_related_slots"),
             path("related/subgroups/",  self.admin_site.admin_view(self.related_subgroups),  name="enroll_related_subgroups"),
+            path("import/",             self.admin_site.admin_view(self.import_view),        name="portal_enrollment_import"),
         ]
         return my + urls
 
+    # ========== 开学批量导入（CSV / XLSX） ==========
+    IMPORT_UPLOAD_MAX_AGE = timedelta(hours=24)
+    change_list_template = "admin/portal/enrollment/change_list.html"
+
+    def import_view(self, request):
+        """
+        第一步：上传 → 只校验，显示报告（文件先存进私有存储，不在公开的 /media 下）
+        第二步：确认 → 用同一份文件真正写入，写完删除暂存文件
+        只预览、没确认的暂存文件超过 IMPORT_UPLOAD_MAX_AGE 后在下一次导入时清掉
+        """
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        context = {**self.admin_site.each_context(request), "opts": self.model._meta,
+                   "title": "批量导入报名", "report": None, "token": ""}
+        if request.method == "POST":
+            purge_older_than("imports", self.IMPORT_UPLOAD_MAX_AGE)
+            upload, token = request.FILES.get("file"), request.POST.get("token", "")
+            commit = bool(token) and "confirm" in request.POST
+            if upload is not None:
+                name = re.sub(r"\.{2,}", ".", re.sub(r"[^\w.-]", "_", os.path.basename(upload.name)))[-100:]
+                token = private_storage.save(f"imports/{secrets.token_hex(8)}-{name}", upload)
+            if not IMPORT_TOKEN_RE.fullmatch(token) or ".." in token or not private_storage.exists(token):
+                self.message_user(request, "请先选择要上传的文件", messages.ERROR)
+                return redirect("admin:portal_enrollment_import")
+            try:
+                with private_storage.open(token, "rb") as fp:
+                    report = import_enrollments(fp, token, commit=commit,
+                                                allow_errors="skip_errors" in request.POST)
+            except ImportFileError as exc:
+                private_storage.delete(token)
+                self.message_user(request, str(exc), messages.ERROR)
+                return redirect("admin:portal_enrollment_import")
+            if report.committed:
+                private_storage.delete(token)
+                self.message_user(request, f"导入完成：{report.summary()}", messages.SUCCESS)
+                return redirect("admin:portal_enrollment_changelist")
+            context.update(report=report, token=token)
+        return TemplateResponse(request, "admin/portal/enrollment/import.html", context)
+
     def related_students(self, request):
         pid = request.GET.get("parent_id")
         qs = Student.objects.filter(parent_id=pid, is_active=True).order_by("full_name") if pid else Student.objects.none()
@@ -223,7 +429,7 @@ class EnrollmentAdmin(admin.ModelAdmin):
         js = (static("portal/admin_enroll.js"),)
 
 @admin.register(Attendance)
-class AttendanceAdmin(admin.ModelAdmin):
+class AttendanceAdmin(StrRelatedMixin, admin.ModelAdmin):
     """
     出勤列表（带搜索、筛选、导出）
     """
@@ -240,9 +446,10 @@ class AttendanceAdmin(admin.ModelAdmin):
     )
     list_select_related = (
         "enrollment", "enrollment__student", "enrollment__parent",
-        "enrollment__course", "enrollment__course__campus",
+        "enrollment__course", "enrollment__course__campus", "enrollment__course_slot",
         "course_slot", "course_slot__course", "course_slot__semester",
-        "sub_group", "marked_by",
+        "sub_group", "sub_group__course_slot__course", "sub_group__course_slot__semester",
+        "marked_by",
     )
 
     # —— 显示搜索框：可搜 校区/课程/学生/家长/子班/学期/时段 —— 
@@ -263,10 +470,10 @@ class AttendanceAdmin(admin.ModelAdmin):
     # —— 筛选器：校区/课程/学期/时段/子班/周次/日期/状态/标记人 —— 
     list_filter = (
         ("enrollment__course__campus", admin.RelatedOnlyFieldListFilter),
-        ("enrollment__course", admin.RelatedOnlyFieldListFilter),
-        ("course_slot__semester", admin.RelatedOnlyFieldListFilter),
-        ("course_slot", admin.RelatedOnlyFieldListFilter),
-        ("sub_group", admin.RelatedOnlyFieldListFilter),
+        ("enrollment__course", StrRelatedOnlyFieldListFilter),
+        ("course_slot__semester", StrRelatedOnlyFieldListFilter),
+        ("course_slot", StrRelatedOnlyFieldListFilter),
+        ("sub_group", StrRelatedOnlyFieldListFilter),
         WeekNoListFilter,
         ("date", DateFieldListFilter),
         "status",
@@ -275,7 +482,7 @@ class AttendanceAdmin(admin.ModelAdmin):
     date_hierarchy = "date"
 
     # —— 顶部/底部都显示批量操作；支持“跨页全选”导出 —— 
-    actions = ["export_selected_csv"]
+    actions = ["export_selected_csv", "export_selected_xlsx", "export_selected_columnar"]
     actions_on_top = True
     actions_on_bottom = True
 
@@ -293,121 +500,105 @@ class AttendanceAdmin(admin.ModelAdmin):
             ),
         ]
         return custom + urls
+
+    def changelist_view(self, request, extra_context=None):
+        # 工具栏上每种导出格式一个按钮
+        extra_context = {"export_formats": available_formats(), **(extra_context or {})}
+        return super().changelist_view(request, extra_context=extra_context)
     # ---- 工具：将 weekday(1~7 或字符串) 转成英文星期缩写 ----
-    def _weekday_label(self, slot):
+    def _weekday_label(self, weekday):
         """返回 'Mon' / 'Tue' 等；如果不是数字就直接转字符串。"""
-        w = getattr(slot, "weekday", None)
-        if w is None:
+        if weekday is None:
             return ""
         try:
-            i = int(w)              # 你的模型里 Mon=1 ~ Sun=7
+            i = int(weekday)        # 你的模型里 Mon=1 ~ Sun=7
             return calendar.day_abbr[(i - 1) % 7]  # 'Mon' 'Tue' ...
         except Exception:
-            return str(w)
+            return str(weekday)
 
-    def _slot_text(self, slot):
+    def _slot_text(self, weekday, start_time, end_time):
         """组合成 'Tue 18:00-19:00' 这样的时段字符串。"""
-        if not slot:
+        if weekday is None:
             return ""
-        wd = self._weekday_label(slot)
-        start = slot.start_time.strftime("%H:%M") if slot.start_time else ""
-        end   = slot.end_time.strftime("%H:%M") if slot.end_time else ""
+        wd = self._weekday_label(weekday)
+        start = start_time.strftime("%H:%M") if start_time else ""
+        end   = end_time.strftime("%H:%M") if end_time else ""
         return f"{wd} {start}-{end}"
     
+    # —— 导出列：直接取 values_list 元组，不实例化模型 ——
+    EXPORT_HEADER = [
+        "Campus", "Course", "Semester", "Time slot",
+        "Sub group", "Student", "Parent",
+        "Week", "Date", "Status", "Paid",
+        "Marked by", "Created at",
+    ]
+    EXPORT_FIELDS = (
+        "enrollment__course__campus__name", "enrollment__course__title",
+        "course_slot__semester__name",
+        "course_slot__weekday", "course_slot__start_time", "course_slot__end_time",
+        "sub_group__name", "enrollment__student__full_name", "enrollment__parent__username",
+        "week_no", "date", "status", "enrollment__paid_status",
+        "marked_by__username", "created_at",
+    )
+
+    def _export_rows(self, qs):
+        """表头 + 逐行生成；.iterator() 分块读取，内存不随行数增长"""
+        yield self.EXPORT_HEADER
+        qs = (qs.order_by("date", "course_slot_id", "sub_group_id", "enrollment_id")
+                .values_list(*self.EXPORT_FIELDS))
+        for (campus, course, semester, weekday, start, end,
+             subgroup, student, parent, week, date, status, paid,
+             marked_by, created) in qs.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            # 时间段：周几 + 起止
+            slot_txt = self._slot_text(weekday, start, end)
+            yield [
+                campus or "", course or "", semester or "", slot_txt,
+                subgroup or "", student or "", parent or "",
+                week, date.strftime("%Y-%m-%d") if date else "", status, paid or "",
+                marked_by or "", timezone.localtime(created).strftime("%Y-%m-%d %H:%M"),
+            ]
+
     def export_filtered_csv(self, request):
         """
         导出“当前筛选/搜索条件”的所有记录（无需选择）
+        数据量可能很大（全年、全部校区）：只登记后台任务，由 run_export_worker 生成文件
+        只接受 POST（带 CSRF，工具栏上是表单按钮）：筛选条件在 query string 里原样交给 ChangeList，
+        表单字段 _format=xlsx|ndjson|... 选格式（默认 csv）
         """
-        # 用 Admin 的 ChangeList 拿到当前过滤后的 queryset
-        cl = self.get_changelist_instance(request)
-        qs = cl.get_queryset(request)
-
-        filename = timezone.now().strftime("attendance_%Y%m%d_%H%M%S.csv")
-        resp = HttpResponse(content_type="text/csv; charset=utf-8")
-        resp["Content-Disposition"] = f'attachment; filename="{filename}"'
-        writer = csv.writer(resp)
-        writer.writerow([
-            "Campus", "Course", "Semester", "Time slot",
-            "Sub group", "Student", "Parent",
-            "Week", "Date", "Status", "Paid",
-            "Marked by", "Created at",
-        ])
-
-        qs = qs.select_related(
-            "enrollment", "enrollment__student", "enrollment__parent",
-            "enrollment__course", "enrollment__course__campus",
-            "course_slot", "course_slot__semester",
-            "sub_group", "marked_by"
-        ).order_by("date", "course_slot_id", "sub_group_id", "enrollment_id")
-
-        for a in qs:
-            campus = a.enrollment.course.campus.name if a.enrollment and a.enrollment.course else ""
-            course = a.enrollment.course.title if a.enrollment and a.enrollment.course else ""
-            semester = a.course_slot.semester.name if a.course_slot and a.course_slot.semester else ""
-            # 时间段：周几 + 起止
-            slot_txt = self._slot_text(a.course_slot)
-            subgroup = a.sub_group.name if a.sub_group else ""
-
-            student = a.enrollment.student.full_name if a.enrollment and a.enrollment.student else ""
-            parent = a.enrollment.parent.username if a.enrollment and a.enrollment.parent else ""
-
-            week = a.week_no
-            date = a.date.strftime("%Y-%m-%d") if a.date else ""
-            status = a.status
-            paid = a.enrollment.paid_status if a.enrollment else ""
-
-            marked_by = a.marked_by.username if a.marked_by else ""
-            created = timezone.localtime(a.created_at).strftime("%Y-%m-%d %H:%M")
-
-            writer.writerow([
-                campus, course, semester, slot_txt,
-                subgroup, student, parent,
-                week, date, status, paid,
-                marked_by, created
-            ])
-        return resp
+        if request.method != "POST":
+            return HttpResponseNotAllowed(["POST"])
+        query = request.GET.copy()
+        query.pop("_format", None)
+        fmt = request.POST.get("_format") or "csv"
+        if get_exporter(fmt) is None:
+            self.message_user(request, f"不支持的导出格式：{fmt}", messages.ERROR)
+            return redirect(f"{reverse('admin:portal_attendance_changelist')}?{query.urlencode()}")
+        return self._enqueue_export(request, query.urlencode(), fmt)
+
+    def _enqueue_export(self, request, query, fmt="csv"):
+        job = enqueue_export("attendance_admin", {"query": query, "format": fmt}, request.user)
+        self.message_user(request, f"已加入导出队列（Export#{job.pk}），生成后在此页下载。", messages.SUCCESS)
+        return redirect("admin:portal_exportjob_changelist")
+
      # ========== 批量操作：导出所选（支持跨页“选中全部 X 条”） ==========
+    def _export_selected(self, request, queryset, fmt):
+        # 跨页全选 = 当前筛选的全部记录 → 走后台任务；只勾了本页几行就直接流式返回
+        if request.POST.get(helpers.ACTION_CHECKBOX_NAME) and request.POST.get("select_across") == "1":
+            return self._enqueue_export(request, request.GET.urlencode(), fmt)
+        basename = timezone.now().strftime("attendance_selected_%Y%m%d_%H%M%S")
+        return get_exporter(fmt).response(self._export_rows(queryset), basename)
+
     @admin.action(description="导出所选出勤为 CSV")
     def export_selected_csv(self, request, queryset):
-        filename = timezone.now().strftime("attendance_selected_%Y%m%d_%H%M%S.csv")
-        resp = HttpResponse(content_type="text/csv; charset=utf-8")
-        resp["Content-Disposition"] = f'attachment; filename="{filename}"'
-        writer = csv.writer(resp)
-        writer.writerow([
-            "Campus", "Course", "Semester", "Time slot",
-            "Sub group", "Student", "Parent",
-            "Week", "Date", "Status", "Paid",
-            "Marked by", "Created at",
-        ])
-
-        qs = queryset.select_related(
-            "enrollment", "enrollment__student", "enrollment__parent",
-            "enrollment__course", "enrollment__course__campus",
-            "course_slot", "course_slot__semester",
-            "sub_group", "marked_by"
-        ).order_by("date", "course_slot_id", "sub_group_id", "enrollment_id")
-
-        for a in qs:
-            campus = a.enrollment.course.campus.name if a.enrollment and a.enrollment.course else ""
-            course = a.enrollment.course.title if a.enrollment and a.enrollment.course else ""
-            semester = a.course_slot.semester.name if a.course_slot and a.course_slot.semester else ""
-            slot_txt = self._slot_text(a.course_slot)
-            subgroup = a.sub_group.name if a.sub_group else ""
-            student = a.enrollment.student.full_name if a.enrollment and a.enrollment.student else ""
-            parent = a.enrollment.parent.username if a.enrollment and a.enrollment.parent else ""
-            week = a.week_no
-            date = a.date.strftime("%Y-%m-%d") if a.date else ""
-            status = a.status
-            paid = a.enrollment.paid_status if a.enrollment else ""
-            marked_by = a.marked_by.username if a.marked_by else ""
-            created = timezone.localtime(a.created_at).strftime("%Y-%m-%d %H:%M")
-            writer.writerow([
-                campus, course, semester, slot_txt,
-                subgroup, student, parent,
-                week, date, status, paid,
-                marked_by, created
-            ])
-        return resp
+        return self._export_selected(request, queryset, "csv")
+
+    @admin.action(description="导出所选出勤为 Excel (XLSX)")
+    def export_selected_xlsx(self, request, queryset):
+        return self._export_selected(request, queryset, "xlsx")
+
+    @admin.action(description="导出所选出勤为列式格式（Arrow，无 pyarrow 时为 NDJSON）")
+    def export_selected_columnar(self, request, queryset):
+        return self._export_selected(request, queryset, "columnar")
 # --- 修复：公告表单按 course_slot 过滤 sub_group，并做一致性校验 ---
 from django import forms
 
@@ -426,13 +617,13 @@ class ClassNoticeAdminForm(forms.ModelForm):
         if self.is_bound:
             slot_id = self.data.get("course_slot") or self.data.get("course_slot_id")
             if slot_id:
-                self.fields["sub_group"].queryset = SubGroup.objects.filter(course_slot_id=slot_id)
+                self.fields["sub_group"].queryset = with_str_related(SubGroup.objects.filter(course_slot_id=slot_id))
 
         # 编辑已有对象：根据实例的 course_slot 过滤
         elif self.instance and self.instance.pk and self.instance.course_slot_id:
-            self.fields["sub_group"].queryset = SubGroup.objects.filter(
+            self.fields["sub_group"].queryset = with_str_related(SubGroup.objects.filter(
                 course_slot_id=self.instance.course_slot_id
-            )
+            ))
 
     def clean(self):
         cleaned = super().clean()
@@ -444,15 +635,18 @@ class ClassNoticeAdminForm(forms.ModelForm):
         return cleaned
     
 @admin.register(ClassNotice)
-class ClassNoticeAdmin(admin.ModelAdmin):
+class ClassNoticeAdmin(FullTextSearchMixin, StrRelatedMixin, admin.ModelAdmin):
     form = ClassNoticeAdminForm
     list_display  = ("id", "title", "course_slot", "sub_group",
                      "visible_to", "is_pinned", "created_by", "created_at")
-    list_filter   = (("course_slot__semester", admin.RelatedOnlyFieldListFilter),
-                     ("course_slot", admin.RelatedOnlyFieldListFilter),
-                     ("sub_group", admin.RelatedOnlyFieldListFilter),
+    list_select_related = ("course_slot__course", "course_slot__semester",
+                           "sub_group__course_slot__course", "sub_group__course_slot__semester", "created_by")
+    list_filter   = (("course_slot__semester", StrRelatedOnlyFieldListFilter),
+                     ("course_slot", StrRelatedOnlyFieldListFilter),
+                     ("sub_group", StrRelatedOnlyFieldListFilter),
                      "visible_to", "is_pinned")
     search_fields = ("title", "content", "course_slot__course__title", "sub_group__name")
+    search_kind = "notice"
     autocomplete_fields = ("course_slot",)
     readonly_fields   = ("created_by",)
     ordering = ("-is_pinned", "-id")
@@ -481,7 +675,7 @@ class ClassNoticeAdmin(admin.ModelAdmin):
         slot_id = request.GET.get("slot_id")
         data = []
         if slot_id:
-            qs = SubGroup.objects.filter(course_slot_id=slot_id).order_by("name")
+            qs = with_str_related(SubGroup.objects.filter(course_slot_id=slot_id)).order_by("name")
             data = [{"id": g.id, "label": str(g)} for g in qs]
         return JsonResponse({"results": data})
 
@@ -509,18 +703,20 @@ class LearningResourceItemInline(admin.TabularInline):
     readonly_fields = ()       # 这里也可以放预览图等
 
 @admin.register(LearningResource)
-class LearningResourceAdmin(admin.ModelAdmin):
+class LearningResourceAdmin(FullTextSearchMixin, StrRelatedMixin, admin.ModelAdmin):
     list_display  = (
         "id", "title", "sub_group",
         "is_active", "created_by", "created_at",
     )
+    list_select_related = ("sub_group__course_slot__course", "sub_group__course_slot__semester", "created_by")
     list_filter   = (
-        ("sub_group__course_slot__semester", admin.RelatedOnlyFieldListFilter),
-        ("sub_group__course_slot", admin.RelatedOnlyFieldListFilter),
-        ("sub_group", admin.RelatedOnlyFieldListFilter),
+        ("sub_group__course_slot__semester", StrRelatedOnlyFieldListFilter),
+        ("sub_group__course_slot", StrRelatedOnlyFieldListFilter),
+        ("sub_group", StrRelatedOnlyFieldListFilter),
         "is_active",
     )
     search_fields = ("title", "description", "sub_group__name")
+    search_kind = "resource"
     autocomplete_fields = ("sub_group",)
     readonly_fields     = ("created_by",)
     fieldsets = (
@@ -546,9 +742,8 @@ class CampusFilter(admin.SimpleListFilter):
     parameter_name = "campus"
 
     def lookups(self, request, model_admin):
-        qs = model_admin.model.objects.all()
-        campuses = set(q.sub_group.course_slot.course.campus for q in qs)
-        return [(c.id, c.name) for c in campuses]
+        # 每个校区一次 EXISTS 探测（校区很少），结果缓存；评论增删时失效（见 signals）
+        return campus_choices_for_comments(getattr(model_admin, "comment_role", None))
 
     def queryset(self, request, queryset):
         if self.value():
@@ -558,7 +753,7 @@ class CampusFilter(admin.SimpleListFilter):
         return queryset
 
 @admin.register(ParentComment)
-class ParentCommentAdmin(admin.ModelAdmin):
+class ParentCommentAdmin(FullTextSearchMixin, StrRelatedMixin, admin.ModelAdmin):
     list_display = (
         "id", "user", "enrollment", "sub_group", "content", "created_at"
     )
@@ -573,13 +768,21 @@ class ParentCommentAdmin(admin.ModelAdmin):
         "content",
     )
     readonly_fields = ("created_at",)
+    comment_role = "PARENT"
+    search_kind = "parent_comment"
+    # enrollment / sub_group 的 __str__ 会连带访问 学生、课程(校区)、时段(课程/学期)
+    list_select_related = (
+        "user",
+        "enrollment__student", "enrollment__parent", "enrollment__course__campus", "enrollment__course_slot",
+        "sub_group__course_slot__course", "sub_group__course_slot__semester",
+    )
 
     def get_queryset(self, request):
-        return super().get_queryset(request).filter(role="PARENT")
+        return super().get_queryset(request).filter(role=self.comment_role)
 
 
 @admin.register(AssistantComment)
-class AssistantCommentAdmin(admin.ModelAdmin):
+class AssistantCommentAdmin(FullTextSearchMixin, StrRelatedMixin, admin.ModelAdmin):
     list_display = (
         "id", "user", "sub_group", "content", "created_at"
     )
@@ -593,12 +796,84 @@ class AssistantCommentAdmin(admin.ModelAdmin):
         "content",
     )
     readonly_fields = ("created_at",)
+    comment_role = "ASSISTANT"
+    search_kind = "assistant_comment"
+    list_select_related = (
+        "user",
+        "sub_group__course_slot__course", "sub_group__course_slot__semester",
+    )
 
     def get_queryset(self, request):
-        return super().get_queryset(request).filter(role="ASSISTANT")
+        return super().get_queryset(request).filter(role=self.comment_role)
 
 
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    """后台任务（导出 / 公告收件箱扇出等）：只读，看状态、下载导出结果"""
+    list_display = ("id", "kind", "status", "row_count", "created_by", "created_at", "finished_at", "download")
+    list_filter = ("status", "kind")
+    list_select_related = ("created_by",)
+    readonly_fields = ("kind", "params", "status", "filename", "row_count", "error", "worker", "attempts",
+                       "created_by", "created_at", "started_at", "finished_at", "download")
+    exclude = ("file",)
 
+    def has_add_permission(self, request):
+        return False
 
+    def has_change_permission(self, request, obj=None):
+        return False
 
-    
+    @admin.display(description="File")
+    def download(self, obj):
+        if obj.status != ExportJob.Status.DONE or not obj.file:
+            return obj.error or "-"
+        url = reverse("admin:portal_exportjob_download", args=[obj.pk])
+        return format_html('<a href="{}">{}</a>', url, obj.filename)
+
+    def get_urls(self):
+        urls = super().get_urls()
+        my = [
+            path("<int:job_id>/download/", self.admin_site.admin_view(self.download_view),
+                 name="portal_exportjob_download"),
+        ]
+        return my + urls
+
+    def download_view(self, request, job_id):
+        # 经后台鉴权再读文件，不直接暴露 MEDIA_URL 上的路径
+        job = get_object_or_404(ExportJob, pk=job_id, status=ExportJob.Status.DONE)
+        if not self.has_view_permission(request, job) or not job.file:
+            raise Http404
+        return FileResponse(job.file.open("rb"), as_attachment=True, filename=job.filename)
+
+
+@admin.register(SlowQuery)
+class SlowQueryAdmin(admin.ModelAdmin):
+    """慢查询（portal/slowlog.py 写入）：只读；按最大耗时排序，看调用位置和执行计划"""
+    list_display = ("call_site", "url_name", "count", "avg_ms_display", "max_ms_display", "explained", "last_seen")
+    list_filter = ("url_name",)
+    search_fields = ("call_site", "sql")
+    readonly_fields = ("fingerprint", "call_site", "url_name", "count", "total_ms", "max_ms", "last_ms",
+                       "sql", "params", "explain_plan", "explained_at", "first_seen", "last_seen")
+    exclude = ("explain",)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    @admin.display(description="Avg ms", ordering="total_ms")
+    def avg_ms_display(self, obj):
+        return f"{obj.avg_ms:.1f}"
+
+    @admin.display(description="Max ms", ordering="max_ms")
+    def max_ms_display(self, obj):
+        return f"{obj.max_ms:.1f}"
+
+    @admin.display(description="EXPLAIN", boolean=True)
+    def explained(self, obj):
+        return obj.explained_at is not None
+
+    @admin.display(description="Explain")
+    def explain_plan(self, obj):
+        return format_html("<pre>{}</pre>", obj.explain or "-")
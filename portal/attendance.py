@@ -0,0 +1,269 @@
+# portal/attendance.py
+"""
+出勤相关工具：
+- 集合式写入：一次读 + 一次 bulk_update + 一次 bulk_create，
+  查询次数与名单人数无关（替代逐人 get_or_create）
+- 签到矩阵缓存：按 (slot_id, subgroup_id) 缓存名单 + 出勤矩阵，
+  任何写入都 bump 该时段的版本号，旧 key 自然失效（读取是异步的，签到表接口是异步视图）
+- 出勤汇总：EnrollmentAttendanceSummary 按报名冗余存 出勤/缺勤/迟到 次数和每周状态，
+  写出勤时只刷新涉及的报名
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import FilteredRelation, Q
+from django.utils import timezone
+
+from .caching import NamespacedCache
+from .models import Attendance, CourseSlot, Enrollment, EnrollmentAttendanceSummary
+
+
+UPSERT_ATTEMPTS = 3
+
+
+def upsert_attendance(*, slot, sub_group_id, marks, user, date_for_week):
+    """
+    批量 Upsert 出勤记录（保持 (enrollment, course_slot, week_no, sub_group) 唯一语义）
+
+    marks:         {(enrollment_id, week_no): present(bool)}
+    date_for_week: week_no -> date
+    返回写入的格子数
+
+    select_for_update 锁不住还不存在的行：两个请求同时新建同一格时后提交的 INSERT 撞唯一约束，
+    此时回滚这次尝试、重新读（已能读到对方的行）再走 UPDATE，与原来 get_or_create 的重试一致
+    """
+    if not marks:
+        return 0
+
+    for attempt in range(1, UPSERT_ATTEMPTS + 1):
+        try:
+            with transaction.atomic():
+                return _upsert_once(slot, sub_group_id, marks, user, date_for_week)
+        except IntegrityError:
+            if attempt == UPSERT_ATTEMPTS:
+                raise
+
+
+def _locked_existing(slot, sub_group_id, enrollment_ids, weeks):
+    """已存在的记录 {(enrollment_id, week_no): Attendance}，加行锁（sub_group_id=None 即 IS NULL）"""
+    return {
+        (a.enrollment_id, a.week_no): a
+        for a in Attendance.objects.select_for_update().filter(
+            course_slot=slot,
+            sub_group_id=sub_group_id,
+            enrollment_id__in=enrollment_ids,
+            week_no__in=weeks,
+        )
+    }
+
+
+def _upsert_once(slot, sub_group_id, marks, user, date_for_week):
+    enrollment_ids = {eid for eid, _ in marks}
+    weeks = {wk for _, wk in marks}
+
+    # 1) 一次读出已存在的记录
+    existing = _locked_existing(slot, sub_group_id, enrollment_ids, weeks)
+
+    to_update, to_create = [], []
+    for (eid, wk), present in marks.items():
+        status = "PRESENT" if present else "ABSENT"
+        d = date_for_week(wk)
+        obj = existing.get((eid, wk))
+        if obj is None:
+            to_create.append(Attendance(
+                enrollment_id=eid,
+                course_slot_id=slot.id,
+                sub_group_id=sub_group_id,
+                week_no=wk,
+                date=d,
+                status=status,
+                marked_by_id=user.id,
+            ))
+        else:
+            obj.status = status
+            obj.date = d
+            obj.marked_by_id = user.id
+            to_update.append(obj)
+
+    # 2) 已有记录：一条 UPDATE ... CASE；新记录：一条多值 INSERT
+    if to_update:
+        Attendance.objects.bulk_update(to_update, ["status", "date", "marked_by"])
+    if to_create:
+        Attendance.objects.bulk_create(to_create)
+
+    # bulk_* 不发 signal：汇总在同一事务里刷新；矩阵缓存提交后才 bump，避免读到旧数据再写回
+    refresh_attendance_summaries(enrollment_ids)
+    transaction.on_commit(lambda: bump_matrix_version(slot.id))
+    return len(marks)
+
+
+# —— 出勤汇总 ——
+SUMMARY_FIELDS = ("present", "absent", "late", "weeks")
+# 同一周有多条记录（旧数据：带/不带细分班各一行）时，按 出勤 > 迟到 > 缺勤 取一条
+_STATUS_RANK = {"ABSENT": 0, "LATE": 1, "PRESENT": 2}
+
+
+def summarize_weeks(rows):
+    """[(week_no, status), ...] → {"present", "absent", "late", "weeks"}（按周去重后计数）"""
+    best = {}
+    for wk, status in rows:
+        if wk >= 1 and (wk not in best or _STATUS_RANK[status] > _STATUS_RANK[best[wk]]):
+            best[wk] = status
+    codes = [EnrollmentAttendanceSummary.UNMARKED] * max(best, default=0)
+    for wk, status in best.items():
+        codes[wk - 1] = EnrollmentAttendanceSummary.WEEK_CODES[status]
+    statuses = list(best.values())
+    return {
+        "present": statuses.count("PRESENT"),
+        "absent": statuses.count("ABSENT"),
+        "late": statuses.count("LATE"),
+        "weeks": "".join(codes)[:64],
+    }
+
+
+def compute_attendance_summaries(enrollment_ids, *, Attendance=Attendance):
+    """{enrollment_id: summarize_weeks(...)}；没有出勤记录的报名也给一行全 0"""
+    rows = defaultdict(list)
+    for eid, wk, status in (Attendance.objects.filter(enrollment_id__in=enrollment_ids)
+                            .values_list("enrollment_id", "week_no", "status")):
+        rows[eid].append((wk, status))
+    return {eid: summarize_weeks(rows[eid]) for eid in enrollment_ids}
+
+
+def refresh_attendance_summaries(enrollment_ids, *, Attendance=Attendance, Enrollment=Enrollment,
+                                 Summary=EnrollmentAttendanceSummary):
+    """
+    重算这些报名的汇总：一次读出勤 + 一条 upsert
+    - PostgreSQL / SQLite：INSERT ... ON CONFLICT (enrollment_id) DO UPDATE
+    - MySQL / MariaDB：INSERT ... ON DUPLICATE KEY UPDATE（不支持指定冲突列，不能传 unique_fields）
+    - 都不支持时：已有的行 bulk_update，缺的行 bulk_create
+    已删除的报名直接跳过；模型类可由数据迁移传入历史模型
+    """
+    ids = list(Enrollment.objects.filter(id__in=set(enrollment_ids)).values_list("id", flat=True))
+    if not ids:
+        return 0
+    now = timezone.now()
+    objs = [Summary(enrollment_id=eid, updated_at=now, **data)
+            for eid, data in compute_attendance_summaries(ids, Attendance=Attendance).items()]
+    fields = [*SUMMARY_FIELDS, "updated_at"]
+    features = connections[router.db_for_write(Summary)].features
+    if features.supports_update_conflicts_with_target:
+        Summary.objects.bulk_create(objs, update_conflicts=True, unique_fields=["enrollment"], update_fields=fields)
+    elif features.supports_update_conflicts:
+        Summary.objects.bulk_create(objs, update_conflicts=True, update_fields=fields)
+    else:
+        existing = set(Summary.objects.filter(enrollment_id__in=ids).values_list("enrollment_id", flat=True))
+        Summary.objects.bulk_update([o for o in objs if o.enrollment_id in existing], fields)
+        Summary.objects.bulk_create([o for o in objs if o.enrollment_id not in existing])
+    return len(objs)
+
+
+# —— 签到矩阵缓存 ——
+matrix_cache = NamespacedCache(
+    "attmx",
+    timeout=getattr(settings, "ATTENDANCE_MATRIX_CACHE_TIMEOUT", 600),
+    description="签到表：名单 + 出勤矩阵（按 时段×细分班）",
+)
+
+
+def bump_matrix_version(slot_id):
+    matrix_cache.bump(slot_id)
+
+
+def bump_matrix_for_enrollment(course_slot_id, course_id, semester_id):
+    """报名变动影响的时段：自身 course_slot；旧数据(course_slot 为空)影响同课程同学期的全部时段"""
+    if course_slot_id:
+        bump_matrix_version(course_slot_id)
+    else:
+        for sid in CourseSlot.objects.filter(course_id=course_id, semester_id=semester_id).values_list("id", flat=True):
+            bump_matrix_version(sid)
+
+
+async def aget_attendance_matrix(slot, subgroup_id):
+    """
+    返回该时段(+细分班)的名单与出勤矩阵（覆盖整个学期的所有周）：
+      {"weeks": [1..N], "rows": [{enrollment_id, student_name, parent_name, paid,
+                                   subgroup_name, subgroup_id, status}]}
+    status 每位对应 weeks 中的一周，"1"=出勤 "0"=未出勤
+    """
+    return await matrix_cache.aget_or_build(
+        f"{slot.id}:{subgroup_id or 0}:{int(getattr(settings, 'ENROLLMENT_STRICT_SLOT_FILTER', False))}"
+        f":{await matrix_cache.aversion(slot.id)}",
+        lambda: _abuild_attendance_matrix(slot, subgroup_id),
+    )
+
+
+async def _abuild_attendance_matrix(slot, subgroup_id):
+    sem = slot.semester
+    weeks = list(range(1, sem.week_count + 1))
+
+    enrollments = roster_queryset(slot, subgroup_id).select_related("parent","student","sub_group").order_by("id")
+    existing_qs = attendance_queryset(slot, subgroup_id).filter(week_no__lte=sem.week_count)
+
+    ex_map = {(eid, wk, sg_id or 0): (st == "PRESENT") async for eid, wk, sg_id, st in
+              existing_qs.values_list("enrollment_id", "week_no", "sub_group_id", "status")}
+
+    rows = []
+    async for en in enrollments:
+        row_subgroup_id = en.sub_group_id or (subgroup_id or None)
+        rows.append({
+            "enrollment_id": en.id,
+            "student_name": en.student.full_name if en.student else en.parent.username,
+            "parent_name": en.parent.username,
+            "paid": (en.paid_status == "PAID"),
+            "subgroup_name": en.sub_group.name if en.sub_group else "",
+            "subgroup_id": row_subgroup_id or "",
+            "status": "".join("1" if ex_map.get((en.id, w, row_subgroup_id or 0)) else "0" for w in weeks),
+        })
+    return {"weeks": weeks, "rows": rows}
+
+
+# —— 签到表 / 导出共用的查询 ——
+def roster_queryset(slot, subgroup_id=None):
+    """该时段(+细分班)的 APPROVED 报名"""
+    if getattr(settings, "ENROLLMENT_STRICT_SLOT_FILTER", False):
+        # 回填后的纯等值路径：enroll_status_slot_idx 一次定位
+        enrollments = Enrollment.objects.filter(status="APPROVED", course_slot_id=slot.id)
+        if subgroup_id:
+            enrollments = enrollments.filter(sub_group_id=subgroup_id)
+        return enrollments
+
+    # 优先筛选选中时段的报名；兼容旧数据（还未写入 course_slot 的）
+    # 等值条件写进 OR 的每一支，SQLite(MULTI-INDEX OR) / MySQL(index_merge) 才能两边都走复合索引
+    enrollments = Enrollment.objects.filter(
+        Q(status="APPROVED", course_slot_id=slot.id)
+        | Q(status="APPROVED", course_slot__isnull=True, course_id=slot.course_id, semester_id=slot.semester_id)
+    )
+    if subgroup_id:
+        enrollments = enrollments.filter(Q(sub_group_id=subgroup_id) | Q(sub_group_id__isnull=True))
+    return enrollments
+
+
+def attendance_queryset(slot, subgroup_id=None):
+    """该时段(+细分班)的出勤记录"""
+    if subgroup_id and getattr(settings, "ENROLLMENT_STRICT_SLOT_FILTER", False):
+        return Attendance.objects.filter(course_slot=slot, sub_group_id=subgroup_id)
+    if subgroup_id:
+        # 同上：每一支都是 (course_slot, sub_group) 等值，走 att_slot_sg_week_idx
+        return Attendance.objects.filter(Q(course_slot=slot, sub_group_id=subgroup_id)
+                                         | Q(course_slot=slot, sub_group__isnull=True))
+    return Attendance.objects.filter(course_slot=slot)
+
+
+def roster_attendance_rows(slot, subgroup_id=None):
+    """
+    导出用：名单 LEFT JOIN 出勤（条件同 attendance_queryset），按 (报名, 周) 排序，
+    调用方边读边按报名分组拼行，内存不随名单人数增长。
+    每行 (enrollment_id, 学生, 家长, 付费状态, week_no, status)；没有出勤记录的报名也有一行，周/状态为 None
+    """
+    cond = Q(attendance__course_slot=slot)
+    if subgroup_id and getattr(settings, "ENROLLMENT_STRICT_SLOT_FILTER", False):
+        cond &= Q(attendance__sub_group_id=subgroup_id)
+    elif subgroup_id:
+        cond &= Q(attendance__sub_group_id=subgroup_id) | Q(attendance__sub_group_id__isnull=True)
+    return (roster_queryset(slot, subgroup_id)
+            .annotate(att=FilteredRelation("attendance", condition=cond))
+            .order_by("id", "att__week_no")
+            .values_list("id", "student__full_name", "parent__username", "paid_status",
+                         "att__week_no", "att__status"))
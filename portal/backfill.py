@@ -0,0 +1,106 @@
+# portal/backfill.py
+"""
+旧数据回填：给 course_slot / sub_group 为空的 Enrollment（以及对应 Attendance）补上能唯一推断的值
+
+推断规则（只在“唯一”时写入）：
+- Enrollment.course_slot 为空：
+    1) 已有 sub_group → 用 sub_group.course_slot（课程/学期必须一致）
+    2) 否则该 课程+学期 下只有一个 CourseSlot → 用它
+- Enrollment.sub_group 为空且已有 course_slot：该时段下只有一个 SubGroup → 用它
+- Attendance.sub_group 为空：报名已有 sub_group 且时段一致、且不会撞唯一约束 → 用报名的 sub_group
+
+模型类由调用方传入，数据迁移（历史模型）和管理命令共用同一套逻辑。
+"""
+from collections import defaultdict
+
+BATCH_SIZE = 500
+
+
+def backfill_enrollment_slots(Enrollment, CourseSlot, SubGroup, Attendance, *, dry_run=False):
+    """
+    返回 {"enrollment_slot": n, "enrollment_subgroup": n, "attendance_subgroup": n,
+          "unresolved": [(model, id, reason), ...], "slots": {受影响的时段 id}}
+    slots 给调用方失效签到表缓存用：空 course_slot 的报名原来出现在同课程同学期的所有时段里，都算受影响
+    """
+    result = {"enrollment_slot": 0, "enrollment_subgroup": 0, "attendance_subgroup": 0, "unresolved": [],
+              "slots": set()}
+    unresolved = result["unresolved"]
+    slots = result["slots"]
+
+    # —— 内存查找表：课程+学期 → 时段；时段 → 细分班；细分班 → 时段 ——
+    slots_by_course_sem = defaultdict(list)
+    slot_info = {}
+    for sid, course_id, sem_id in CourseSlot.objects.values_list("id", "course_id", "semester_id"):
+        slots_by_course_sem[(course_id, sem_id)].append(sid)
+        slot_info[sid] = (course_id, sem_id)
+    subgroups_by_slot = defaultdict(list)
+    slot_of_subgroup = {}
+    for gid, sid in SubGroup.objects.values_list("id", "course_slot_id"):
+        subgroups_by_slot[sid].append(gid)
+        slot_of_subgroup[gid] = sid
+
+    # —— 1) Enrollment.course_slot / sub_group ——
+    to_update = []
+    legacy = (Enrollment.objects.filter(course_slot__isnull=True) | Enrollment.objects.filter(sub_group__isnull=True))
+    for en in legacy.only("id", "course_id", "semester_id", "course_slot_id", "sub_group_id").iterator(chunk_size=BATCH_SIZE):
+        changed = False
+        if en.course_slot_id is None:
+            if en.sub_group_id:
+                sid = slot_of_subgroup.get(en.sub_group_id)
+                if sid and slot_info.get(sid) == (en.course_id, en.semester_id):
+                    en.course_slot_id = sid
+                else:
+                    unresolved.append(("Enrollment", en.id, "sub_group 的时段与报名的课程/学期不一致"))
+            else:
+                candidates = slots_by_course_sem.get((en.course_id, en.semester_id), [])
+                if len(candidates) == 1:
+                    en.course_slot_id = candidates[0]
+                else:
+                    unresolved.append(("Enrollment", en.id, f"该课程+学期有 {len(candidates)} 个时段，无法确定"))
+            if en.course_slot_id is not None:
+                result["enrollment_slot"] += 1
+                slots.update(slots_by_course_sem.get((en.course_id, en.semester_id), []))
+                changed = True
+
+        if en.sub_group_id is None and en.course_slot_id is not None:
+            candidates = subgroups_by_slot.get(en.course_slot_id, [])
+            if len(candidates) == 1:
+                en.sub_group_id = candidates[0]
+                result["enrollment_subgroup"] += 1
+                slots.add(en.course_slot_id)
+                changed = True
+            elif candidates:
+                unresolved.append(("Enrollment", en.id, f"时段下有 {len(candidates)} 个细分班，未分班"))
+
+        if changed:
+            to_update.append(en)
+    if not dry_run and to_update:
+        Enrollment.objects.bulk_update(to_update, ["course_slot", "sub_group"], batch_size=BATCH_SIZE)
+
+    # —— 2) Attendance.sub_group（报名的细分班已知时） ——
+    enroll_sg = {en.id: (en.course_slot_id, en.sub_group_id) for en in to_update}
+    att_qs = (Attendance.objects.filter(sub_group__isnull=True)
+              .values_list("id", "enrollment_id", "course_slot_id", "week_no",
+                           "enrollment__course_slot_id", "enrollment__sub_group_id"))
+    pending = []
+    for att_id, eid, slot_id, week_no, en_slot, en_sg in att_qs.iterator(chunk_size=BATCH_SIZE):
+        en_slot, en_sg = enroll_sg.get(eid, (en_slot, en_sg))
+        if en_sg and en_slot == slot_id:
+            pending.append((att_id, eid, slot_id, week_no, en_sg))
+    # 已存在同 (报名, 时段, 周, 细分班) 的记录就不能改，避免撞唯一约束
+    taken = set()
+    if pending:
+        taken = set(Attendance.objects.filter(enrollment_id__in={p[1] for p in pending}, sub_group__isnull=False)
+                    .values_list("enrollment_id", "course_slot_id", "week_no", "sub_group_id"))
+    att_updates = []
+    for att_id, eid, slot_id, week_no, sg in pending:
+        if (eid, slot_id, week_no, sg) in taken:
+            unresolved.append(("Attendance", att_id, "同一格子已有带细分班的记录"))
+            continue
+        att_updates.append(Attendance(id=att_id, sub_group_id=sg))
+        slots.add(slot_id)
+    result["attendance_subgroup"] = len(att_updates)
+    if not dry_run and att_updates:
+        Attendance.objects.bulk_update(att_updates, ["sub_group"], batch_size=BATCH_SIZE)
+
+    return result
@@ -0,0 +1,192 @@
+# portal/benchmarks.py
+"""
+热点接口的基准测试（manage.py run_benchmarks）：对当前数据库（一般先跑 seed_scale）
+逐个场景发请求，记录 耗时 / SQL 条数 / 响应大小，输出 JSON 报告，不同版本之间直接 diff
+
+- 每个场景跑 repeat 次：第一次单独记为 cold_ms（缓存未命中），其余取 p50 / max
+- 每次请求都包在事务里最后回滚：打勾类接口不会真的改数据
+- 用 django.test.Client + force_login，不需要知道任何密码
+"""
+import json
+import platform
+import statistics
+import time
+from datetime import datetime
+
+import django
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .models import Attendance, CourseSlot, Enrollment
+
+SCENARIOS = {}
+
+
+def scenario(name, user):
+    """登记场景：函数接收 BenchmarkContext，返回 [(说明, 发请求的无参函数)]；user 是以谁的身份请求"""
+    def deco(fn):
+        SCENARIOS[name] = (user, fn)
+        return fn
+    return deco
+
+
+class BenchmarkContext:
+    """挑出数据量最大的时段 / 报名最多的家长，所有场景共用"""
+
+    def __init__(self):
+        User = get_user_model()
+        self.slot = (CourseSlot.objects.select_related("course", "semester")
+                     .annotate(n=Count("enrollment")).order_by("-n", "id").first())
+        if self.slot is None:
+            raise LookupError("数据库里没有时段，先运行 manage.py seed_scale")
+        self.subgroup_id = self.slot.subgroup_set.values_list("id", flat=True).order_by("id").first()
+        self.assistant = User.objects.filter(role="ASSISTANT", is_active=True).order_by("id").first()
+        parent_id = (Enrollment.objects.filter(status="APPROVED").values("parent_id")
+                     .annotate(n=Count("id")).order_by("-n", "parent_id").values_list("parent_id", flat=True).first())
+        self.parent = User.objects.filter(pk=parent_id).first()
+        self.superuser = User.objects.filter(is_superuser=True, is_active=True).order_by("id").first()
+        self.enrollment_ids = list(Enrollment.objects.filter(status="APPROVED", course_slot=self.slot)
+                                   .values_list("id", flat=True))
+
+    def client_for(self, user):
+        client = Client()
+        if user is not None:
+            client.force_login(user)
+        return client
+
+
+def _consume(resp):
+    """流式响应要读完才算完成；返回 (状态码, 字节数)"""
+    if getattr(resp, "streaming", False):
+        return resp.status_code, sum(len(chunk) for chunk in resp.streaming_content)
+    return resp.status_code, len(resp.content)
+
+
+# —— 场景 ——
+@scenario("attendance_table", user="assistant")
+def _attendance_table(ctx):
+    client = ctx.client_for(ctx.assistant)
+    slot = ctx.slot
+    params = {"campus_id": slot.course.campus_id, "semester_id": slot.semester_id, "weekday": slot.weekday,
+              "slot_id": slot.id, "subgroup_id": ctx.subgroup_id or ""}
+    return [("", lambda: client.get(reverse("assistant_attendance_table"), params))]
+
+
+@scenario("attendance_export_csv", user="assistant")
+def _attendance_export(ctx):
+    client = ctx.client_for(ctx.assistant)
+    return [(fmt, lambda fmt=fmt: client.get(reverse("attendance_export_csv"), {"slot_id": ctx.slot.id, "format": fmt}))
+            for fmt in ("csv", "xlsx")]
+
+
+@scenario("parent_pages", user="parent")
+def _parent_pages(ctx):
+    client = ctx.client_for(ctx.parent)
+    return [(name, lambda name=name: client.get(reverse(name)))
+            for name in ("parent", "parent_notices", "parent_resources", "parent_enrollments")]
+
+
+@scenario("attendance_mark", user="assistant")
+def _attendance_mark(ctx):
+    client = ctx.client_for(ctx.assistant)
+    week = 1
+    cells = [{"enrollment_id": eid, "week_no": week, "present": True} for eid in ctx.enrollment_ids]
+    body = {"slot_id": ctx.slot.id, "week_no": week, "subgroup_id": None}
+
+    def post(name, data):
+        return client.post(reverse(name), data=json.dumps(data), content_type="application/json")
+
+    return [
+        ("mark_batch", lambda: post("assistant_attendance_mark_batch",
+                                    {"course_slot_id": ctx.slot.id, "sub_group_id": None, "cells": cells})),
+        ("mark_week_bulk", lambda: post("attendance_mark_week_bulk", body)),
+        ("clear_week_bulk", lambda: post("attendance_clear_week_bulk", body)),
+    ]
+
+
+@scenario("admin_changelists", user="superuser")
+def _admin_changelists(ctx):
+    client = ctx.client_for(ctx.superuser)
+    calls = []
+    for model in admin.site._registry:
+        opts = model._meta
+        if opts.app_label != "portal":
+            continue
+        url = reverse(f"admin:{opts.app_label}_{opts.model_name}_changelist")
+        calls.append((opts.model_name, lambda url=url: client.get(url)))
+    return calls
+
+
+# —— 运行 ——
+def _measure(fn, repeat):
+    timings, queries, status, size = [], [], None, 0
+    for _ in range(repeat):
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                status, size = _consume(fn())
+                timings.append((time.perf_counter() - started) * 1000)
+            transaction.set_rollback(True)
+        queries.append(len(captured.captured_queries))
+    warm = timings[1:] or timings
+    return {
+        "status": status,
+        "bytes": size,
+        "queries": queries[-1],
+        "cold_queries": queries[0],
+        "cold_ms": round(timings[0], 2),
+        "p50_ms": round(statistics.median(warm), 2),
+        "max_ms": round(max(warm), 2),
+    }
+
+
+def run_benchmarks(*, only=None, repeat=5, log=None):
+    """返回报告 dict：{"meta": {...}, "results": {"场景[.子项]": {...}}}"""
+    log = log or (lambda msg: None)
+    ctx = BenchmarkContext()
+    results = {}
+    for name, (user, build) in SCENARIOS.items():
+        if only and name not in only:
+            continue
+        if getattr(ctx, user) is None:
+            results[name] = {"skipped": f"数据库里没有可用的 {user} 账号"}
+            log(f"{name}: skipped")
+            continue
+        for label, fn in build(ctx):
+            key = f"{name}.{label}" if label else name
+            results[key] = _measure(fn, repeat)
+            log(f"{key}: {results[key]}")
+    return {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "django": django.get_version(),
+            "python": platform.python_version(),
+            "database": connection.vendor,
+            "repeat": repeat,
+            "slot_id": ctx.slot.id,
+            "slot_enrollments": len(ctx.enrollment_ids),
+            "rows": {
+                "enrollments": Enrollment.objects.count(),
+                "attendance": Attendance.objects.count(),
+            },
+        },
+        "results": results,
+    }
+
+
+def compare_reports(old, new, keys=("queries", "p50_ms")):
+    """[(场景, 指标, 旧值, 新值)]，只列出两边都有的场景"""
+    rows = []
+    for name, result in new["results"].items():
+        before = old.get("results", {}).get(name)
+        if not before:
+            continue
+        for key in keys:
+            if key in result and key in before:
+                rows.append((name, key, before[key], result[key]))
+    return rows
@@ -0,0 +1,159 @@
+# portal/caching.py
+"""
+带命名空间和统计的缓存封装（底层就是 Django 的 default cache，
+locmem / 文件 / Redis 都可以）
+
+- 每个命名空间一个 NamespacedCache，key 统一加 "<ns>:" 前缀
+- 命中/未命中/写入/删除 计数写回共享缓存（多个 gunicorn worker 合计）；每次读写多一次 incr，
+  所以默认关闭（CACHE_STATS_ENABLED），排查命中率时再打开
+- version()/bump()：按 scope 的版本号，bump 之后旧 key 自然失效
+- aget_or_build()/aversion()：ASGI 下异步视图用，走 cache.aget/aset（builder 是协程函数）
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+
+STATS_PREFIX = "cachestats"
+METRICS = ("hits", "misses", "sets", "deletes", "invalidations")
+
+
+class NamespacedCache:
+    registry = {}
+
+    def __init__(self, namespace, *, timeout=300, description=""):
+        self.namespace = namespace
+        self.timeout = timeout
+        self.description = description
+        NamespacedCache.registry[namespace] = self
+
+    # —— key ——
+    def key(self, suffix):
+        return f"{self.namespace}:{suffix}"
+
+    # —— 读写 ——
+    def get(self, suffix):
+        value = cache.get(self.key(suffix))
+        self._count("misses" if value is None else "hits")
+        return value
+
+    def set(self, suffix, value, timeout=None):
+        cache.set(self.key(suffix), value, self.timeout if timeout is None else timeout)
+        self._count("sets")
+
+    def delete(self, suffix):
+        cache.delete(self.key(suffix))
+        self._count("deletes")
+
+    def get_or_build(self, suffix, builder, timeout=None):
+        value = self.get(suffix)
+        if value is None:
+            value = builder()
+            self.set(suffix, value, timeout)
+        return value
+
+    # —— 异步读写（异步视图用；builder 返回协程） ——
+    async def aget(self, suffix):
+        value = await cache.aget(self.key(suffix))
+        await self._acount("misses" if value is None else "hits")
+        return value
+
+    async def aset(self, suffix, value, timeout=None):
+        await cache.aset(self.key(suffix), value, self.timeout if timeout is None else timeout)
+        await self._acount("sets")
+
+    async def aget_or_build(self, suffix, builder, timeout=None):
+        value = await self.aget(suffix)
+        if value is None:
+            value = await builder()
+            await self.aset(suffix, value, timeout)
+        return value
+
+    # —— 版本号（失效用） ——
+    def _version_key(self, scope):
+        return self.key(f"v:{scope}")
+
+    def version(self, scope):
+        v = cache.get(self._version_key(scope))
+        if v is None:
+            # 版本号丢失（被挤出/重启）时用时间戳重建，保证不会撞上旧 key
+            cache.add(self._version_key(scope), time.time_ns(), None)
+            v = cache.get(self._version_key(scope))
+        return v
+
+    async def aversion(self, scope):
+        v = await cache.aget(self._version_key(scope))
+        if v is None:
+            await cache.aadd(self._version_key(scope), time.time_ns(), None)
+            v = await cache.aget(self._version_key(scope))
+        return v
+
+    def bump(self, scope):
+        try:
+            cache.incr(self._version_key(scope))
+        except ValueError:
+            cache.set(self._version_key(scope), time.time_ns(), None)
+        self._count("invalidations")
+
+    # —— 统计 ——
+    def _count(self, metric):
+        if not getattr(settings, "CACHE_STATS_ENABLED", False):
+            return
+        key = f"{STATS_PREFIX}:{self.namespace}:{metric}"
+        try:
+            cache.incr(key)
+        except ValueError:
+            if not cache.add(key, 1, None):
+                cache.incr(key)
+
+    async def _acount(self, metric):
+        if not getattr(settings, "CACHE_STATS_ENABLED", False):
+            return
+        key = f"{STATS_PREFIX}:{self.namespace}:{metric}"
+        try:
+            await cache.aincr(key)
+        except ValueError:
+            if not await cache.aadd(key, 1, None):
+                await cache.aincr(key)
+
+    def stats(self):
+        keys = {m: f"{STATS_PREFIX}:{self.namespace}:{m}" for m in METRICS}
+        got = cache.get_many(keys.values())
+        data = {m: got.get(k, 0) for m, k in keys.items()}
+        lookups = data["hits"] + data["misses"]
+        data["hit_rate"] = round(data["hits"] / lookups * 100, 1) if lookups else None
+        data["keys"] = count_keys(self.namespace)
+        # 不按命名空间估算淘汰数（sets - deletes - keys 会把覆盖写也算进去）；淘汰只看 Redis 的 evicted_keys
+        return data
+
+    def reset_stats(self):
+        cache.delete_many([f"{STATS_PREFIX}:{self.namespace}:{m}" for m in METRICS])
+
+
+def count_keys(namespace):
+    """当前缓存里该命名空间的数据 key 数（不含版本号）；后端不支持枚举时返回 None"""
+    backend = caches[DEFAULT_CACHE_ALIAS]    # cache 本身是代理，取真实后端
+    kind = type(backend).__name__
+    if kind == "LocMemCache":
+        keys = list(backend._cache)
+    elif kind == "RedisCache":
+        client = backend._cache.get_client(None)
+        keys = [k.decode() if isinstance(k, bytes) else k
+                for k in client.scan_iter(match=f"*:{namespace}:*", count=1000)]
+    else:
+        return None
+    # 完整 key 形如 "<KEY_PREFIX>:<VERSION>:<ns>:..."
+    raw = (k.split(":", 2)[-1] for k in keys)
+    return sum(1 for k in raw if k.startswith(f"{namespace}:") and not k.startswith(f"{namespace}:v:"))
+
+
+def backend_info():
+    """后端名 + Redis 的全局淘汰数（INFO stats.evicted_keys）"""
+    backend = caches[DEFAULT_CACHE_ALIAS]
+    info = {"backend": f"{type(backend).__module__}.{type(backend).__name__}", "server_evicted": None}
+    if type(backend).__name__ == "RedisCache":
+        try:
+            info["server_evicted"] = backend._cache.get_client(None).info("stats").get("evicted_keys")
+        except Exception:
+            pass
+    return info
@@ -0,0 +1,80 @@
+# portal/comments.py
+"""
+评论相关的查询与缓存
+
+- 评论历史按 (created_at, id) 倒序做游标分页（keyset）：每页都是一次索引范围扫描，不随页数变慢
+  游标是上一页最后一条的 (created_at, id)，编码成 URL 安全的字符串
+  acomment_page 是异步视图用的版本（async ORM 迭代）
+"""
+import base64
+from datetime import datetime
+
+from django.db.models import Exists, OuterRef, Q
+
+from .caching import NamespacedCache
+from .models import Campus, Comment
+
+campus_filter_cache = NamespacedCache("campusfilter", timeout=3600, description="评论后台：校区筛选项")
+CAMPUS_SCOPE = "campus"
+COMMENTS_PAGE_SIZE = 20
+MAX_COMMENTS_PAGE_SIZE = 100
+
+
+def campus_choices_for_comments(role=None):
+    """有评论的校区 [(id, name)]；role 为空表示不区分家长/助教"""
+    ver = campus_filter_cache.version(CAMPUS_SCOPE)
+    return campus_filter_cache.get_or_build(f"{role or 'ALL'}:{ver}", lambda: _campus_choices(role))
+
+
+def _campus_choices(role):
+    comments = Comment.objects.filter(sub_group__course_slot__course__campus=OuterRef("pk"))
+    if role:
+        comments = comments.filter(role=role)
+    return list(Campus.objects.filter(Exists(comments)).order_by("name").values_list("id", "name"))
+
+
+def bump_campus_choices():
+    campus_filter_cache.bump(CAMPUS_SCOPE)
+
+
+# —— 游标分页 ——
+def encode_cursor(comment):
+    raw = f"{comment.created_at.isoformat()}|{comment.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """-> (created_at, id)；格式不对时 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        stamp, pk = raw.rsplit("|", 1)
+        return datetime.fromisoformat(stamp), int(pk)
+    except (TypeError, UnicodeDecodeError, ValueError) as exc:
+        raise ValueError(f"invalid cursor: {cursor!r}") from exc
+
+
+def comment_page(queryset, cursor=None, size=COMMENTS_PAGE_SIZE):
+    """
+    queryset 里 cursor 之后（更早）的 size 条评论，按 (created_at, id) 倒序
+    返回 (comments, next_cursor)；没有更早的评论时 next_cursor 为 None
+    """
+    return _split_page(list(_page_queryset(queryset, cursor, size)), size)
+
+
+async def acomment_page(queryset, cursor=None, size=COMMENTS_PAGE_SIZE):
+    return _split_page([c async for c in _page_queryset(queryset, cursor, size)], size)
+
+
+def _page_queryset(queryset, cursor, size):
+    """多取一条，用来判断还有没有下一页"""
+    qs = queryset.order_by("-created_at", "-id")
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        qs = qs.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+    return qs[:size + 1]
+
+
+def _split_page(rows, size):
+    if len(rows) > size:
+        return rows[:size], encode_cursor(rows[size - 1])
+    return rows, None
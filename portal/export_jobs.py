@@ -0,0 +1,206 @@
+# portal/export_jobs.py
+"""
+后台任务：请求里只登记一条 ExportJob，由独立进程 `manage.py run_export_worker` 轮询执行
+- 导出：文件写到私有存储（portal/storage.py，不对外公开），只能经后台 ExportJob 的下载视图读取
+- 其它后台任务（公告收件箱扇出等）：不产生文件，失败自动重试
+
+- 队列就是 ExportJob 表：按 id 取最早的 PENDING，用条件 UPDATE 抢占（多 worker 也不会重复执行）；
+  和业务数据在同一个事务里登记，事务提交了任务就不会丢（进程重启 / 发版也不会）
+- 导出类型登记在 JOB_KINDS：kind → 生成 (行迭代器, 文件名主干) 的函数
+- 其它任务登记在 TASK_KINDS（@job_task）：kind → 函数，params["args"] 原样作为位置参数；
+  抛异常时放回队列，最多执行 TASK_MAX_ATTEMPTS 次，之后记为 FAILED
+- 文件格式由 params["format"] 决定（portal/exports.py 的注册表，默认 csv）
+- RUNNING 期间 worker 每 EXPORT_JOB_HEARTBEAT_SECONDS 刷新 heartbeat_at；
+  心跳超过 EXPORT_JOB_STALE_SECONDS 没动的任务视为 worker 已死，由任一 worker 的定期维护放回队列
+"""
+import os
+import secrets
+import socket
+import tempfile
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import F, Q
+from django.http import HttpRequest, QueryDict
+from django.utils import timezone
+
+from .exports import get_exporter
+from .models import ExportJob
+
+JOB_KINDS = {}
+TASK_KINDS = {}
+TASK_MAX_ATTEMPTS = 3
+
+
+class JobLost(Exception):
+    """任务已被当作崩溃放回队列（心跳过期），当前 worker 不再拥有它"""
+
+
+def job_kind(name):
+    """登记任务类型：被装饰的函数接收 job，返回 (rows, basename)，rows 第一行是表头"""
+    def deco(fn):
+        JOB_KINDS[name] = fn
+        return fn
+    return deco
+
+
+def job_task(name):
+    """登记后台任务：被装饰的函数照常可直接调用，enqueue_task(fn, *args) 把调用登记进队列"""
+    def deco(fn):
+        TASK_KINDS[name] = fn
+        fn.job_kind = name
+        return fn
+    return deco
+
+
+def enqueue_task(fn, *args):
+    """在当前事务里登记一次 fn(*args) 调用（参数要能存进 JSON）；事务回滚则任务也不存在"""
+    return ExportJob.objects.create(kind=fn.job_kind, params={"args": list(args)})
+
+
+def enqueue_export(kind, params, user):
+    if kind not in JOB_KINDS:
+        raise ValueError(f"unknown export kind: {kind}")
+    if get_exporter(params.get("format")) is None:
+        raise ValueError(f"unknown export format: {params.get('format')}")
+    return ExportJob.objects.create(kind=kind, params=params, created_by=user)
+
+
+# —— worker 侧 ——
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim_next_job(worker):
+    """抢一个 PENDING 任务；条件 UPDATE 只有一个 worker 能成功"""
+    for job_id in ExportJob.objects.filter(status=ExportJob.Status.PENDING).order_by("id").values_list("id", flat=True)[:5]:
+        now = timezone.now()
+        won = ExportJob.objects.filter(pk=job_id, status=ExportJob.Status.PENDING).update(
+            status=ExportJob.Status.RUNNING, worker=worker, started_at=now, heartbeat_at=now,
+            attempts=F("attempts") + 1,
+        )
+        if won:
+            return ExportJob.objects.select_related("created_by").get(pk=job_id)
+    return None
+
+
+def _owned(job):
+    return ExportJob.objects.filter(pk=job.pk, status=ExportJob.Status.RUNNING, worker=job.worker)
+
+
+def touch_heartbeat(job):
+    """刷新心跳；任务已被放回队列 / 别的 worker 接手时抛 JobLost"""
+    if not _owned(job).update(heartbeat_at=timezone.now()):
+        raise JobLost(str(job))
+
+
+def _with_heartbeat(job, rows, interval):
+    """逐行透传，顺带每 interval 秒刷新一次心跳（导出慢就是慢在逐行读库/写文件）"""
+    due = time.monotonic() + interval
+    for row in rows:
+        if time.monotonic() >= due:
+            touch_heartbeat(job)
+            due = time.monotonic() + interval
+        yield row
+
+
+def run_job(job):
+    """
+    执行一个已抢到的任务：先写临时文件，再存进 storage；异常记到 job.error
+    中途心跳发现任务已丢（被当成崩溃放回队列）就丢掉结果，不覆盖别的 worker 的状态
+    """
+    if job.kind in TASK_KINDS:
+        return _run_task(job)
+    interval = getattr(settings, "EXPORT_JOB_HEARTBEAT_SECONDS", 30)
+    try:
+        exporter = get_exporter(job.params.get("format"))
+        rows, basename = JOB_KINDS[job.kind](job)
+        filename = exporter.filename(basename)
+        with tempfile.TemporaryFile() as tmp:
+            job.row_count = exporter.write(_with_heartbeat(job, rows, interval), tmp)
+            tmp.seek(0)
+            job.file.save(f"{job.pk}-{secrets.token_hex(8)}-{filename}", File(tmp), save=False)
+        job.filename = filename
+        job.status = ExportJob.Status.DONE
+    except JobLost:
+        return None
+    except Exception as exc:
+        job.status = ExportJob.Status.FAILED
+        job.error = f"{type(exc).__name__}: {exc}"
+    job.finished_at = timezone.now()
+    done = _owned(job).update(file=job.file.name or None, filename=job.filename, row_count=job.row_count,
+                              status=job.status, error=job.error, finished_at=job.finished_at)
+    if not done:
+        if job.file:
+            job.file.delete(save=False)
+        return None
+    return job
+
+
+def _run_task(job):
+    """非导出任务：在事务里执行；失败且还有次数就放回队列（PENDING），否则 FAILED"""
+    try:
+        with transaction.atomic():
+            TASK_KINDS[job.kind](*job.params.get("args", []))
+        job.status, job.error = ExportJob.Status.DONE, ""
+    except Exception as exc:
+        job.error = f"{type(exc).__name__}: {exc}"
+        job.status = ExportJob.Status.PENDING if job.attempts < TASK_MAX_ATTEMPTS else ExportJob.Status.FAILED
+    job.finished_at = timezone.now() if job.status != ExportJob.Status.PENDING else None
+    fields = {"status": job.status, "error": job.error, "finished_at": job.finished_at}
+    if job.status == ExportJob.Status.PENDING:
+        fields.update(worker="", started_at=None, heartbeat_at=None)
+    if not _owned(job).update(**fields):
+        return None
+    return job
+
+
+def requeue_stale_jobs(stale_after=None):
+    """心跳过期（worker 崩溃 / 被杀）的 RUNNING 任务放回队列；心跳还在刷的长任务不动"""
+    if stale_after is None:
+        stale_after = timedelta(seconds=getattr(settings, "EXPORT_JOB_STALE_SECONDS", 300))
+    cutoff = timezone.now() - stale_after
+    # heartbeat_at 为空的是加心跳之前就在跑的老任务，按 started_at 判断
+    stale = Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff)
+    return ExportJob.objects.filter(stale, status=ExportJob.Status.RUNNING).update(
+        status=ExportJob.Status.PENDING, worker="", started_at=None, heartbeat_at=None,
+    )
+
+
+def purge_old_jobs(days=None):
+    """删除超过保留期的任务及其文件"""
+    days = getattr(settings, "EXPORT_JOB_RETENTION_DAYS", 7) if days is None else days
+    cutoff = timezone.now() - timedelta(days=days)
+    n = 0
+    for job in ExportJob.objects.filter(created_at__lt=cutoff).exclude(status=ExportJob.Status.RUNNING):
+        if job.file:
+            job.file.delete(save=False)
+        job.delete()
+        n += 1
+    return n
+
+
+# —— 任务类型 ——
+@job_kind("attendance_admin")
+def attendance_admin_export(job):
+    """
+    后台「出勤」列表的导出：按登记时的筛选/搜索参数重建 ChangeList，
+    和页面上看到的是同一个 queryset
+    """
+    from django.contrib import admin
+    from .models import Attendance
+
+    if job.created_by is None:
+        raise RuntimeError("发起导出的用户已删除")
+    model_admin = admin.site._registry[Attendance]
+    request = HttpRequest()
+    request.method = "GET"
+    request.GET = QueryDict(job.params.get("query", ""))
+    request.user = job.created_by
+    cl = model_admin.get_changelist_instance(request)
+    qs = cl.get_queryset(request)
+    stamp = timezone.localtime(job.created_at).strftime("%Y%m%d_%H%M%S")
+    return model_admin._export_rows(qs), f"attendance_{stamp}"
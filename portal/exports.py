@@ -0,0 +1,284 @@
+# portal/exports.py
+"""
+导出格式注册表：所有格式共用同一个「行生成器」（第一行是表头，之后逐行 yield），
+格式只负责把行编码成字节流，新增格式不需要再查一次库
+
+- csv：Excel 友好（可选 BOM）
+- xlsx：手写最小 SpreadsheetML，边生成边压缩输出，内存占用与行数无关
+- arrow：Arrow IPC 流（装了 pyarrow 才注册），按批写出
+- ndjson：每行一个 JSON 对象；没有 pyarrow 时作为列式分析的兜底格式
+
+同一个 Exporter 既能直接做 StreamingHttpResponse，也能写进文件（后台导出任务）
+"""
+import csv
+import datetime
+import json
+import re
+import zipfile
+from xml.sax.saxutils import escape
+
+from django.http import StreamingHttpResponse
+
+EXPORT_CHUNK_SIZE = 2000
+
+EXPORTERS = {}
+
+
+def register_exporter(cls):
+    EXPORTERS[cls.name] = cls()
+    return cls
+
+
+def get_exporter(name):
+    """未知格式返回 None；"columnar" 指向当前可用的列式格式"""
+    if name == "columnar":
+        name = COLUMNAR_FORMAT
+    return EXPORTERS.get(name or "csv")
+
+
+class Exporter:
+    name = ""
+    label = ""
+    extension = ""
+    content_type = "application/octet-stream"
+
+    def chunks(self, rows):
+        """rows → bytes 分块"""
+        raise NotImplementedError
+
+    def response(self, rows, basename):
+        resp = StreamingHttpResponse(self.chunks(rows), content_type=self.content_type)
+        resp["Content-Disposition"] = f'attachment; filename="{self.filename(basename)}"'
+        return resp
+
+    def write(self, rows, fp):
+        """写进二进制文件对象，返回数据行数（不含表头）"""
+        counter = _RowCounter(rows)
+        for chunk in self.chunks(counter):
+            fp.write(chunk)
+        return counter.data_rows
+
+    def filename(self, basename):
+        return f"{basename}.{self.extension}"
+
+
+class _RowCounter:
+    def __init__(self, rows):
+        self.rows = rows
+        self.data_rows = 0
+
+    def __iter__(self):
+        for i, row in enumerate(self.rows):
+            self.data_rows = i
+            yield row
+
+
+class Echo:
+    """csv.writer 需要一个带 write() 的对象；这里直接把写入内容返回"""
+    def write(self, value):
+        return value
+
+
+@register_exporter
+class CsvExporter(Exporter):
+    name = "csv"
+    label = "CSV"
+    extension = "csv"
+    content_type = "text/csv; charset=utf-8"
+
+    def __init__(self, bom=True):
+        # BOM 只在开头写一次（自己编码成 bytes，否则 StreamingHttpResponse 会给每个分块都加）
+        self.bom = bom
+
+    def chunks(self, rows):
+        writer = csv.writer(Echo())
+        if self.bom:
+            yield "\ufeff".encode("utf-8")
+        for r in rows:
+            yield writer.writerow(r).encode("utf-8")
+
+
+def stream_csv(rows, filename, content_type="text/csv; charset=utf-8"):
+    """
+    rows: 可迭代的行（第一行一般是表头），逐行写出
+    charset=utf-8-sig 时只在开头写一次 BOM
+    """
+    resp = StreamingHttpResponse(CsvExporter(bom=content_type.endswith("utf-8-sig")).chunks(rows),
+                                 content_type=content_type)
+    resp["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return resp
+
+
+# —— XLSX ——
+class _ChunkSink:
+    """ZipFile / Arrow writer 的输出目标：不可 seek，写入的字节攒着由生成器取走"""
+    closed = False
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, b):
+        self.parts.append(bytes(b))
+        return len(b)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.parts)
+        self.parts.clear()
+        return data
+
+
+# XML 1.0 不允许的控制字符（Excel 遇到会报文件损坏）
+_XML_ILLEGAL = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+_XLSX_STATIC = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+        'officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Export" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+        'worksheet" Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+
+@register_exporter
+class XlsxExporter(Exporter):
+    name = "xlsx"
+    label = "Excel (XLSX)"
+    extension = "xlsx"
+    content_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    FLUSH_EVERY = 500    # 每多少行把压缩好的数据交出去一次
+
+    def chunks(self, rows):
+        sink = _ChunkSink()
+        with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            for name, xml in _XLSX_STATIC.items():
+                zf.writestr(name, xml)
+            with zf.open("xl/worksheets/sheet1.xml", "w") as sheet:
+                sheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                            b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                            b'<sheetData>')
+                for i, row in enumerate(rows, start=1):
+                    sheet.write(self._row_xml(i, row))
+                    if i % self.FLUSH_EVERY == 0:
+                        yield sink.drain()
+                sheet.write(b"</sheetData></worksheet>")
+            yield sink.drain()
+        yield sink.drain()    # 中央目录在 close 时写出
+
+    @staticmethod
+    def _row_xml(i, row):
+        cells = []
+        for value in row:
+            if value is None or value == "":
+                cells.append("<c/>")
+            elif isinstance(value, bool):
+                cells.append(f'<c t="b"><v>{int(value)}</v></c>')
+            elif isinstance(value, (int, float)):
+                cells.append(f"<c><v>{value}</v></c>")
+            else:
+                text = escape(_XML_ILLEGAL.sub("", str(value)))
+                cells.append(f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>')
+        return f'<row r="{i}">{"".join(cells)}</row>'.encode("utf-8")
+
+
+# —— 列式 / 分析用 ——
+def _json_default(value):
+    if isinstance(value, (datetime.date, datetime.datetime, datetime.time)):
+        return value.isoformat()
+    return str(value)
+
+
+@register_exporter
+class NdjsonExporter(Exporter):
+    name = "ndjson"
+    label = "NDJSON"
+    extension = "ndjson"
+    content_type = "application/x-ndjson"
+
+    def chunks(self, rows):
+        rows = iter(rows)
+        header = next(rows, None)
+        if header is None:
+            return
+        for row in rows:
+            yield (json.dumps(dict(zip(header, row)), ensure_ascii=False, default=_json_default) + "\n").encode("utf-8")
+
+
+try:
+    import pyarrow as pa
+except ImportError:    # 可选依赖
+    pa = None
+
+
+if pa is not None:
+    @register_exporter
+    class ArrowExporter(Exporter):
+        """Arrow IPC 流：每 EXPORT_CHUNK_SIZE 行一个 record batch，列一律存成字符串"""
+        name = "arrow"
+        label = "Arrow IPC"
+        extension = "arrows"
+        content_type = "application/vnd.apache.arrow.stream"
+
+        def chunks(self, rows):
+            rows = iter(rows)
+            header = next(rows, None)
+            if header is None:
+                return
+            schema = pa.schema([(str(h), pa.string()) for h in header])
+            sink = _ChunkSink()
+            with pa.ipc.new_stream(sink, schema) as writer:
+                batch = []
+                for row in rows:
+                    batch.append(row)
+                    if len(batch) >= EXPORT_CHUNK_SIZE:
+                        writer.write_batch(self._batch(schema, batch))
+                        batch = []
+                        yield sink.drain()
+                if batch:
+                    writer.write_batch(self._batch(schema, batch))
+            yield sink.drain()
+
+        @staticmethod
+        def _batch(schema, rows):
+            columns = [[None if v is None else str(v) for v in col] for col in zip(*rows)]
+            return pa.record_batch([pa.array(c, type=pa.string()) for c in columns], schema=schema)
+
+
+COLUMNAR_FORMAT = "arrow" if "arrow" in EXPORTERS else "ndjson"
+
+
+def available_formats():
+    """[(name, label)]，给下拉 / 后台按钮用"""
+    return [(e.name, e.label) for e in EXPORTERS.values()]
@@ -0,0 +1,345 @@
+# portal/imports.py
+"""
+开学批量导入报名（CSV / XLSX）：后台上传和 manage.py import_enrollments 共用
+
+文件第一行是表头（不区分大小写，顺序随意）：
+    parent, student, campus, course, semester, weekday, start_time,
+    [end_time], [sub_group], [status], [paid_status], [birth_date]
+
+- 按批（BATCH_SIZE 行）校验：每批只查一次本批出现的家长 / 已有学生 / 已有报名，
+  校区、课程、学期、时段、细分班全部走内存查找表，不按行查库
+- 学生按 (parent, full_name) 去重（对应 Student 的索引），文件里重复的也只建一次
+- 已有同学生 + 同时段的报名视为「已存在」跳过，不报错
+- 先出报告（将新建的学生 / 报名、跳过的行、每行错误），确认后才 bulk_create 分块写入；
+  有错误行时默认整个文件都不写
+"""
+import csv
+import io
+import re
+import zipfile
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from xml.etree import ElementTree
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from .attendance import bump_matrix_for_enrollment
+from .notices import schedule_inbox_task, sync_parent_inboxes
+from .parent_context import bump_parent_context
+from .models import Campus, Course, CourseSlot, Enrollment, Semester, Student, SubGroup
+
+BATCH_SIZE = 500
+
+REQUIRED_COLUMNS = ("parent", "student", "campus", "course", "semester", "weekday", "start_time")
+OPTIONAL_COLUMNS = ("end_time", "sub_group", "status", "paid_status", "birth_date")
+
+ENROLLMENT_STATUSES = {s for s, _ in Enrollment.STATUS_CHOICES}
+PAID_STATUSES = {"UNPAID", "PAID"}
+WEEKDAYS = {"mon": 1, "tue": 2, "wed": 3, "thu": 4, "fri": 5, "sat": 6, "sun": 7}
+
+
+class ImportFileError(ValueError):
+    """文件本身读不了（格式 / 表头不对），区别于单行错误"""
+
+
+# —— 读文件 ——
+def read_rows(fp, filename):
+    """返回 (表头, 行迭代器)；行是 list，与表头对齐"""
+    if filename.lower().endswith(".xlsx"):
+        rows = _xlsx_rows(fp)
+    elif filename.lower().endswith(".csv"):
+        rows = csv.reader(io.TextIOWrapper(fp, encoding="utf-8-sig", newline=""))
+    else:
+        raise ImportFileError("只支持 .csv / .xlsx 文件")
+    rows = _guarded(rows)
+    try:
+        header = [str(h or "").strip().lower() for h in next(rows)]
+    except StopIteration:
+        raise ImportFileError("文件是空的")
+    missing = [c for c in REQUIRED_COLUMNS if c not in header]
+    if missing:
+        raise ImportFileError(f"缺少列：{', '.join(missing)}")
+    return header, rows
+
+
+def _guarded(rows):
+    """文件是逐行读的：中途损坏（压缩包 / XML / 编码 / 共享字符串下标）也要报成 ImportFileError，而不是 500"""
+    try:
+        yield from rows
+    except ImportFileError:
+        raise
+    except (zipfile.BadZipFile, ElementTree.ParseError, UnicodeDecodeError, csv.Error,
+            KeyError, IndexError, ValueError, EOFError) as exc:
+        raise ImportFileError(f"文件无法解析：{exc}") from exc
+
+
+_SS_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+
+
+def _xlsx_column(ref):
+    letters = re.match(r"[A-Z]+", ref or "")
+    n = 0
+    for ch in letters.group(0) if letters else "":
+        n = n * 26 + ord(ch) - 64
+    return n - 1
+
+
+def _xlsx_rows(fp):
+    """只读第一个工作表的值（共享字符串 / 行内字符串 / 数字 / 布尔），逐行 iterparse，不整表载入"""
+    zf = zipfile.ZipFile(fp)
+    shared = []
+    if "xl/sharedStrings.xml" in zf.namelist():
+        for _, el in ElementTree.iterparse(zf.open("xl/sharedStrings.xml")):
+            if el.tag == _SS_NS + "si":
+                shared.append("".join(t.text or "" for t in el.iter(_SS_NS + "t")))
+                el.clear()
+    sheets = sorted(n for n in zf.namelist() if n.startswith("xl/worksheets/sheet") and n.endswith(".xml"))
+    if not sheets:
+        raise ImportFileError("XLSX 里没有工作表")
+    for _, el in ElementTree.iterparse(zf.open(sheets[0])):
+        if el.tag != _SS_NS + "row":
+            continue
+        row = []
+        for c in el.iter(_SS_NS + "c"):
+            idx = _xlsx_column(c.get("r")) if c.get("r") else len(row)
+            row.extend([""] * (idx - len(row)))
+            kind, v = c.get("t"), c.find(_SS_NS + "v")
+            if kind == "inlineStr":
+                value = "".join(t.text or "" for t in c.iter(_SS_NS + "t"))
+            elif v is None:
+                value = ""
+            elif kind == "s":
+                value = shared[int(v.text)]
+            elif kind == "b":
+                value = v.text == "1"
+            else:
+                value = v.text or ""
+            row.append(value)
+        el.clear()
+        yield row
+
+
+# —— 单元格解析（CSV 里都是字符串；XLSX 的时间 / 日期可能是序列数） ——
+def _parse_weekday(value):
+    value = str(value).strip()
+    if value.isdigit() and 1 <= int(value) <= 7:
+        return int(value)
+    day = WEEKDAYS.get(value[:3].lower())
+    if day is None:
+        raise ValueError(f"无法识别的星期：{value!r}")
+    return day
+
+
+def _parse_time(value):
+    value = str(value).strip()
+    try:
+        fraction = float(value)
+    except ValueError:
+        for fmt in ("%H:%M", "%H:%M:%S"):
+            try:
+                return datetime.strptime(value, fmt).time()
+            except ValueError:
+                pass
+        raise ValueError(f"无法识别的时间：{value!r}")
+    if not 0 <= fraction < 1:
+        raise ValueError(f"无法识别的时间：{value!r}")
+    minutes = round(fraction * 24 * 60)       # Excel 把时间存成一天的比例
+    return time(minutes // 60, minutes % 60)
+
+
+def _parse_date(value):
+    value = str(value).strip()
+    if not value:
+        return None
+    if re.fullmatch(r"\d+(\.0+)?", value):
+        return date(1899, 12, 30) + timedelta(days=int(float(value)))    # Excel 日期序列数
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"无法识别的日期：{value!r}（用 YYYY-MM-DD）")
+
+
+# —— 报告 ——
+class ImportReport:
+    """
+    rows:   [(行号, "create" | "exists" | "error", 说明)]，行号按文件算（表头是第 1 行）
+    new_students / new_enrollments: 将要（或已经）新建的数量
+    """
+
+    def __init__(self):
+        self.rows = []
+        self.new_students = 0
+        self.new_enrollments = 0
+        self.committed = False
+
+    @property
+    def errors(self):
+        return [r for r in self.rows if r[1] == "error"]
+
+    @property
+    def skipped(self):
+        return [r for r in self.rows if r[1] == "exists"]
+
+    def summary(self):
+        return (f"新学生 {self.new_students}，新报名 {self.new_enrollments}，"
+                f"已存在 {len(self.skipped)}，错误 {len(self.errors)}")
+
+
+# —— 导入 ——
+class EnrollmentImporter:
+    """
+    importer = EnrollmentImporter()
+    report = importer.run(header, rows, commit=False)   # 预览
+    report = importer.run(header, rows, commit=True)    # 无错误行才写库（allow_errors=True 时跳过错误行）
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+        # 名称 → id 的内存查找表；开学导入涉及的校区 / 课程 / 时段数量都很小，一次读全
+        self.campuses = {name.strip().lower(): cid for cid, name in Campus.objects.values_list("id", "name")}
+        self.courses = {(campus_id, title.strip().lower()): cid
+                        for cid, campus_id, title in Course.objects.values_list("id", "campus_id", "title")}
+        self.semesters = {(campus_id, name.strip().lower()): sid
+                          for sid, campus_id, name in Semester.objects.values_list("id", "campus_id", "name")}
+        self.slots = defaultdict(list)       # (course, semester, weekday, start) → [(slot_id, end_time)]
+        for sid, course_id, sem_id, wd, start, end in CourseSlot.objects.values_list(
+                "id", "course_id", "semester_id", "weekday", "start_time", "end_time"):
+            self.slots[(course_id, sem_id, wd, start)].append((sid, end))
+        self.subgroups = defaultdict(dict)   # slot → {name: sub_group_id}
+        for gid, slot_id, name in SubGroup.objects.values_list("id", "course_slot_id", "name"):
+            self.subgroups[slot_id][name.strip().lower()] = gid
+
+    def run(self, header, rows, *, commit=False, allow_errors=False):
+        report = ImportReport()
+        planned = []                 # [(行号, parent_id, 学生姓名, birth_date, course, semester, slot, sub_group, status, paid)]
+        new_students = {}            # (parent_id, 姓名小写) → (姓名, birth_date)
+        seen_enrollments = set()     # 文件内重复
+        batch = []
+        for line, row in enumerate(rows, start=2):
+            values = dict(zip(header, (str(v).strip() if v is not None else "" for v in row)))
+            if not any(values.values()):
+                continue
+            batch.append((line, values))
+            if len(batch) >= self.batch_size:
+                self._validate_batch(batch, report, planned, new_students, seen_enrollments)
+                batch = []
+        if batch:
+            self._validate_batch(batch, report, planned, new_students, seen_enrollments)
+
+        report.new_students = len(new_students)
+        report.new_enrollments = len(planned)
+        if commit and planned and (allow_errors or not report.errors):
+            self._write(planned, new_students)
+            report.committed = True
+        report.rows.sort()
+        return report
+
+    def _validate_batch(self, batch, report, planned, new_students, seen_enrollments):
+        User = get_user_model()
+        usernames = {v.get("parent", "") for _, v in batch}
+        parents = dict(User.objects.filter(username__in=usernames).values_list("username", "id"))
+        # 本批家长的已有学生 / 报名（parent_id IN (...) 走 (parent, full_name) / (parent, status) 索引）
+        students = {}
+        for sid, pid, name in (Student.objects.filter(parent_id__in=parents.values())
+                               .order_by("id").values_list("id", "parent_id", "full_name")):
+            students.setdefault((pid, name.strip().lower()), sid)
+        enrolled = set(Enrollment.objects.filter(parent_id__in=parents.values(), student__isnull=False)
+                       .exclude(status__in=("REJECTED", "CANCELLED"))
+                       .values_list("student_id", "course_slot_id"))
+
+        for line, v in batch:
+            try:
+                resolved = self._resolve(v, parents)
+            except ValueError as exc:
+                report.rows.append((line, "error", str(exc)))
+                continue
+            parent_id, name, birth, course_id, sem_id, slot_id, sg_id, status, paid = resolved
+            student_key = (parent_id, name.lower())
+            student_id = students.get(student_key)
+            desc = f"{v['parent']} / {name} → {v['course']} {v['semester']} {v['weekday']} {v['start_time']}"
+            if (student_key, slot_id) in seen_enrollments or (student_id and (student_id, slot_id) in enrolled):
+                report.rows.append((line, "exists", desc))
+                continue
+            seen_enrollments.add((student_key, slot_id))
+            if student_id is None:
+                new_students.setdefault(student_key, (name, birth))
+                desc += "（新学生）"
+            planned.append((line, parent_id, name, birth, course_id, sem_id, slot_id, sg_id, status, paid))
+            report.rows.append((line, "create", desc))
+
+    def _resolve(self, v, parents):
+        missing = [c for c in REQUIRED_COLUMNS if not v.get(c)]
+        if missing:
+            raise ValueError(f"必填列为空：{', '.join(missing)}")
+        parent_id = parents.get(v["parent"])
+        if parent_id is None:
+            raise ValueError(f"家长账号不存在：{v['parent']}")
+        campus_id = self.campuses.get(v["campus"].lower())
+        if campus_id is None:
+            raise ValueError(f"校区不存在：{v['campus']}")
+        course_id = self.courses.get((campus_id, v["course"].lower()))
+        if course_id is None:
+            raise ValueError(f"该校区没有课程：{v['course']}")
+        sem_id = self.semesters.get((campus_id, v["semester"].lower()))
+        if sem_id is None:
+            raise ValueError(f"该校区没有学期：{v['semester']}")
+
+        weekday, start = _parse_weekday(v["weekday"]), _parse_time(v["start_time"])
+        candidates = self.slots.get((course_id, sem_id, weekday, start), [])
+        if v.get("end_time"):
+            end = _parse_time(v["end_time"])
+            candidates = [c for c in candidates if c[1] == end]
+        if len(candidates) != 1:
+            raise ValueError(f"找不到唯一的时段（匹配 {len(candidates)} 个）")
+        slot_id = candidates[0][0]
+
+        groups = self.subgroups.get(slot_id, {})
+        if v.get("sub_group"):
+            sg_id = groups.get(v["sub_group"].lower())
+            if sg_id is None:
+                raise ValueError(f"该时段没有细分班：{v['sub_group']}")
+        else:
+            # 与 backfill 一致：时段下只有一个细分班才自动分班
+            sg_id = next(iter(groups.values())) if len(groups) == 1 else None
+
+        status = (v.get("status") or "APPROVED").upper()
+        if status not in ENROLLMENT_STATUSES:
+            raise ValueError(f"无效的报名状态：{v['status']}")
+        paid = (v.get("paid_status") or "UNPAID").upper()
+        if paid not in PAID_STATUSES:
+            raise ValueError(f"无效的缴费状态：{v['paid_status']}")
+        return (parent_id, v["student"], _parse_date(v.get("birth_date", "")),
+                course_id, sem_id, slot_id, sg_id, status, paid)
+
+    def _write(self, planned, new_students):
+        with transaction.atomic():
+            Student.objects.bulk_create(
+                [Student(parent_id=pid, full_name=name, birth_date=birth)
+                 for (pid, _), (name, birth) in new_students.items()],
+                batch_size=self.batch_size,
+            )
+            # 不依赖 bulk_create 回填主键（MySQL 不支持）：按 (parent, full_name) 再查一次
+            parent_ids = {p[1] for p in planned}
+            student_ids = {}
+            for sid, pid, name in (Student.objects.filter(parent_id__in=parent_ids)
+                                   .order_by("id").values_list("id", "parent_id", "full_name")):
+                student_ids.setdefault((pid, name.strip().lower()), sid)
+
+            Enrollment.objects.bulk_create(
+                [Enrollment(parent_id=pid, student_id=student_ids[(pid, name.lower())], course_id=course_id,
+                            semester_id=sem_id, course_slot_id=slot_id, sub_group_id=sg_id,
+                            status=status, paid_status=paid)
+                 for _, pid, name, _, course_id, sem_id, slot_id, sg_id, status, paid in planned],
+                batch_size=self.batch_size,
+            )
+            # bulk_create 不发 signal：名单缓存、家长端上下文和公告收件箱自己处理
+            touched = {(p[6], p[4], p[5]) for p in planned}
+            transaction.on_commit(lambda: [bump_matrix_for_enrollment(*keys) for keys in touched])
+            transaction.on_commit(lambda: [bump_parent_context(pid) for pid in parent_ids])
+            schedule_inbox_task(sync_parent_inboxes, sorted(parent_ids))
+
+
+def import_enrollments(fp, filename, *, commit=False, allow_errors=False, batch_size=BATCH_SIZE):
+    header, rows = read_rows(fp, filename)
+    return EnrollmentImporter(batch_size=batch_size).run(header, rows, commit=commit, allow_errors=allow_errors)
@@ -0,0 +1,245 @@
+# portal/loadtest.py
+"""
+并发压测（manage.py run_load_benchmark）：同一批 JSON 接口分别在 WSGI / ASGI 两种部署方式下
+用 N 个并发连接持续请求，对比吞吐（req/s）和延迟分位，决定线上用哪种 SERVER_MODE
+
+- --mode wsgi|asgi|both：命令自己在本机空闲端口起 gunicorn（参数同 entrypoint.sh），压完就停；
+  --url：压一个已经在跑的服务（不管它是哪种模式）
+- 数据取自当前数据库（一般先跑 seed_scale），挑法同 run_benchmarks（BenchmarkContext）
+- 标准库 http.client，每个并发线程一条 keep-alive 连接；登录态是给助教账号新建的 session
+- 默认只压只读接口；--include-writes 才加上打勾接口（会真的写出勤，别对线上库用；
+  SQLite 下并发写会报 database is locked，写接口只在 MySQL / Postgres 上压才有意义）
+"""
+import http.client
+import importlib.util
+import itertools
+import json
+import shutil
+import socket
+import subprocess
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.test import Client
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+
+from .metrics import percentile
+
+LOAD_TARGETS = {}
+WRITE_TARGETS = {"attendance_mark"}
+
+SERVER_COMMANDS = {
+    "wsgi": ["gunicorn", "core.wsgi:application"],
+    "asgi": ["gunicorn", "core.asgi:application", "-k", "uvicorn_worker.UvicornWorker"],
+}
+SERVER_MODULES = {"wsgi": ("gunicorn",), "asgi": ("gunicorn", "uvicorn", "uvicorn_worker")}
+READY_TIMEOUT = 30
+
+
+def load_target(name):
+    """登记压测接口：函数接收 BenchmarkContext，返回 [(method, path, json_body 或 None)]"""
+    def deco(fn):
+        LOAD_TARGETS[name] = fn
+        return fn
+    return deco
+
+
+# —— 接口 ——
+@load_target("api_slots")
+def _api_slots(ctx):
+    slot = ctx.slot
+    query = urlencode({"campus_id": slot.course.campus_id, "semester_id": slot.semester_id, "weekday": slot.weekday})
+    return [("GET", f"{reverse('assistant_api_slots')}?{query}", None)]
+
+
+@load_target("api_subgroups")
+def _api_subgroups(ctx):
+    return [("GET", f"{reverse('assistant_api_subgroups')}?slot_id={ctx.slot.id}", None)]
+
+
+@load_target("attendance_table")
+def _attendance_table(ctx):
+    slot = ctx.slot
+    query = urlencode({"campus_id": slot.course.campus_id, "semester_id": slot.semester_id, "weekday": slot.weekday,
+                       "slot_id": slot.id, "subgroup_id": ctx.subgroup_id or ""})
+    return [("GET", f"{reverse('assistant_attendance_table')}?{query}", None)]
+
+
+@load_target("assistant_comments_api")
+def _assistant_comments(ctx):
+    if not ctx.subgroup_id:
+        return []
+    return [("GET", f"{reverse('assistant_comments_api')}?subgroup_id={ctx.subgroup_id}", None)]
+
+
+@load_target("attendance_mark")
+def _attendance_mark(ctx):
+    url = reverse("assistant_attendance_mark")
+    return [("POST", url, {"enrollment_id": eid, "course_slot_id": ctx.slot.id, "sub_group_id": None,
+                           "week_no": 1, "present": True})
+            for eid in ctx.enrollment_ids[:50]]
+
+
+def build_requests(ctx, *, only=None, include_writes=False):
+    """[(接口名, method, path, body)]，按接口轮流排开"""
+    per_target = []
+    for name, build in LOAD_TARGETS.items():
+        if (only and name not in only) or (name in WRITE_TARGETS and not include_writes):
+            continue
+        per_target.append([(name, *req) for req in build(ctx)])
+    rows = []
+    for group in itertools.zip_longest(*per_target):
+        rows.extend(r for r in group if r is not None)
+    return rows
+
+
+# —— 登录态 ——
+def _host_header():
+    hosts = [h.lstrip(".") for h in settings.ALLOWED_HOSTS if h not in ("*", ".")]
+    return hosts[0] if hosts else "localhost"
+
+
+def auth_headers(user):
+    """该用户的新 session + 一对 CSRF cookie / 头；按 HTTPS 反代后的请求发（X-Forwarded-Proto）"""
+    client = Client()
+    client.force_login(user)
+    csrf = get_random_string(32)
+    host = _host_header()
+    return {
+        "Host": host,
+        "Cookie": (f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}; "
+                   f"{settings.CSRF_COOKIE_NAME}={csrf}"),
+        "X-CSRFToken": csrf,
+        "X-Forwarded-Proto": "https",
+        "Origin": f"https://{host}",
+        "Referer": f"https://{host}/",
+    }
+
+
+# —— 压测 ——
+def _send(conn, headers, method, path, body):
+    if body is None:
+        conn.request(method, path, headers=headers)
+    else:
+        conn.request(method, path, body=json.dumps(body).encode("utf-8"),
+                     headers={**headers, "Content-Type": "application/json"})
+    resp = conn.getresponse()
+    resp.read()
+    return resp.status
+
+
+def run_load(base_url, requests, headers, *, concurrency=32, total=2000):
+    """
+    concurrency 个线程共发 total 个请求（按 requests 轮流），开始前每个请求先发一次预热（不计入）
+    返回 {"requests", "errors"(非 2xx), "status", "elapsed_s", "rps", "p50_ms", "p95_ms", "p99_ms",
+          "per_target"(各接口 p50)}
+    """
+    if not requests:
+        raise LookupError("没有可压的接口（数据库里没有时段 / 细分班？）")
+    parts = urlsplit(base_url)
+    counter = itertools.count()
+    lock = threading.Lock()
+    latencies, statuses, per_target = [], Counter(), {}
+
+    def connect():
+        return http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=60)
+
+    warm = connect()
+    for _, method, path, body in requests:
+        _send(warm, headers, method, path, body)
+    warm.close()
+
+    def worker():
+        conn = connect()
+        mine, codes, targets = [], Counter(), {}
+        try:
+            while True:
+                with lock:
+                    i = next(counter)
+                if i >= total:
+                    break
+                name, method, path, body = requests[i % len(requests)]
+                started = time.perf_counter()
+                try:
+                    status = _send(conn, headers, method, path, body)
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    conn = connect()
+                    status = "error"
+                ms = (time.perf_counter() - started) * 1000
+                mine.append(ms)
+                targets.setdefault(name, []).append(ms)
+                codes[status] += 1
+        finally:
+            conn.close()
+        with lock:
+            latencies.extend(mine)
+            statuses.update(codes)
+            for name, values in targets.items():
+                per_target.setdefault(name, []).extend(values)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lambda _: worker(), range(concurrency)))    # 线程里的异常在这里抛出
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": sum(n for code, n in statuses.items() if code == "error" or not 200 <= code < 300),
+        "status": {str(code): n for code, n in sorted(statuses.items(), key=str)},
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "per_target": {name: round(percentile(sorted(values), 50), 2) for name, values in sorted(per_target.items())},
+    }
+
+
+# —— 本机起服务 ——
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_ready(proc, port):
+    deadline = time.monotonic() + READY_TIMEOUT
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"服务进程退出（exit {proc.returncode}），看上面 gunicorn 的输出")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{READY_TIMEOUT}s 内服务没有起来")
+
+
+@contextmanager
+def serve(mode, *, workers=3):
+    """在空闲端口起 gunicorn（wsgi / asgi 两种 worker），yield base_url，退出时停掉"""
+    missing = [m for m in SERVER_MODULES[mode] if importlib.util.find_spec(m) is None]
+    if missing or shutil.which(SERVER_COMMANDS[mode][0]) is None:
+        raise RuntimeError(f"{mode} 模式需要安装 {', '.join(missing or SERVER_COMMANDS[mode][:1])}（见 requirements.txt）")
+    port = _free_port()
+    proc = subprocess.Popen(
+        [*SERVER_COMMANDS[mode], "--bind", f"127.0.0.1:{port}", "--workers", str(workers), "--timeout", "60"],
+        cwd=str(settings.BASE_DIR),
+    )
+    try:
+        _wait_ready(proc, port)
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
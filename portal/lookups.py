@@ -0,0 +1,53 @@
+# portal/lookups.py
+"""
+级联下拉（时段 / 细分班）的查询结果缓存
+
+数据只在后台改 Course / CourseSlot / SubGroup 时变化：
+所有结果共用一个 "timetable" 版本号，相关模型保存/删除时 bump。
+缓存的是序列化后的 JSON 和它的 ETag，命中时不再查库也不再序列化。
+接口是异步视图（ASGI 部署时不占线程）：缓存走 cache.aget/aset，查库用 async ORM 逐行迭代。
+"""
+import hashlib
+import json
+
+from .caching import NamespacedCache
+from .models import CourseSlot, SubGroup
+
+lookup_cache = NamespacedCache("lookup", timeout=24 * 3600, description="级联下拉：时段 / 细分班")
+TIMETABLE_SCOPE = "timetable"
+
+
+def bump_timetable_version():
+    lookup_cache.bump(TIMETABLE_SCOPE)
+
+
+async def acached_lookup(suffix, builder):
+    """返回 (body_bytes, etag)；suffix 由调用方按参数拼出，builder 是协程函数"""
+    ver = await lookup_cache.aversion(TIMETABLE_SCOPE)
+
+    async def build():
+        return _encode(await builder())
+
+    return await lookup_cache.aget_or_build(f"{suffix}:{ver}", build)
+
+
+def _encode(data):
+    body = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return body, f'"{hashlib.md5(body).hexdigest()}"'
+
+
+async def aslots_payload(campus_id, semester_id, weekday):
+    qs = CourseSlot.objects.filter(
+        semester_id=semester_id,
+        weekday=weekday,
+        course__campus_id=campus_id
+    ).select_related("course")
+    data = [{"id": s.id,
+             "label": f"{s.course.title} {s.start_time.strftime('%H:%M')}–{s.end_time.strftime('%H:%M')}"}
+            async for s in qs.order_by("start_time")]
+    return {"slots": data}
+
+
+async def asubgroups_payload(slot_id):
+    qs = SubGroup.objects.filter(course_slot_id=slot_id).order_by("id")
+    return {"subgroups": [{"id": g.id, "label": g.name} async for g in qs]}
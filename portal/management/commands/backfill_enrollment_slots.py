@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from portal.attendance import bump_matrix_version
+from portal.backfill import backfill_enrollment_slots
+from portal.models import Attendance, CourseSlot, Enrollment, SubGroup
+from portal.notices import rebuild_notice_inbox
+from portal.parent_context import bump_all_parent_contexts
+
+
+class Command(BaseCommand):
+    help = "回填旧报名/出勤的 course_slot、sub_group（仅唯一可推断时），并列出无法回填的行"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="只统计和报告，不写库")
+
+    def handle(self, *args, dry_run=False, **kwargs):
+        with transaction.atomic():
+            result = backfill_enrollment_slots(Enrollment, CourseSlot, SubGroup, Attendance, dry_run=dry_run)
+            if not dry_run and result["enrollment_slot"] + result["enrollment_subgroup"]:
+                # bulk_update 不发 signal：家长端上下文（时段 / 细分班）整体失效，公告收件箱全量重算
+                transaction.on_commit(bump_all_parent_contexts)
+                transaction.on_commit(rebuild_notice_inbox)
+            if not dry_run:
+                # 名单 / 细分班 / 出勤格子变了的时段：签到表缓存失效
+                for slot_id in result["slots"]:
+                    transaction.on_commit(lambda slot_id=slot_id: bump_matrix_version(slot_id))
+
+        prefix = "[dry-run] " if dry_run else ""
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}Enrollment.course_slot: {result['enrollment_slot']}  "
+            f"Enrollment.sub_group: {result['enrollment_subgroup']}  "
+            f"Attendance.sub_group: {result['attendance_subgroup']}"
+        ))
+        unresolved = result["unresolved"]
+        if not unresolved:
+            self.stdout.write("没有无法回填的行，可以打开 ENROLLMENT_STRICT_SLOT_FILTER。")
+            return
+        self.stdout.write(self.style.WARNING(f"{len(unresolved)} 行无法回填（需在后台手动处理）："))
+        for model, pk, reason in unresolved:
+            self.stdout.write(f"  {model}#{pk}: {reason}")
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from portal.slowlog import explain_pending, prune_slow_queries
+
+
+class Command(BaseCommand):
+    help = "给还没有执行计划的慢查询补跑 EXPLAIN，并把 SlowQuery 表裁到 SLOW_QUERY_MAX_ROWS"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=100)
+
+    def handle(self, *args, limit=100, **kwargs):
+        explained = explain_pending(limit)
+        pruned = prune_slow_queries()
+        self.stdout.write(self.style.SUCCESS(f"EXPLAIN {explained} 条，删除 {pruned} 条旧记录"))
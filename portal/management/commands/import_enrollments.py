@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from portal.imports import BATCH_SIZE, ImportFileError, import_enrollments
+
+
+class Command(BaseCommand):
+    help = "从 CSV / XLSX 批量导入学生和报名（表头见 portal/imports.py）；先用 --dry-run 看报告"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help=".csv 或 .xlsx 文件")
+        parser.add_argument("--dry-run", action="store_true", help="只校验并输出报告，不写库")
+        parser.add_argument("--skip-errors", action="store_true", help="跳过错误行，写入其余行（默认有错误就全部不写）")
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+        parser.add_argument("--verbose-rows", action="store_true", help="逐行列出将新建 / 已存在的行")
+
+    def handle(self, path, *, dry_run=False, skip_errors=False, batch_size=BATCH_SIZE, verbose_rows=False, **kwargs):
+        try:
+            with open(path, "rb") as fp:
+                report = import_enrollments(fp, path, commit=not dry_run, allow_errors=skip_errors,
+                                            batch_size=batch_size)
+        except (OSError, ImportFileError) as exc:
+            raise CommandError(str(exc))
+
+        for line, action, message in report.rows:
+            if action == "error":
+                self.stdout.write(self.style.ERROR(f"  第 {line} 行：{message}"))
+            elif verbose_rows:
+                self.stdout.write(f"  第 {line} 行 [{action}] {message}")
+
+        prefix = "[dry-run] " if dry_run else ""
+        self.stdout.write(self.style.SUCCESS(f"{prefix}{report.summary()}"))
+        if dry_run:
+            return
+        if report.committed:
+            self.stdout.write(self.style.SUCCESS("已写入。"))
+        elif report.errors:
+            raise CommandError(f"{len(report.errors)} 行有错误，未写入任何数据（修正后重试，或加 --skip-errors）")
+        else:
+            self.stdout.write("没有需要新建的报名。")
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from portal.attendance import SUMMARY_FIELDS, compute_attendance_summaries, refresh_attendance_summaries
+from portal.models import Enrollment, EnrollmentAttendanceSummary
+
+
+class Command(BaseCommand):
+    help = "按 Attendance 重算每个报名的出勤汇总；--check 只比对、不写库（有不一致时返回非 0）"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--check", action="store_true", help="只校验汇总表与出勤记录是否一致")
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, check=False, batch_size=500, **kwargs):
+        ids = list(Enrollment.objects.order_by("id").values_list("id", flat=True))
+        batches = [ids[i:i + batch_size] for i in range(0, len(ids), batch_size)]
+
+        if not check:
+            total = 0
+            for batch in batches:
+                with transaction.atomic():
+                    total += refresh_attendance_summaries(batch)
+            self.stdout.write(self.style.SUCCESS(f"已重算 {total} 个报名的出勤汇总"))
+            return
+
+        mismatched = []
+        for batch in batches:
+            stored = {row[0]: dict(zip(SUMMARY_FIELDS, row[1:])) for row in
+                      EnrollmentAttendanceSummary.objects.filter(enrollment_id__in=batch)
+                      .values_list("enrollment_id", *SUMMARY_FIELDS)}
+            for eid, expected in compute_attendance_summaries(batch).items():
+                if stored.get(eid) != expected:
+                    mismatched.append((eid, stored.get(eid), expected))
+
+        if not mismatched:
+            self.stdout.write(self.style.SUCCESS(f"{len(ids)} 个报名的出勤汇总全部一致"))
+            return
+        for eid, got, expected in mismatched[:50]:
+            self.stdout.write(f"  Enrollment#{eid}: 汇总 {got}，应为 {expected}")
+        raise CommandError(f"{len(mismatched)} 个报名的出勤汇总不一致，运行 rebuild_attendance_summaries 修复")
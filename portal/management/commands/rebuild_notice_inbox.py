@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from portal.notices import rebuild_notice_inbox
+
+
+class Command(BaseCommand):
+    help = "按公告受众和当前报名全量重算家长公告收件箱（只增删差集，已读状态保留）"
+
+    def handle(self, *args, **kwargs):
+        with transaction.atomic():
+            added, removed = rebuild_notice_inbox(log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(f"收件箱：新增 {added}，删除 {removed}"))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from portal.search import get_backend, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "全量重建评论 / 公告 / 学习资料的全文检索文档（bulk 写入之后、或改过文档规则之后运行）"
+
+    def handle(self, *args, **kwargs):
+        with transaction.atomic():
+            total = rebuild_search_index(log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(f"已写入 {total} 个检索文档（{get_backend().name}）"))
@@ -0,0 +1,47 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from portal.benchmarks import SCENARIOS, compare_reports, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = "对当前数据库跑热点接口基准（耗时 / SQL 条数），输出 JSON 报告；--compare 与旧报告对比"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--output", "-o", help="报告写到文件（默认打印到 stdout）")
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--only", nargs="+", choices=sorted(SCENARIOS), help="只跑这些场景")
+        parser.add_argument("--compare", metavar="OLD_JSON", help="与之前的报告对比 SQL 条数和 p50")
+
+    def handle(self, *args, output=None, repeat=5, only=None, compare=None, **options):
+        # 测试客户端的 Host 是 testserver，需要临时放进 ALLOWED_HOSTS（manage.py test 里已经设置过）
+        try:
+            setup_test_environment()
+            own_environment = True
+        except RuntimeError:
+            own_environment = False
+        try:
+            report = run_benchmarks(only=only, repeat=max(repeat, 1),
+                                    log=self.stderr.write if options["verbosity"] > 1 else None)
+        except LookupError as exc:
+            raise CommandError(str(exc))
+        finally:
+            if own_environment:
+                teardown_test_environment()
+
+        text = json.dumps(report, indent=2, ensure_ascii=False)
+        if output:
+            with open(output, "w", encoding="utf-8") as fp:
+                fp.write(text + "\n")
+            self.stdout.write(self.style.SUCCESS(f"报告已写入 {output}"))
+        else:
+            self.stdout.write(text)
+
+        if compare:
+            with open(compare, encoding="utf-8") as fp:
+                old = json.load(fp)
+            for name, key, before, after in compare_reports(old, report):
+                flag = "" if after <= before else self.style.WARNING("  ↑")
+                self.stdout.write(f"{name:40} {key:8} {before:>10} → {after:<10}{flag}")
@@ -0,0 +1,63 @@
+import signal
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from portal.export_jobs import claim_next_job, purge_old_jobs, requeue_stale_jobs, run_job, worker_name
+
+
+class Command(BaseCommand):
+    help = "后台任务 worker：轮询 ExportJob 表执行导出 / 公告收件箱扇出等任务（docker-compose 里的 export-worker 服务）"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="把当前队列跑完就退出（cron / 测试用）")
+        parser.add_argument("--sleep", type=float,
+                            default=getattr(settings, "EXPORT_WORKER_POLL_SECONDS", 2.0),
+                            help="队列为空时的轮询间隔（秒）")
+        parser.add_argument("--stale-seconds", type=int,
+                            default=getattr(settings, "EXPORT_JOB_STALE_SECONDS", 300),
+                            help="RUNNING 任务心跳超过这么久没刷新视为 worker 已崩溃，放回队列")
+        parser.add_argument("--maintenance-seconds", type=float,
+                            default=getattr(settings, "EXPORT_WORKER_MAINTENANCE_SECONDS", 300),
+                            help="每隔这么久放回心跳过期的任务、清理过期任务")
+
+    def handle(self, *args, once=False, sleep=2.0, stale_seconds=300, maintenance_seconds=300, **kwargs):
+        self._stop = False
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+
+        name = worker_name()
+        stale_after = timedelta(seconds=stale_seconds)
+        next_maintenance = 0.0
+
+        while not self._stop:
+            close_old_connections()    # 长驻进程：丢掉超时/断开的数据库连接
+            if time.monotonic() >= next_maintenance:
+                # 启动时跑一次，之后定期跑：别的 worker 崩溃留下的任务不用等重启才回队列
+                self._maintain(stale_after)
+                next_maintenance = time.monotonic() + maintenance_seconds
+            job = claim_next_job(name)
+            if job is None:
+                if once:
+                    break
+                time.sleep(sleep)
+                continue
+            result = run_job(job)
+            if result is None:
+                self.stdout.write(self.style.WARNING(f"{job} 心跳过期已被放回队列，丢弃本次结果"))
+                continue
+            style = self.style.SUCCESS if result.status == result.Status.DONE else self.style.ERROR
+            self.stdout.write(style(f"{result} rows={result.row_count} {result.error}".rstrip()))
+
+    def _maintain(self, stale_after):
+        requeued = requeue_stale_jobs(stale_after)
+        if requeued:
+            self.stdout.write(self.style.WARNING(f"{requeued} 个中断的任务已放回队列"))
+        purge_old_jobs()
+
+    def _request_stop(self, signum, frame):
+        # 当前任务跑完再退出
+        self._stop = True
@@ -0,0 +1,75 @@
+import json
+import platform
+from datetime import datetime
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+
+from portal.benchmarks import BenchmarkContext
+from portal.loadtest import LOAD_TARGETS, SERVER_COMMANDS, auth_headers, build_requests, run_load, serve
+
+
+class Command(BaseCommand):
+    help = "JSON 接口并发压测：本机分别以 WSGI / ASGI 起 gunicorn 对比吞吐，或 --url 压一个在跑的服务"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--mode", choices=[*SERVER_COMMANDS, "both"], default="both")
+        parser.add_argument("--url", help="压已经在跑的服务（如 http://127.0.0.1:8000），不自己起服务")
+        parser.add_argument("--workers", type=int, default=3, help="自己起服务时的 gunicorn worker 数")
+        parser.add_argument("--concurrency", "-c", type=int, default=32)
+        parser.add_argument("--requests", "-n", type=int, default=2000)
+        parser.add_argument("--only", nargs="+", choices=sorted(LOAD_TARGETS), help="只压这些接口")
+        parser.add_argument("--include-writes", action="store_true", help="加上打勾接口（会真的写出勤）")
+        parser.add_argument("--output", "-o", help="报告写到文件（默认打印到 stdout）")
+
+    def handle(self, *args, mode="both", url=None, workers=3, concurrency=32, requests=2000, only=None,
+               include_writes=False, output=None, **options):
+        try:
+            ctx = BenchmarkContext()
+        except LookupError as exc:
+            raise CommandError(str(exc))
+        if ctx.assistant is None:
+            raise CommandError("数据库里没有可用的助教账号")
+        reqs = build_requests(ctx, only=only, include_writes=include_writes)
+        headers = auth_headers(ctx.assistant)
+        kwargs = {"concurrency": max(concurrency, 1), "total": max(requests, 1)}
+
+        results = {}
+        try:
+            if url:
+                results["url"] = run_load(url, reqs, headers, **kwargs)
+            else:
+                for m in (SERVER_COMMANDS if mode == "both" else [mode]):
+                    self.stderr.write(f"{m}: gunicorn × {workers} workers, {kwargs['concurrency']} 并发 ...")
+                    with serve(m, workers=workers) as base_url:
+                        results[m] = run_load(base_url, reqs, headers, **kwargs)
+        except (LookupError, RuntimeError) as exc:
+            raise CommandError(str(exc))
+
+        report = {
+            "meta": {
+                "created_at": datetime.now().isoformat(timespec="seconds"),
+                "django": django.get_version(),
+                "python": platform.python_version(),
+                "workers": None if url else workers,
+                "targets": sorted({r[0] for r in reqs}),
+                "slot_id": ctx.slot.id,
+                "slot_enrollments": len(ctx.enrollment_ids),
+                **kwargs,
+            },
+            "results": results,
+        }
+        text = json.dumps(report, indent=2, ensure_ascii=False)
+        if output:
+            with open(output, "w", encoding="utf-8") as fp:
+                fp.write(text + "\n")
+            self.stdout.write(self.style.SUCCESS(f"报告已写入 {output}"))
+        else:
+            self.stdout.write(text)
+
+        for name, r in results.items():
+            flag = self.style.WARNING(f"  {r['errors']} errors") if r["errors"] else ""
+            self.stdout.write(f"{name:6} {r['rps']:>9} req/s   p50 {r['p50_ms']:>8} ms   p95 {r['p95_ms']:>8} ms   "
+                              f"p99 {r['p99_ms']:>8} ms{flag}")
+        if {"wsgi", "asgi"} <= results.keys() and results["wsgi"]["rps"]:
+            self.stdout.write(f"asgi / wsgi 吞吐比：{results['asgi']['rps'] / results['wsgi']['rps']:.2f}")
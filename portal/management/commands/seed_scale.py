@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from portal.seeding import DEFAULTS, flush_scale_data, seed_scale
+
+
+class Command(BaseCommand):
+    help = "生成压测规模的数据（多校区 / 多学期 / 数千家长 + 出勤历史），全部 bulk insert；见 portal/seeding.py"
+
+    def add_arguments(self, parser):
+        for key, default in DEFAULTS.items():
+            option = "--" + key.replace("_", "-")
+            parser.add_argument(option, dest=key, type=type(default), default=default, help=f"默认 {default}")
+        parser.add_argument("--flush", action="store_true", help="先删除同 prefix 之前生成的数据")
+
+    def handle(self, *args, flush=False, **options):
+        opts = {key: options[key] for key in DEFAULTS}
+        if flush:
+            self.stdout.write(f"已删除 {flush_scale_data(opts['prefix'])} 行旧数据")
+        counts = seed_scale(log=self.stdout.write if options["verbosity"] > 1 else None, **opts)
+        self.stdout.write(self.style.SUCCESS(
+            "Seeded: " + ", ".join(f"{k}={v}" for k, v in counts.items())
+        ))
+        self.stdout.write(f"账号：{opts['prefix']}_assistant_N / {opts['prefix']}_parent_N（密码不可用，需后台重置或用 run_benchmarks）")
@@ -0,0 +1,193 @@
+# portal/metrics.py
+"""
+按 URL 名统计每个请求的 耗时 / SQL 条数 / SQL 耗时（线上 DEBUG 关闭、没有 APM 时用）
+
+- RequestMetricsMiddleware：REQUEST_METRICS_ENABLED=False 时直接不挂载（零开销）
+- SQL 通过 connection.execute_wrapper 计数计时，不依赖 DEBUG
+- 每个 URL 名在共享缓存里存一个环形缓冲区（最近 REQUEST_METRICS_WINDOW 个样本）：
+  cache.incr 拿槽位号再写入该槽，多个 worker 并发也不会互相覆盖整段数据
+- REQUEST_METRICS_SERVER_TIMING=True 时加 Server-Timing 响应头，浏览器 devtools 里直接看
+- 流式响应（导出）只计到响应对象返回为止，不含逐块生成的时间
+- 同时支持同步 / 异步（ASGI）调用链，不逼 Django 为每个请求切线程：异步视图的查询在 sync_to_async
+  的线程里执行，那条连接不归中间件所在的线程管，所以每条连接挂一个常驻 execute_wrapper，
+  转给 contextvar 里当前请求登记的 wrapper（contextvar 会跟进 sync_to_async 的线程）
+"""
+import contextvars
+import math
+import time
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+
+PREFIX = "reqmetrics"
+NAMES_KEY = f"{PREFIX}:names"
+SAMPLE_TIMEOUT = 7 * 24 * 3600
+
+
+_request_wrappers = contextvars.ContextVar("request_query_wrappers", default=())
+
+
+# —— 异步请求的 SQL 钩子 ——
+def _dispatch(execute, sql, params, many, context, wrappers=None):
+    wrappers = _request_wrappers.get() if wrappers is None else wrappers
+    if not wrappers:
+        return execute(sql, params, many, context)
+    inner = lambda *args: _dispatch(execute, *args, wrappers=wrappers[1:])
+    return wrappers[0](inner, sql, params, many, context)
+
+
+def _install_hook(sender=None, connection=None, **kwargs):
+    if _dispatch not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, _dispatch)
+
+
+def install_request_hooks():
+    """新连接建立时挂上；当前线程已经建立的连接（测试、runserver）也补挂"""
+    connection_created.connect(_install_hook, dispatch_uid="portal.metrics.request_hooks")
+    for conn in connections.all(initialized_only=True):
+        _install_hook(connection=conn)
+
+
+@contextmanager
+def request_execute_wrapper(wrapper):
+    """异步版 connection.execute_wrapper：本请求（含 sync_to_async 的线程）里的所有查询都经过 wrapper"""
+    token = _request_wrappers.set((*_request_wrappers.get(), wrapper))
+    try:
+        yield
+    finally:
+        _request_wrappers.reset(token)
+
+
+def _window():
+    return getattr(settings, "REQUEST_METRICS_WINDOW", 200)
+
+
+class QueryTimer:
+    """execute_wrapper：累计本请求的 SQL 条数和耗时"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+
+
+def record_sample(name, wall_ms, queries, db_ms):
+    """写入一个样本（一次 incr + 一次 set）"""
+    key = f"{PREFIX}:{name}:n"
+    try:
+        n = cache.incr(key)
+    except ValueError:
+        n = 1 if cache.add(key, 1, None) else cache.incr(key)
+    if (n - 1) % _window() == 0:
+        # 第一个样本、以及每转一圈确认一次名字已登记（缓存被清空 / 重置后能自愈）
+        _register_name(name)
+    cache.set(f"{PREFIX}:{name}:{n % _window()}", (round(wall_ms, 2), queries, round(db_ms, 2)), SAMPLE_TIMEOUT)
+
+
+def _register_name(name):
+    names = cache.get(NAMES_KEY) or set()
+    if name not in names:
+        cache.set(NAMES_KEY, names | {name}, None)
+
+
+def percentile(values, pct):
+    """最近秩法；values 已排序"""
+    if not values:
+        return None
+    return values[max(0, math.ceil(pct / 100 * len(values)) - 1)]
+
+
+def summarize(name):
+    """{"name", "count", "wall_p50/p95/p99", "queries_p50/p95/max", "db_p50/p95"}；没有样本时返回 None"""
+    total = cache.get(f"{PREFIX}:{name}:n") or 0
+    samples = [s for s in cache.get_many([f"{PREFIX}:{name}:{i}" for i in range(_window())]).values() if s]
+    if not samples:
+        return None
+    wall = sorted(s[0] for s in samples)
+    queries = sorted(s[1] for s in samples)
+    db = sorted(s[2] for s in samples)
+    return {
+        "name": name, "count": total, "window": len(samples),
+        "wall_p50": percentile(wall, 50), "wall_p95": percentile(wall, 95), "wall_p99": percentile(wall, 99),
+        "queries_p50": percentile(queries, 50), "queries_p95": percentile(queries, 95), "queries_max": queries[-1],
+        "db_p50": percentile(db, 50), "db_p95": percentile(db, 95),
+    }
+
+
+def all_summaries():
+    rows = [summarize(name) for name in sorted(cache.get(NAMES_KEY) or ())]
+    return sorted((r for r in rows if r), key=lambda r: r["wall_p95"], reverse=True)
+
+
+def reset_metrics():
+    names = cache.get(NAMES_KEY) or ()
+    keys = [NAMES_KEY]
+    for name in names:
+        keys.append(f"{PREFIX}:{name}:n")
+        keys.extend(f"{PREFIX}:{name}:{i}" for i in range(_window()))
+    cache.delete_many(keys)
+
+
+class RequestMetricsMiddleware:
+    """放在 MIDDLEWARE 靠前的位置，计入后面所有中间件和视图的耗时"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, "REQUEST_METRICS_ENABLED", False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.server_timing = getattr(settings, "REQUEST_METRICS_SERVER_TIMING", False)
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+            install_request_hooks()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        timer = QueryTimer()
+        started = time.perf_counter()
+        with connection.execute_wrapper(timer):
+            response = self.get_response(request)
+        wall_ms = (time.perf_counter() - started) * 1000
+        self._record(request, wall_ms, timer)
+        return self._add_header(response, wall_ms, timer)
+
+    async def __acall__(self, request):
+        timer = QueryTimer()
+        started = time.perf_counter()
+        with request_execute_wrapper(timer):
+            response = await self.get_response(request)
+        wall_ms = (time.perf_counter() - started) * 1000
+        # 写样本走同步缓存接口（Django 的 cache.a* 也只是包一层线程），不阻塞事件循环
+        await sync_to_async(self._record, thread_sensitive=False)(request, wall_ms, timer)
+        return self._add_header(response, wall_ms, timer)
+
+    def _record(self, request, wall_ms, timer):
+        match = getattr(request, "resolver_match", None)
+        if match is not None:
+            # 统计本身出错不能影响请求
+            try:
+                record_sample(match.view_name, wall_ms, timer.count, timer.duration * 1000)
+            except Exception:
+                pass
+
+    def _add_header(self, response, wall_ms, timer):
+        db_ms = timer.duration * 1000
+        if self.server_timing:
+            response["Server-Timing"] = (f'app;dur={wall_ms:.1f}, '
+                                         f'db;dur={db_ms:.1f};desc="{timer.count} queries"')
+        return response
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0010_rename_resource_learningresourceitem_learning_resource_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='semester',
+            name='holiday_weeks',
+            field=models.CharField(blank=True, default='', help_text='停课的日历周，逗号分隔，如 4,5（从开学那周算第 1 周）', max_length=100),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:15
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0011_semester_holiday_weeks'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='attendance',
+            index=models.Index(fields=['course_slot', 'sub_group', 'week_no'], name='att_slot_sg_week_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='enrollment',
+            index=models.Index(fields=['status', 'course_slot'], name='enroll_status_slot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='enrollment',
+            index=models.Index(fields=['status', 'course', 'semester'], name='enroll_status_course_sem_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='enrollment',
+            index=models.Index(condition=models.Q(('course_slot__isnull', True)), fields=['course', 'semester'], name='enroll_legacy_noslot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='enrollment',
+            index=models.Index(fields=['parent', 'status'], name='enroll_parent_status_idx'),
+        ),
+    ]
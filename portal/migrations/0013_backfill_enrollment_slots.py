@@ -0,0 +1,36 @@
+from django.db import migrations
+
+
+def forwards(apps, schema_editor):
+    from django.db import transaction
+    from portal.attendance import bump_matrix_version
+    from portal.backfill import backfill_enrollment_slots
+    from portal.parent_context import bump_all_parent_contexts
+
+    result = backfill_enrollment_slots(
+        apps.get_model("portal", "Enrollment"),
+        apps.get_model("portal", "CourseSlot"),
+        apps.get_model("portal", "SubGroup"),
+        apps.get_model("portal", "Attendance"),
+    )
+
+    # bulk_update 不发 signal：迁移提交后让签到表 / 家长端的缓存失效（只动缓存版本号，不查库）
+    def bump_caches():
+        for slot_id in result["slots"]:
+            bump_matrix_version(slot_id)
+        if result["enrollment_slot"] + result["enrollment_subgroup"]:
+            bump_all_parent_contexts()
+
+    transaction.on_commit(bump_caches, using=schema_editor.connection.alias)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("portal", "0012_hot_query_indexes"),
+    ]
+
+    operations = [
+        # 只补能唯一推断的值；无法回填的行用 manage.py backfill_enrollment_slots --dry-run 查看
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def forwards(apps, schema_editor):
+    from portal.attendance import refresh_attendance_summaries
+
+    Enrollment = apps.get_model("portal", "Enrollment")
+    ids = list(Enrollment.objects.order_by("id").values_list("id", flat=True))
+    for i in range(0, len(ids), 500):
+        refresh_attendance_summaries(
+            ids[i:i + 500],
+            Attendance=apps.get_model("portal", "Attendance"),
+            Enrollment=Enrollment,
+            Summary=apps.get_model("portal", "EnrollmentAttendanceSummary"),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0013_backfill_enrollment_slots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EnrollmentAttendanceSummary',
+            fields=[
+                ('enrollment', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='attendance_summary', serialize=False, to='portal.enrollment')),
+                ('present', models.PositiveSmallIntegerField(default=0)),
+                ('absent', models.PositiveSmallIntegerField(default=0)),
+                ('late', models.PositiveSmallIntegerField(default=0)),
+                ('weeks', models.CharField(blank=True, default='', max_length=64)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Attendance summary',
+                'verbose_name_plural': 'Attendance summaries',
+            },
+        ),
+        # 已有出勤数据的汇总；之后可用 manage.py rebuild_attendance_summaries --check 校验
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:45
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def forwards(apps, schema_editor):
+    from portal.models import normalize_visible_to, notice_audience_key
+
+    ClassNotice = apps.get_model("portal", "ClassNotice")
+    rows = ClassNotice.objects.only("id", "course_slot_id", "sub_group_id", "visible_to").order_by("id")
+    batch = []
+    for n in rows.iterator(chunk_size=2000):
+        n.visible_to = normalize_visible_to(n.visible_to)
+        n.audience_key = notice_audience_key(n.course_slot_id, n.sub_group_id, n.visible_to == "PAID")
+        batch.append(n)
+        if len(batch) >= 2000:
+            ClassNotice.objects.bulk_update(batch, ["visible_to", "audience_key"])
+            batch = []
+    if batch:
+        ClassNotice.objects.bulk_update(batch, ["visible_to", "audience_key"])
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0016_slow_query'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='classnotice',
+            name='audience_key',
+            field=models.CharField(blank=True, default='', editable=False, max_length=40),
+        ),
+        # visible_to 的历史写法（PAID_ONLY / paid_only / 空值…）统一成 PAID / ALL，同时填 audience_key
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='classnotice',
+            index=models.Index(fields=['audience_key', 'is_active'], name='notice_audience_idx'),
+        ),
+    ]
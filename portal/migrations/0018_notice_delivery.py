@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def forwards(apps, schema_editor):
+    from portal.notices import rebuild_notice_inbox
+
+    NoticeDelivery = apps.get_model("portal", "NoticeDelivery")
+    rebuild_notice_inbox(
+        ClassNotice=apps.get_model("portal", "ClassNotice"),
+        Enrollment=apps.get_model("portal", "Enrollment"),
+        NoticeDelivery=NoticeDelivery,
+    )
+    # 上线前的公告家长已经在旧页面上看过，不算未读
+    NoticeDelivery.objects.update(read_at=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0017_notice_audience_key'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NoticeDelivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('is_active', models.BooleanField(default=True)),
+                ('is_pinned', models.BooleanField(default=False)),
+                ('posted_at', models.DateTimeField()),
+                ('read_at', models.DateTimeField(blank=True, null=True)),
+                ('notice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='portal.classnotice')),
+                ('parent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notice_deliveries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['parent', 'is_active', 'is_pinned', 'posted_at'], name='delivery_inbox_idx'), models.Index(fields=['parent', 'is_active', 'read_at'], name='delivery_unread_idx')],
+                'constraints': [models.UniqueConstraint(fields=('notice', 'parent'), name='uniq_notice_delivery')],
+            },
+        ),
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
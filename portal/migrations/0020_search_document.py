@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-17 17:56
+
+from django.db import migrations, models
+
+
+def create_index(apps, schema_editor):
+    from portal.search import create_fulltext_index
+
+    create_fulltext_index(schema_editor)
+
+
+def drop_index(apps, schema_editor):
+    from portal.search import drop_fulltext_index
+
+    drop_fulltext_index(schema_editor)
+
+
+def backfill(apps, schema_editor):
+    from portal.search import rebuild_search_index
+
+    rebuild_search_index(apps=apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0019_comment_history_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=30)),
+                ('object_id', models.PositiveIntegerField()),
+                ('title', models.CharField(blank=True, default='', max_length=255)),
+                ('body', models.TextField(blank=True, default='')),
+                ('context', models.CharField(blank=True, default='', max_length=500)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('kind', 'object_id'), name='uniq_search_document')],
+            },
+        ),
+        # 按数据库建全文索引（SQLite FTS5 / MySQL FULLTEXT / Postgres tsvector），见 portal/search.py
+        migrations.RunPython(create_index, drop_index),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-17 18:28
+
+import portal.storage
+from django.db import migrations, models
+
+
+def move_files_to_private(apps, schema_editor):
+    """已生成的导出文件从 default_storage（公开的 MEDIA_ROOT）挪到私有存储"""
+    from django.core.files.storage import default_storage
+    from portal.storage import private_storage
+
+    ExportJob = apps.get_model("portal", "ExportJob")
+    for job in ExportJob.objects.exclude(file="").exclude(file=None).only("id", "file"):
+        name = job.file.name
+        if not default_storage.exists(name):
+            continue
+        with default_storage.open(name, "rb") as fp:
+            new_name = private_storage.save(name, fp)
+        default_storage.delete(name)
+        if new_name != name:
+            ExportJob.objects.filter(pk=job.pk).update(file=new_name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portal', '0020_search_document'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='exportjob',
+            name='file',
+            field=models.FileField(blank=True, null=True, storage=portal.storage.get_private_storage, upload_to='exports/'),
+        ),
+        migrations.RunPython(move_files_to_private, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,10 @@
 from django.db import models
 from django.conf import settings
 from datetime import date, timedelta
+from functools import lru_cache
+import calendar
 from django.core.exceptions import ValidationError
+from .storage import get_private_storage
 User = settings.AUTH_USER_MODEL
 
 # —— 基础维度 ——
@@ -15,9 +18,30 @@ class Semester(models.Model):
     name = models.CharField(max_length=120)
     start_date = models.DateField()              # Week1 起始周的周一
     week_count = models.PositiveSmallIntegerField(default=10)
+    # 放假/停课的日历周（从 start_date 那周算第 1 周），如 "4,5"；上课周 Week N 会顺延跳过这些周
+    holiday_weeks = models.CharField(max_length=100, blank=True, default="",
+                                     help_text="停课的日历周，逗号分隔，如 4,5（从开学那周算第 1 周）")
     is_active = models.BooleanField(default=True)
     def __str__(self): return f"{self.name} @ {self.campus}"
 
+    def clean(self):
+        super().clean()
+        try:
+            self.holiday_week_set()
+        except ValueError:
+            raise ValidationError({"holiday_weeks": "请填写逗号分隔的正整数，如 4,5"})
+
+    def holiday_week_set(self):
+        weeks = {int(w) for w in self.holiday_weeks.replace("，", ",").split(",") if w.strip()}
+        if any(w < 1 for w in weeks):
+            raise ValueError("holiday week must be >= 1")
+        return frozenset(weeks)
+
+    def calendar(self, weekday):
+        """该学期某个上课日(1..7)的周历，见 SemesterCalendar"""
+        return semester_calendar(self.id, self.start_date, self.week_count,
+                                 self.holiday_week_set(), weekday)
+
 class Course(models.Model):
     campus = models.ForeignKey(Campus, on_delete=models.CASCADE)
     title = models.CharField(max_length=200)
@@ -86,6 +110,21 @@ class Enrollment(models.Model):
     status = models.CharField(max_length=16, choices=STATUS_CHOICES, default="PENDING")
     paid_status = models.CharField(max_length=16, choices=[("UNPAID","UNPAID"),("PAID","PAID")], default="UNPAID")
     created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        # 对应 portal/views.py 的热点查询
+        indexes = [
+            # 签到表 / 导出 / 批量打勾：status=APPROVED AND course_slot_id=?
+            models.Index(fields=["status", "course_slot"], name="enroll_status_slot_idx"),
+            # 旧数据兼容分支：status=APPROVED AND course_slot IS NULL AND course_id=? AND semester_id=?
+            models.Index(fields=["status", "course", "semester"], name="enroll_status_course_sem_idx"),
+            # 同上，只索引 course_slot 为空的旧行（Postgres/SQLite 才建；MySQL 不支持部分索引，用上一条）
+            models.Index(fields=["course", "semester"], condition=models.Q(course_slot__isnull=True),
+                         name="enroll_legacy_noslot_idx"),
+            # 家长端每个页面：parent_id=? AND status=APPROVED
+            models.Index(fields=["parent", "status"], name="enroll_parent_status_idx"),
+        ]
+
     def clean(self):
         super().clean()
         # —— 自动把 student.parent 写进 parent（报名视图或 admin 都适用）
@@ -112,16 +151,107 @@ class Attendance(models.Model):
 
     class Meta:
         unique_together = ("enrollment", "course_slot", "week_no", "sub_group")
+        indexes = [
+            # 签到表 / 导出：course_slot_id=? AND (sub_group_id=? OR IS NULL) AND week_no<=?
+            models.Index(fields=["course_slot", "sub_group", "week_no"], name="att_slot_sg_week_idx"),
+        ]
 
     def __str__(self):
         return f"A#{self.id} E{self.enrollment_id} W{self.week_no} {self.status}"
 
+
+# —— 出勤汇总（每个报名一行的冗余表，由 portal/attendance.py 的 refresh_attendance_summaries 维护） ——
+class EnrollmentAttendanceSummary(models.Model):
+    WEEK_CODES = {"PRESENT": "P", "ABSENT": "A", "LATE": "L"}
+    UNMARKED = "-"
+
+    enrollment = models.OneToOneField(Enrollment, on_delete=models.CASCADE, primary_key=True,
+                                      related_name="attendance_summary")
+    present = models.PositiveSmallIntegerField(default=0)
+    absent = models.PositiveSmallIntegerField(default=0)
+    late = models.PositiveSmallIntegerField(default=0)
+    # 第 i 位 = 第 i+1 周：P / A / L，"-" 表示未点名
+    weeks = models.CharField(max_length=64, blank=True, default="")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Attendance summary"
+        verbose_name_plural = "Attendance summaries"
+
+    def __str__(self):
+        return f"E{self.enrollment_id} P{self.present} A{self.absent} L{self.late}"
+
+    @property
+    def marked(self):
+        return self.present + self.absent + self.late
+
+    @property
+    def rate(self):
+        """出勤率（迟到也算到课），0~100；还没点过名时为 None"""
+        if not self.marked:
+            return None
+        return round((self.present + self.late) * 100 / self.marked, 1)
+
 # —— 工具函数：给定 week_no 和 slot.weekday 计算日期（周一起算） ——
 def compute_date_for_week(semester_start: date, week_no: int, weekday_1_to_7: int) -> date:
     # semester_start 是 Week1 的周一
     return semester_start + timedelta(weeks=week_no - 1, days=weekday_1_to_7 - 1)
 
+
+class SemesterCalendar:
+    """
+    一个 (学期, 周几) 的预计算周历：每个上课周的 日期 / 表头文字("Tue 07/22")
+    week_no 是上课周序号，遇到放假周自动顺延
+    用 Semester.calendar(weekday) 获取（按学期字段值做进程内缓存）
+    """
+    def __init__(self, start_date, week_count, holiday_weeks, weekday):
+        self.start_date = start_date
+        self.weekday = weekday
+        self.weeks = list(range(1, week_count + 1))
+        self.dates = {}
+        cal_week = 0
+        for w in self.weeks:
+            cal_week += 1
+            while cal_week in holiday_weeks:
+                cal_week += 1
+            self.dates[w] = compute_date_for_week(start_date, cal_week, weekday)
+        # 生成 "Tue 07/22"
+        self.labels = {w: f"{calendar.day_abbr[d.weekday()]} {d.strftime('%m/%d')}" for w, d in self.dates.items()}
+
+    def date_of(self, week_no):
+        d = self.dates.get(week_no)
+        if d is None:
+            # 超出学期周数（旧数据）时从最后一个上课周往后连续推算
+            if not self.weeks:
+                return compute_date_for_week(self.start_date, week_no, self.weekday)
+            last = self.weeks[-1]
+            d = self.dates[last] + timedelta(weeks=week_no - last)
+        return d
+
+    def label_of(self, week_no):
+        d = self.date_of(week_no)
+        return self.labels.get(week_no) or f"{calendar.day_abbr[d.weekday()]} {d.strftime('%m/%d')}"
+
+    def is_future(self, week_no, today=None):
+        return self.date_of(week_no) > (today or date.today())
+
+
+@lru_cache(maxsize=512)
+def semester_calendar(semester_id, start_date, week_count, holiday_weeks, weekday):
+    # 参数里带上所有会影响结果的字段：学期被修改后 key 自然不同，不需要手动失效
+    return SemesterCalendar(start_date, week_count, holiday_weeks, weekday)
+
 # --- 班级通知（老师公告） ---
+def normalize_visible_to(value):
+    """历史数据里的 PAID_ONLY / paid_only / paid / 空值 等统一成 PAID / ALL"""
+    return "PAID" if (value or "").strip().upper() in ("PAID", "PAID_ONLY") else "ALL"
+
+
+def notice_audience_key(course_slot_id, sub_group_id, paid_only):
+    """公告受众：'时段:细分班(* 表示整个时段):P/A'，家长端按这个 key 集合一次查出可见公告"""
+    return f"{course_slot_id}:{sub_group_id or '*'}:{'P' if paid_only else 'A'}"
+
+
 class ClassNotice(models.Model):
     course_slot = models.ForeignKey(CourseSlot, on_delete=models.CASCADE, related_name="notices")
     sub_group   = models.ForeignKey(SubGroup, null=True, blank=True, on_delete=models.CASCADE, related_name="notices")
@@ -133,17 +263,56 @@ class ClassNotice(models.Model):
     )
     is_active   = models.BooleanField(default=True)
     order_no    = models.PositiveIntegerField(default=0)
+    # 由 course_slot / sub_group / visible_to 推出，save() 时维护；bulk_create 的调用方自己填
+    audience_key = models.CharField(max_length=40, blank=True, default="", editable=False)
     created_by  = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
     created_at  = models.DateTimeField(auto_now_add=True)
     updated_at  = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ("-is_pinned","-order_no", "-created_at")
+        indexes = [
+            # 家长端公告：audience_key IN (...) AND is_active，见 portal/notices.py
+            models.Index(fields=["audience_key", "is_active"], name="notice_audience_idx"),
+        ]
 
     def __str__(self):
         sg = f" / {self.sub_group.name}" if self.sub_group_id else ""
         return f"{self.title} ({self.course_slot}{sg})"
 
+    def save(self, *args, **kwargs):
+        self.visible_to = normalize_visible_to(self.visible_to)
+        self.audience_key = notice_audience_key(self.course_slot_id, self.sub_group_id, self.visible_to == "PAID")
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = {*update_fields, "visible_to", "audience_key"}
+        super().save(*args, **kwargs)
+
+
+# --- 家长公告收件箱（portal/notices.py 写入：发布时扇出给可见的家长，家长端只读这张表） ---
+class NoticeDelivery(models.Model):
+    notice     = models.ForeignKey(ClassNotice, on_delete=models.CASCADE, related_name="deliveries")
+    parent     = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="notice_deliveries")
+    # 以下两列从公告复制，列表 / 未读数只走本表的索引
+    is_active  = models.BooleanField(default=True)
+    is_pinned  = models.BooleanField(default=False)
+    posted_at  = models.DateTimeField()                   # = notice.created_at
+    read_at    = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["notice", "parent"], name="uniq_notice_delivery"),
+        ]
+        indexes = [
+            # 家长端列表：parent_id=? AND is_active ORDER BY is_pinned DESC, posted_at DESC
+            models.Index(fields=["parent", "is_active", "is_pinned", "posted_at"], name="delivery_inbox_idx"),
+            # 未读数：parent_id=? AND is_active AND read_at IS NULL
+            models.Index(fields=["parent", "is_active", "read_at"], name="delivery_unread_idx"),
+        ]
+
+    def __str__(self):
+        return f"Notice#{self.notice_id} → {self.parent_id}"
+
 
 # --- 学习资料（视频/文件/图片），挂在 Sub group 上 ---
 #def resource_upload_path(instance, filename):
@@ -252,6 +421,13 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            # 评论历史的游标分页（portal/comments.py）：按 (created_at, id) 倒序
+            # 助教面板：sub_group_id=? AND role=ASSISTANT
+            models.Index(fields=["sub_group", "role", "created_at"], name="comment_sg_role_created_idx"),
+            # 家长首页：user_id=? AND role=PARENT
+            models.Index(fields=["user", "role", "created_at"], name="comment_user_role_created_idx"),
+        ]
 
 
 # Proxy models：让 admin 后台可以对两种评论分开管理
@@ -267,3 +443,87 @@ class AssistantComment(Comment):
         verbose_name = "Assistant Comment"
         verbose_name_plural = "Assistant Comments"
 
+
+
+# --- 后台任务：导出 / 公告收件箱扇出等（DB 表当队列，manage.py run_export_worker 消费） ---
+class ExportJob(models.Model):
+    class Status(models.TextChoices):
+        PENDING = "PENDING", "Pending"
+        RUNNING = "RUNNING", "Running"
+        DONE    = "DONE",    "Done"
+        FAILED  = "FAILED",  "Failed"
+
+    kind        = models.CharField(max_length=40)              # 见 portal/export_jobs.py 的 JOB_KINDS / TASK_KINDS
+    params      = models.JSONField(default=dict, blank=True)
+    status      = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    # 含学生个人信息：放私有存储（不在 MEDIA_ROOT 下），只经后台下载视图读取
+    file        = models.FileField(upload_to="exports/", storage=get_private_storage, blank=True, null=True)
+    filename    = models.CharField(max_length=200, blank=True, default="")   # 下载时的文件名
+    row_count   = models.PositiveIntegerField(default=0)
+    error       = models.TextField(blank=True, default="")
+    worker      = models.CharField(max_length=100, blank=True, default="")
+    created_by  = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
+    created_at  = models.DateTimeField(auto_now_add=True)
+    started_at  = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)   # RUNNING 期间 worker 定期刷新；过期 = worker 已死
+    attempts    = models.PositiveSmallIntegerField(default=0)  # 被 worker 抢到的次数（非导出任务失败重试用）
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ("-id",)
+        indexes = [
+            # worker 取任务：status=PENDING ORDER BY id
+            models.Index(fields=["status", "id"], name="exportjob_status_idx"),
+        ]
+
+    def __str__(self):
+        return f"Export#{self.id} {self.kind} ({self.status})"
+
+
+# --- 慢查询记录（portal/slowlog.py 写入；按 SQL 指纹去重，行数有上限） ---
+class SlowQuery(models.Model):
+    fingerprint = models.CharField(max_length=40, unique=True)   # 归一化 SQL 的 sha1
+    sql         = models.TextField()                             # 最近一次的原始 SQL（带占位符）
+    params      = models.TextField(blank=True, default="")       # 最近一次的参数（JSON，字符串已脱敏，截断）
+    call_site   = models.CharField(max_length=255, blank=True, default="")  # portal/views.py:123 in parent_notices
+    url_name    = models.CharField(max_length=200, blank=True, default="")
+    count       = models.PositiveIntegerField(default=0)
+    total_ms    = models.FloatField(default=0)
+    max_ms      = models.FloatField(default=0)
+    last_ms     = models.FloatField(default=0)
+    explain     = models.TextField(blank=True, default="")
+    explained_at = models.DateTimeField(null=True, blank=True)
+    first_seen  = models.DateTimeField(auto_now_add=True)
+    last_seen   = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ("-max_ms",)
+        indexes = [
+            # 超出上限时删最久没出现的
+            models.Index(fields=["last_seen"], name="slowquery_last_seen_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.call_site or self.fingerprint[:10]} ({self.max_ms:.0f} ms × {self.count})"
+
+    @property
+    def avg_ms(self):
+        return self.total_ms / self.count if self.count else 0
+
+
+# --- 全文检索文档（portal/search.py 维护：评论 / 公告 / 学习资料各一行，全文索引按数据库建在这张表上） ---
+class SearchDocument(models.Model):
+    kind       = models.CharField(max_length=30)             # 见 portal/search.py 的 SEARCH_KINDS
+    object_id  = models.PositiveIntegerField()
+    title      = models.CharField(max_length=255, blank=True, default="")
+    body       = models.TextField(blank=True, default="")
+    context    = models.CharField(max_length=500, blank=True, default="")   # 课程 / 细分班 / 作者等关联名称
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["kind", "object_id"], name="uniq_search_document"),
+        ]
+
+    def __str__(self):
+        return f"{self.kind}#{self.object_id}"
@@ -0,0 +1,155 @@
+# portal/notices.py
+"""
+家长端公告
+
+受众：每条公告存一个 audience_key（时段 / 细分班 / 是否仅缴费可见，见 models.notice_audience_key），
+一个家长的已批准报名可以推出他「能看到的 key 集合」。可见规则（与原来的 Exists 子查询一致）：
+- 公告时段是家长已批准报名的时段；限定了细分班的，还要是家长报名的细分班
+- 仅缴费可见的，同时段要有已缴费报名，且该报名未分班或与公告的细分班相同
+  （所以不限细分班的付费公告只对未分班的缴费报名可见）
+
+收件箱（NoticeDelivery）：写时扇出，家长端列表 / 未读数只查收件箱
+- 公告新建或受众变了：fanout_notice 重算这条公告的收件人，只增删差集（留下的保留已读状态）
+- 只改了 停用 / 置顶：update_notice_flags 一条 UPDATE；只改标题 / 内容：收件箱不用动
+- 报名变化（批准 / 缴费 / 换班…）：sync_parent_inboxes 重算这些家长的收件箱
+- NOTICE_FANOUT_ASYNC=True（默认）：扇出 / 同步登记为后台任务（export_jobs.enqueue_task，和业务写入同一事务），
+  由 run_export_worker 执行，失败自动重试；False：事务提交后在请求里同步执行（没有 worker 的部署 / 测试）
+- manage.py rebuild_notice_inbox 全量重算（bulk 写入报名后、或任务重试仍失败时）
+"""
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .export_jobs import enqueue_task, job_task
+from .models import ClassNotice, Enrollment, NoticeDelivery, notice_audience_key
+from .parent_context import build_parent_context
+
+NOTICES_PER_PAGE = 20
+BATCH_SIZE = 1000
+
+
+# —— 受众 ——
+def audience_keys(enrollments):
+    """一个家长的已批准报名 ((enrollment_id, course_slot_id, sub_group_id, paid), ...) -> 能看到的 audience_key 集合"""
+    groups_by_slot = {}
+    for _, slot_id, sg_id, _ in enrollments:
+        if slot_id and sg_id:
+            groups_by_slot.setdefault(slot_id, set()).add(sg_id)
+    keys = set()
+    for _, slot_id, sg_id, paid in enrollments:
+        if not slot_id:
+            continue
+        groups = groups_by_slot.get(slot_id, ())
+        keys.add(notice_audience_key(slot_id, None, False))
+        keys.update(notice_audience_key(slot_id, g, False) for g in groups)
+        if paid and sg_id:
+            keys.add(notice_audience_key(slot_id, sg_id, True))
+        elif paid:
+            # 未分班的缴费报名：整个时段的付费公告 + 家长报了的细分班的付费公告
+            keys.add(notice_audience_key(slot_id, None, True))
+            keys.update(notice_audience_key(slot_id, g, True) for g in groups)
+    return keys
+
+
+def notice_recipients(course_slot_id, audience_key, *, Enrollment=Enrollment):
+    """能看到这条公告的家长 id 集合（一次查询：该时段的已批准报名）"""
+    by_parent = {}
+    for eid, pid, slot_id, sg_id, paid in (Enrollment.objects
+                                           .filter(course_slot_id=course_slot_id, status="APPROVED")
+                                           .values_list("id", "parent_id", "course_slot_id", "sub_group_id",
+                                                        "paid_status")):
+        by_parent.setdefault(pid, []).append((eid, slot_id, sg_id, paid == "PAID"))
+    return {pid for pid, rows in by_parent.items() if audience_key in audience_keys(rows)}
+
+
+# —— 扇出 ——
+def _deliveries(NoticeDelivery, pairs, notices):
+    """pairs: [(notice_id, parent_id)]；notices: {notice_id: (is_active, is_pinned, created_at)}"""
+    objs = [NoticeDelivery(notice_id=nid, parent_id=pid, is_active=notices[nid][0], is_pinned=notices[nid][1],
+                           posted_at=notices[nid][2]) for nid, pid in pairs]
+    # 两个后台任务同时补同一行时以先到的为准
+    NoticeDelivery.objects.bulk_create(objs, batch_size=BATCH_SIZE, ignore_conflicts=True)
+    return len(objs)
+
+
+def update_notice_flags(notice_id, is_active, is_pinned, *, NoticeDelivery=NoticeDelivery):
+    return (NoticeDelivery.objects.filter(notice_id=notice_id)
+            .exclude(is_active=is_active, is_pinned=is_pinned)
+            .update(is_active=is_active, is_pinned=is_pinned))
+
+
+@job_task("notice_fanout")
+def fanout_notice(notice_id, *, ClassNotice=ClassNotice, Enrollment=Enrollment, NoticeDelivery=NoticeDelivery):
+    """按公告当前的受众重算收件人，只增删差集；返回 (新增, 删除)。模型类可由数据迁移传入历史模型"""
+    row = (ClassNotice.objects.filter(pk=notice_id)
+           .values_list("course_slot_id", "audience_key", "is_active", "is_pinned", "created_at").first())
+    if row is None:
+        return 0, 0
+    slot_id, key, is_active, is_pinned, created_at = row
+    wanted = notice_recipients(slot_id, key, Enrollment=Enrollment)
+    existing = set(NoticeDelivery.objects.filter(notice_id=notice_id).values_list("parent_id", flat=True))
+    removed = sorted(existing - wanted)
+    for i in range(0, len(removed), BATCH_SIZE):
+        NoticeDelivery.objects.filter(notice_id=notice_id, parent_id__in=removed[i:i + BATCH_SIZE]).delete()
+    added = _deliveries(NoticeDelivery, [(notice_id, pid) for pid in sorted(wanted - existing)],
+                        {notice_id: (is_active, is_pinned, created_at)})
+    update_notice_flags(notice_id, is_active, is_pinned, NoticeDelivery=NoticeDelivery)
+    return added, len(removed)
+
+
+@job_task("notice_sync_parents")
+def sync_parent_inboxes(parent_ids):
+    """按家长当前的报名重算收件箱（每个家长 3~4 条查询）；返回 (新增, 删除)"""
+    added = removed = 0
+    for parent_id in sorted(set(parent_ids)):
+        keys = audience_keys(build_parent_context(parent_id).enrollments)
+        notices = {nid: rest for nid, *rest in (ClassNotice.objects.filter(audience_key__in=sorted(keys))
+                                                .values_list("id", "is_active", "is_pinned", "created_at"))} if keys else {}
+        existing = set(NoticeDelivery.objects.filter(parent_id=parent_id).values_list("notice_id", flat=True))
+        stale = existing - notices.keys()
+        if stale:
+            removed += NoticeDelivery.objects.filter(parent_id=parent_id, notice_id__in=stale).delete()[0]
+        added += _deliveries(NoticeDelivery, [(nid, parent_id) for nid in sorted(notices.keys() - existing)], notices)
+    return added, removed
+
+
+def rebuild_notice_inbox(*, log=None, ClassNotice=ClassNotice, Enrollment=Enrollment, NoticeDelivery=NoticeDelivery):
+    """逐条公告重算收件人；返回 (新增, 删除)"""
+    log = log or (lambda msg: None)
+    added = removed = 0
+    ids = list(ClassNotice.objects.order_by("id").values_list("id", flat=True))
+    for n, notice_id in enumerate(ids, start=1):
+        a, r = fanout_notice(notice_id, ClassNotice=ClassNotice, Enrollment=Enrollment, NoticeDelivery=NoticeDelivery)
+        added, removed = added + a, removed + r
+        if n % 500 == 0:
+            log(f"{n}/{len(ids)} notices")
+    return added, removed
+
+
+def schedule_inbox_task(fn, *args):
+    """
+    登记 fn(*args) 为后台任务（同一事务，提交了就不会丢）；
+    NOTICE_FANOUT_ASYNC=False 时改为事务提交后就地执行（测试 / 不跑 worker 的部署）
+    """
+    if not getattr(settings, "NOTICE_FANOUT_ASYNC", True):
+        transaction.on_commit(lambda: fn(*args))
+        return
+    enqueue_task(fn, *args)
+
+
+# —— 家长端读取 ——
+def inbox_for_parent(parent_id):
+    return (NoticeDelivery.objects
+            .filter(parent_id=parent_id, is_active=True)
+            .select_related("notice__course_slot__course", "notice__course_slot__semester", "notice__sub_group")
+            .order_by("-is_pinned", "-posted_at", "-id"))
+
+
+def unread_count(parent_id):
+    return NoticeDelivery.objects.filter(parent_id=parent_id, is_active=True, read_at__isnull=True).count()
+
+
+def mark_read(delivery_ids):
+    if not delivery_ids:
+        return 0
+    return NoticeDelivery.objects.filter(pk__in=delivery_ids, read_at__isnull=True).update(read_at=timezone.now())
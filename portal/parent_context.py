@@ -0,0 +1,61 @@
+# portal/parent_context.py
+"""
+家长端共用的「报名上下文」：已批准报名的 ID / 时段 / 细分班 / 缴费情况 + 在读孩子，
+每个家长算一次、放进缓存，家长端各页面都在它上面再查一两次
+
+- key 带两个版本号：该家长自己的（报名 / 孩子变动时 bump）和全局的（批量回填等一次动很多家长时 bump）
+- 报名 / 孩子的 save、delete 走 signals.py；bulk_create / bulk_update 的调用方自己 bump
+"""
+from .caching import NamespacedCache
+from .models import Enrollment, Student
+
+parent_cache = NamespacedCache("parentctx", timeout=3600, description="家长端：报名 / 孩子上下文")
+ALL_SCOPE = "all"
+
+
+class ParentContext:
+    """
+    enrollments: ((enrollment_id, course_slot_id, sub_group_id, paid), ...)，按报名时间倒序，只含 APPROVED
+    students:    ((student_id, full_name), ...)，在读孩子按姓名排序
+    """
+
+    def __init__(self, parent_id, enrollments, students):
+        self.parent_id = parent_id
+        self.enrollments = tuple(enrollments)
+        self.students = tuple(students)
+        self.enrollment_ids = tuple(e[0] for e in self.enrollments)
+        self.slot_ids = frozenset(e[1] for e in self.enrollments if e[1])
+        self.subgroup_ids = frozenset(e[2] for e in self.enrollments if e[2])
+
+    def latest_enrollment_in(self, sub_group_id):
+        """该细分班下最新一个已批准报名的 id（没有时 None）"""
+        return next((e[0] for e in self.enrollments if e[2] == sub_group_id), None)
+
+
+def _scope(parent_id):
+    return f"p{parent_id}"
+
+
+def bump_parent_context(parent_id):
+    if parent_id:
+        parent_cache.bump(_scope(parent_id))
+
+
+def bump_all_parent_contexts():
+    parent_cache.bump(ALL_SCOPE)
+
+
+def build_parent_context(parent_id):
+    enrollments = (Enrollment.objects.filter(parent_id=parent_id, status="APPROVED")
+                   .order_by("-created_at", "-id")
+                   .values_list("id", "course_slot_id", "sub_group_id", "paid_status"))
+    students = (Student.objects.filter(parent_id=parent_id, is_active=True)
+                .order_by("full_name").values_list("id", "full_name"))
+    return ParentContext(parent_id,
+                         [(eid, slot_id, sg_id, paid == "PAID") for eid, slot_id, sg_id, paid in enrollments],
+                         students)
+
+
+def get_parent_context(parent_id):
+    key = f"{parent_id}:{parent_cache.version(ALL_SCOPE)}:{parent_cache.version(_scope(parent_id))}"
+    return parent_cache.get_or_build(key, lambda: build_parent_context(parent_id))
@@ -0,0 +1,330 @@
+# portal/search.py
+"""
+评论 / 公告 / 学习资料的全文检索：每个对象在 SearchDocument 表里存一行（标题 / 正文 / 关联名称），
+全文索引按数据库建在这张表上（迁移 0020），后台搜索不再对原表做 '%xx%' 扫描
+
+- SQLite：FTS5 外部内容表 portal_search_fts（trigram 分词，支持中文子串），触发器跟随文档表同步
+- MySQL：FULLTEXT 索引（ngram parser）
+- Postgres：生成列 search_vector tsvector + GIN 索引；'simple' 配置只按空白 / 标点切词，中日韩文字整段算一个词，
+  所以含中日韩文字的词不走 tsquery，改用文档表上的 LIKE 子串匹配（结果同 SQLite trigram / MySQL ngram，但不走索引）
+- 其它数据库 / SQLite 没编译 FTS5：退化为文档表上的 icontains（仍只扫一张窄表）
+
+- 文档由 signals 在事务提交后重建（reindex_objects）；关联名称（细分班 / 课程 / 学生改名）变化时连带重建
+- 结果按相关度排序，最多 SEARCH_MAX_RESULTS 条；单次查询超过 SEARCH_TIMEOUT_MS 直接中止，返回 timed_out
+- manage.py rebuild_search_index 全量重建
+- 注意：SQLite 上以后再改 SearchDocument 的表结构时 Django 会重建表、触发器随之丢失，
+  迁移里要再调用 drop_fulltext_index / create_fulltext_index
+"""
+import re
+import time
+from collections import namedtuple
+
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+
+FTS_TABLE = "portal_search_fts"
+# 中日韩文字（含假名、谚文）：没有空格分词
+CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]")
+MAX_TERMS = 8
+BATCH_SIZE = 500
+
+SearchHit = namedtuple("SearchHit", "kind object_id title snippet score")
+SearchResult = namedtuple("SearchResult", "hits timed_out backend")
+
+
+# —— 文档类型 ——
+SEARCH_KINDS = {}
+
+
+class SearchKind:
+    """model: 源模型（portal 下的模型名）；admin_model: 后台链接用的模型（评论的两个 proxy）；rows(qs) -> (id, title, body, context)"""
+
+    def __init__(self, name, model, admin_model, label, rows):
+        self.name, self.model, self.admin_model, self.label, self.rows = name, model, admin_model, label, rows
+
+
+def search_kind(name, model, *, admin_model=None, label=""):
+    def deco(fn):
+        SEARCH_KINDS[name] = SearchKind(name, model, admin_model or model, label or name, fn)
+        return fn
+    return deco
+
+
+def _join(*parts):
+    return " / ".join(p for p in parts if p)[:500]
+
+
+@search_kind("notice", "ClassNotice", label="Class notice")
+def _notice_rows(qs):
+    for pk, title, content, course, sg in qs.values_list("id", "title", "content", "course_slot__course__title",
+                                                         "sub_group__name"):
+        yield pk, title, content, _join(course, sg)
+
+
+@search_kind("resource", "LearningResource", label="Learning resource")
+def _resource_rows(qs):
+    for pk, title, description, sg in qs.values_list("id", "title", "description", "sub_group__name"):
+        yield pk, title, description, _join(sg)
+
+
+@search_kind("parent_comment", "Comment", admin_model="ParentComment", label="Parent comment")
+def _parent_comment_rows(qs):
+    for pk, content, user, student, sg in (qs.filter(role="PARENT")
+                                           .values_list("id", "content", "user__username",
+                                                        "enrollment__student__full_name", "sub_group__name")):
+        yield pk, "", content, _join(user, student, sg)
+
+
+@search_kind("assistant_comment", "Comment", admin_model="AssistantComment", label="Assistant comment")
+def _assistant_comment_rows(qs):
+    for pk, content, user, sg in (qs.filter(role="ASSISTANT")
+                                  .values_list("id", "content", "user__username", "sub_group__name")):
+        yield pk, "", content, _join(user, sg)
+
+
+def kinds_for_model(model_name):
+    return [k for k in SEARCH_KINDS.values() if k.model == model_name]
+
+
+# —— 建索引 ——
+def reindex_objects(model_name, ids, *, apps=None):
+    """
+    重建这些对象的文档：先删掉该模型所有类型下的旧文档，再按当前数据写入
+    （对象已删除 / 评论换了角色都自然处理）；apps 可由数据迁移传入
+    """
+    apps = apps or django_apps
+    Model = apps.get_model("portal", model_name)
+    Document = apps.get_model("portal", "SearchDocument")
+    ids = sorted(set(ids))
+    kinds = kinds_for_model(model_name)
+    written = 0
+    for i in range(0, len(ids), BATCH_SIZE):
+        chunk = ids[i:i + BATCH_SIZE]
+        with transaction.atomic():
+            Document.objects.filter(kind__in=[k.name for k in kinds], object_id__in=chunk).delete()
+            docs = [Document(kind=k.name, object_id=pk, title=(title or "")[:255], body=body or "", context=context)
+                    for k in kinds for pk, title, body, context in k.rows(Model.objects.filter(pk__in=chunk))]
+            Document.objects.bulk_create(docs)
+        written += len(docs)
+    return written
+
+
+def rebuild_search_index(*, apps=None, log=None):
+    """全量重建；返回写入的文档数"""
+    apps = apps or django_apps
+    log = log or (lambda msg: None)
+    apps.get_model("portal", "SearchDocument").objects.all().delete()
+    total = 0
+    for model_name in sorted({k.model for k in SEARCH_KINDS.values()}):
+        ids = list(apps.get_model("portal", model_name).objects.order_by("id").values_list("id", flat=True))
+        total += reindex_objects(model_name, ids, apps=apps)
+        log(f"{model_name}: {len(ids)} objects")
+    return total
+
+
+# —— 查询 ——
+def parse_terms(q):
+    """空白分词，去掉引号，最多 MAX_TERMS 个"""
+    return [t for t in (w.replace('"', "") for w in re.split(r"\s+", q or "")) if t][:MAX_TERMS]
+
+
+def _like(term):
+    return "%" + term.replace("!", "!!").replace("%", "!%").replace("_", "!_") + "%"
+
+
+class SearchBackend:
+    name = "like"
+
+    def query(self, terms, kinds, limit, timeout_ms):
+        """-> [(kind, object_id, title, snippet, score)]，相关度从高到低"""
+        where, params = self._like_where(terms, "d")
+        if kinds:
+            where.append(f"d.kind IN ({', '.join(['%s'] * len(kinds))})")
+            params += list(kinds)
+        sql = (f"SELECT d.kind, d.object_id, d.title, SUBSTR(d.body, 1, 200), 0 FROM portal_searchdocument d "
+               f"WHERE {' AND '.join(where)} ORDER BY d.id DESC LIMIT %s")
+        return self._execute(sql, params + [limit], timeout_ms)
+
+    def _like_where(self, terms, alias):
+        where, params = [], []
+        for t in terms:
+            where.append(f"({alias}.title LIKE %s ESCAPE '!' OR {alias}.body LIKE %s ESCAPE '!' "
+                         f"OR {alias}.context LIKE %s ESCAPE '!')")
+            params += [_like(t)] * 3
+        return where, params
+
+    def _execute(self, sql, params, timeout_ms):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+
+class SqliteFtsBackend(SearchBackend):
+    """trigram 分词：3 个字符以上的词走 FTS5 MATCH（bm25 排序，标题权重最高），更短的词用 LIKE 补充过滤"""
+    name = "sqlite-fts5"
+
+    def query(self, terms, kinds, limit, timeout_ms):
+        long_terms = [t for t in terms if len(t) >= 3]
+        if not long_terms:
+            return super().query(terms, kinds, limit, timeout_ms)
+        where, params = [f"{FTS_TABLE} MATCH %s"], [" AND ".join(f'"{t}"' for t in long_terms)]
+        short_where, short_params = self._like_where([t for t in terms if len(t) < 3], "d")
+        where += short_where
+        params += short_params
+        if kinds:
+            where.append(f"d.kind IN ({', '.join(['%s'] * len(kinds))})")
+            params += list(kinds)
+        # bm25 越小越相关；列权重：title, body, context
+        rank = f"bm25({FTS_TABLE}, 10.0, 1.0, 3.0)"
+        sql = (f"SELECT d.kind, d.object_id, d.title, SUBSTR(d.body, 1, 200), -{rank} "
+               f"FROM {FTS_TABLE} JOIN portal_searchdocument d ON d.id = {FTS_TABLE}.rowid "
+               f"WHERE {' AND '.join(where)} ORDER BY {rank} LIMIT %s")
+        return self._execute(sql, params + [limit], timeout_ms)
+
+    def _execute(self, sql, params, timeout_ms):
+        connection.ensure_connection()
+        raw = connection.connection
+        deadline = time.monotonic() + timeout_ms / 1000
+        # 每执行若干条虚拟机指令检查一次，超时返回非 0 让 SQLite 中断查询
+        raw.set_progress_handler(lambda: int(time.monotonic() > deadline), 1000)
+        try:
+            return super()._execute(sql, params, timeout_ms)
+        finally:
+            raw.set_progress_handler(None, 0)
+
+
+class MysqlFulltextBackend(SearchBackend):
+    name = "mysql-fulltext"
+    MATCH = "MATCH(d.title, d.body, d.context) AGAINST (%s IN BOOLEAN MODE)"
+
+    def query(self, terms, kinds, limit, timeout_ms):
+        boolean = " ".join(f'+"{t}"' for t in terms)
+        where, params = [self.MATCH], [boolean]
+        if kinds:
+            where.append(f"d.kind IN ({', '.join(['%s'] * len(kinds))})")
+            params += list(kinds)
+        sql = (f"SELECT /*+ MAX_EXECUTION_TIME({int(timeout_ms)}) */ d.kind, d.object_id, d.title, "
+               f"SUBSTRING(d.body, 1, 200), {self.MATCH} AS score FROM portal_searchdocument d "
+               f"WHERE {' AND '.join(where)} ORDER BY score DESC LIMIT %s")
+        return self._execute(sql, [boolean] + params + [limit], timeout_ms)
+
+
+class PostgresBackend(SearchBackend):
+    """其它词走 tsquery（ts_rank 排序）；含中日韩文字的词用 LIKE 补充过滤，全是这类词时整条退化为 LIKE"""
+    name = "postgres-tsvector"
+
+    def query(self, terms, kinds, limit, timeout_ms):
+        cjk = [t for t in terms if CJK_RE.search(t)]
+        words = [t for t in terms if not CJK_RE.search(t)]
+        if not words:
+            return super().query(terms, kinds, limit, timeout_ms)
+        where, params = self._like_where(cjk, "d")
+        where.insert(0, "d.search_vector @@ q")
+        if kinds:
+            where.append(f"d.kind IN ({', '.join(['%s'] * len(kinds))})")
+            params += list(kinds)
+        sql = (f"SELECT d.kind, d.object_id, d.title, SUBSTRING(d.body, 1, 200), ts_rank(d.search_vector, q) AS score "
+               f"FROM portal_searchdocument d, plainto_tsquery('simple', %s) q "
+               f"WHERE {' AND '.join(where)} ORDER BY score DESC LIMIT %s")
+        return self._execute(sql, [" ".join(words)] + params + [limit], timeout_ms)
+
+    def _execute(self, sql, params, timeout_ms):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT current_setting('statement_timeout')")
+            previous = cursor.fetchone()[0]
+            # is_local=true：只在当前事务内有效；查完恢复，外层事务后面的语句不受影响
+            cursor.execute("SELECT set_config('statement_timeout', %s, true)", [f"{int(timeout_ms)}ms"])
+            try:
+                cursor.execute(sql, params)
+                return cursor.fetchall()
+            finally:
+                cursor.execute("SELECT set_config('statement_timeout', %s, true)", [previous])
+
+
+def _sqlite_has_fts():
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+        return cursor.fetchone() is not None
+
+
+def get_backend():
+    if connection.vendor == "sqlite":
+        return SqliteFtsBackend() if _sqlite_has_fts() else SearchBackend()
+    return {"mysql": MysqlFulltextBackend, "postgresql": PostgresBackend}.get(connection.vendor, SearchBackend)()
+
+
+def search(q, kinds=None, limit=None, timeout_ms=None):
+    """返回 SearchResult(hits=[SearchHit...], timed_out, backend)"""
+    limit = limit or getattr(settings, "SEARCH_MAX_RESULTS", 200)
+    timeout_ms = timeout_ms or getattr(settings, "SEARCH_TIMEOUT_MS", 500)
+    backend = get_backend()
+    terms = parse_terms(q)
+    if not terms:
+        return SearchResult([], False, backend.name)
+    try:
+        # 独立的保存点：超时中止后外层事务还能继续用
+        with transaction.atomic():
+            rows = backend.query(terms, kinds, limit, timeout_ms)
+    except OperationalError:
+        return SearchResult([], True, backend.name)
+    return SearchResult([SearchHit(*row) for row in rows], False, backend.name)
+
+
+def search_ids(q, kind, limit=None):
+    """
+    后台 get_search_results 用：某一类型命中的对象 id（按相关度）-> (ids, timed_out, truncated)
+    多取一条判断是否被 limit 截断
+    """
+    limit = limit or getattr(settings, "SEARCH_MAX_RESULTS", 200)
+    result = search(q, kinds=[kind], limit=limit + 1)
+    ids = [hit.object_id for hit in result.hits]
+    return ids[:limit], result.timed_out, len(ids) > limit
+
+
+# —— 迁移用：按数据库建全文索引 ——
+def create_fulltext_index(schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        try:
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(title, body, context, "
+                f"content='portal_searchdocument', content_rowid='id', tokenize='trigram')"
+            )
+        except Exception:
+            return    # 没有 FTS5 / trigram（SQLite < 3.34）：查询退化为 LIKE
+        for sql in (
+            f"CREATE TRIGGER portal_search_ai AFTER INSERT ON portal_searchdocument BEGIN "
+            f"INSERT INTO {FTS_TABLE}(rowid, title, body, context) VALUES (new.id, new.title, new.body, new.context); END",
+            f"CREATE TRIGGER portal_search_ad AFTER DELETE ON portal_searchdocument BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, body, context) "
+            f"VALUES ('delete', old.id, old.title, old.body, old.context); END",
+            f"CREATE TRIGGER portal_search_au AFTER UPDATE ON portal_searchdocument BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, body, context) "
+            f"VALUES ('delete', old.id, old.title, old.body, old.context); "
+            f"INSERT INTO {FTS_TABLE}(rowid, title, body, context) VALUES (new.id, new.title, new.body, new.context); END",
+        ):
+            schema_editor.execute(sql)
+    elif vendor == "mysql":
+        schema_editor.execute("ALTER TABLE portal_searchdocument ADD FULLTEXT INDEX search_fulltext_idx "
+                              "(title, body, context) WITH PARSER ngram")
+    elif vendor == "postgresql":
+        schema_editor.execute(
+            "ALTER TABLE portal_searchdocument ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+            "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+            "setweight(to_tsvector('simple', coalesce(context, '')), 'B') || "
+            "setweight(to_tsvector('simple', coalesce(body, '')), 'C')) STORED"
+        )
+        schema_editor.execute("CREATE INDEX search_vector_idx ON portal_searchdocument USING GIN (search_vector)")
+
+
+def drop_fulltext_index(schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite":
+        for name in ("portal_search_ai", "portal_search_ad", "portal_search_au"):
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    elif vendor == "mysql":
+        schema_editor.execute("ALTER TABLE portal_searchdocument DROP INDEX search_fulltext_idx")
+    elif vendor == "postgresql":
+        schema_editor.execute("ALTER TABLE portal_searchdocument DROP COLUMN search_vector")
@@ -0,0 +1,234 @@
+# portal/seeding.py
+"""
+本地压测用的批量造数（manage.py seed_scale）：按参数生成 N 个校区的 学期 / 课程 / 时段 / 细分班、
+成千上万的家长 / 学生 / 报名，以及多个学期的出勤历史，全部 bulk_create
+
+- 所有名字带 prefix（默认 "scale"），flush_scale_data(prefix) 可以整批删掉重来
+- 同一个 seed 生成的数据完全相同，方便不同版本之间对比 benchmark
+- bulk_create 不回填主键时（MySQL）也能用：写完按自然键再查 id
+"""
+import random
+from datetime import date, time, timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+
+from .attendance import refresh_attendance_summaries
+from .comments import bump_campus_choices
+from .lookups import bump_timetable_version
+from .models import (Attendance, Campus, ClassNotice, Comment, Course, CourseSlot, Enrollment, LearningResource,
+                     LearningResourceItem, Semester, Student, SubGroup, notice_audience_key)
+from .notices import rebuild_notice_inbox
+from .parent_context import bump_all_parent_contexts
+from .search import rebuild_search_index
+
+BATCH_SIZE = 2000
+
+DEFAULTS = {
+    "campuses": 3,
+    "terms": 3,                    # 每个校区的学期数，最后一个是当前学期
+    "courses": 4,                  # 每个校区的课程数
+    "slots": 2,                    # 每门课每学期的时段数
+    "subgroups": 2,                # 每个时段的细分班数
+    "parents": 2000,
+    "students_per_parent": 2,
+    "enrollments_per_student": 2,  # 每个学生每学期报几门
+    "present_rate": 0.85,
+    "notices_per_slot": 3,
+    "comments_per_subgroup": 5,
+    "seed": 42,
+    "prefix": "scale",
+    "batch_size": BATCH_SIZE,
+}
+
+
+def _chunked(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def flush_scale_data(prefix):
+    """删掉某个 prefix 之前生成的数据（校区级联到课程/时段/报名/出勤，最后删用户）"""
+    User = get_user_model()
+    with transaction.atomic():
+        n = Campus.objects.filter(name__startswith=f"{prefix} ").delete()[0]
+        return n + User.objects.filter(username__startswith=f"{prefix}_").delete()[0]
+
+
+def seed_scale(*, today=None, log=None, **options):
+    """返回各表新建的行数；log 是可选的进度回调 log(str)"""
+    opts = {**DEFAULTS, **options}
+    rnd = random.Random(opts["seed"])
+    prefix, batch = opts["prefix"], opts["batch_size"]
+    today = today or date.today()
+    log = log or (lambda msg: None)
+    User = get_user_model()
+    counts = {}
+
+    # —— 校区 / 学期 / 课程 / 时段 / 细分班 ——
+    Campus.objects.bulk_create([Campus(name=f"{prefix} Campus {c}") for c in range(1, opts["campuses"] + 1)])
+    campuses = list(Campus.objects.filter(name__startswith=f"{prefix} Campus ").order_by("id"))
+    # 最后一个学期包含今天（第 3 周左右），前面的学期依次往前推 12 周
+    this_monday = today - timedelta(days=today.weekday())
+    starts = [this_monday - timedelta(weeks=2 + 12 * (opts["terms"] - 1 - t)) for t in range(opts["terms"])]
+    Semester.objects.bulk_create([
+        Semester(campus=campus, name=f"Term {t + 1}", start_date=start, week_count=10,
+                 is_active=(t == opts["terms"] - 1))
+        for campus in campuses for t, start in enumerate(starts)
+    ])
+    Course.objects.bulk_create([
+        Course(campus=campus, title=f"Course {k}") for campus in campuses for k in range(1, opts["courses"] + 1)
+    ])
+    semesters = list(Semester.objects.filter(campus__in=campuses).order_by("id"))
+    courses = list(Course.objects.filter(campus__in=campuses).order_by("id"))
+    CourseSlot.objects.bulk_create([
+        CourseSlot(course=course, semester=sem, weekday=1 + (course.id + s) % 6,
+                   start_time=time(15 + s, 0), end_time=time(16 + s, 0))
+        for course in courses for sem in semesters if sem.campus_id == course.campus_id
+        for s in range(opts["slots"])
+    ], batch_size=batch)
+    slots = list(CourseSlot.objects.filter(course__in=courses).select_related("semester").order_by("id"))
+    SubGroup.objects.bulk_create([
+        SubGroup(course_slot=slot, name=f"Group {g}") for slot in slots for g in range(1, opts["subgroups"] + 1)
+    ], batch_size=batch)
+    subgroups_by_slot = {}
+    for gid, slot_id in SubGroup.objects.filter(course_slot__in=slots).order_by("id").values_list("id", "course_slot_id"):
+        subgroups_by_slot.setdefault(slot_id, []).append(gid)
+    counts.update(campuses=len(campuses), semesters=len(semesters), courses=len(courses), slots=len(slots),
+                  subgroups=sum(len(v) for v in subgroups_by_slot.values()))
+    log(f"timetable: {counts}")
+
+    # —— 用户（密码不可用，压测里用 force_login） ——
+    unusable = make_password(None)
+    User.objects.bulk_create(
+        [User(username=f"{prefix}_assistant_{c}", role="ASSISTANT", approval_status="APPROVED", password=unusable)
+         for c in range(1, len(campuses) + 1)]
+        + [User(username=f"{prefix}_parent_{p}", role="PARENT", approval_status="APPROVED", password=unusable)
+           for p in range(1, opts["parents"] + 1)],
+        batch_size=batch,
+    )
+    assistants = list(User.objects.filter(username__startswith=f"{prefix}_assistant_").order_by("id")
+                      .values_list("id", flat=True))
+    parents = list(User.objects.filter(username__startswith=f"{prefix}_parent_").order_by("id")
+                   .values_list("id", flat=True))
+    Student.objects.bulk_create([
+        Student(parent_id=pid, full_name=f"Student {p}-{k}")
+        for p, pid in enumerate(parents, start=1) for k in range(1, opts["students_per_parent"] + 1)
+    ], batch_size=batch)
+    students = list(Student.objects.filter(parent_id__in=parents).order_by("id").values_list("id", "parent_id"))
+    counts.update(parents=len(parents), students=len(students))
+    log(f"users: {len(parents)} parents, {len(students)} students")
+
+    # —— 报名：家长固定在一个校区，每学期每个学生报 N 个不同时段 ——
+    campus_index = {campus.id: i for i, campus in enumerate(campuses)}
+    slots_by_campus_sem = {}
+    for slot in slots:
+        key = (campus_index[slot.semester.campus_id], slot.semester_id)
+        slots_by_campus_sem.setdefault(key, []).append(slot)
+    sem_ids_by_campus = {}
+    for sem in semesters:
+        sem_ids_by_campus.setdefault(campus_index[sem.campus_id], []).append(sem.id)
+
+    parent_index = {pid: p for p, pid in enumerate(parents)}
+    enrollments = []
+    for sid, pid in students:
+        c = parent_index[pid] % len(campuses)
+        for sem_id in sem_ids_by_campus[c]:
+            choices = slots_by_campus_sem.get((c, sem_id), [])
+            for slot in rnd.sample(choices, min(opts["enrollments_per_student"], len(choices))):
+                enrollments.append(Enrollment(
+                    parent_id=pid, student_id=sid, course_id=slot.course_id, semester_id=sem_id,
+                    course_slot_id=slot.id, sub_group_id=rnd.choice(subgroups_by_slot[slot.id]),
+                    status="APPROVED" if rnd.random() < 0.95 else rnd.choice(["PENDING", "CANCELLED"]),
+                    paid_status="PAID" if rnd.random() < 0.7 else "UNPAID",
+                ))
+    Enrollment.objects.bulk_create(enrollments, batch_size=batch)
+    counts["enrollments"] = len(enrollments)
+    log(f"enrollments: {len(enrollments)}")
+
+    # —— 出勤：已经上过的周全部点名（APPROVED 才有） ——
+    slot_by_id = {slot.id: slot for slot in slots}
+    assistant_of = {campus.id: assistants[i] for i, campus in enumerate(campuses)}
+    approved = list(Enrollment.objects.filter(course_slot__in=slots, status="APPROVED").order_by("id")
+                    .values_list("id", "course_slot_id", "sub_group_id"))
+    n_att = 0
+    pending = []
+    for eid, slot_id, sg_id in approved:
+        slot = slot_by_id[slot_id]
+        cal = slot.semester.calendar(slot.weekday)
+        marker = assistant_of[slot.semester.campus_id]
+        for wk in cal.weeks:
+            d = cal.date_of(wk)
+            if d > today:
+                break
+            r = rnd.random()
+            status = "PRESENT" if r < opts["present_rate"] else ("LATE" if r < opts["present_rate"] + 0.03 else "ABSENT")
+            pending.append(Attendance(enrollment_id=eid, course_slot_id=slot_id, sub_group_id=sg_id, week_no=wk,
+                                      date=d, status=status, marked_by_id=marker))
+        if len(pending) >= batch:
+            Attendance.objects.bulk_create(pending, batch_size=batch)
+            n_att += len(pending)
+            pending = []
+    if pending:
+        Attendance.objects.bulk_create(pending, batch_size=batch)
+        n_att += len(pending)
+    counts["attendance"] = n_att
+    log(f"attendance: {n_att}")
+
+    # —— 出勤汇总（bulk_create 不发 signal） ——
+    for ids in _chunked([a[0] for a in approved], 500):
+        with transaction.atomic():
+            refresh_attendance_summaries(ids)
+
+    # —— 公告 / 学习资料 / 评论 ——
+    notices = []
+    for slot in slots:
+        for n in range(opts["notices_per_slot"]):
+            groups = subgroups_by_slot[slot.id]
+            sg_id = rnd.choice(groups) if n % 2 else None
+            notices.append(ClassNotice(
+                course_slot_id=slot.id, sub_group_id=sg_id,
+                title=f"Notice {n + 1}", content="Lorem ipsum " * 20, is_pinned=(n == 0),
+                visible_to="PAID" if n % 3 == 2 else "ALL", created_by_id=assistant_of[slot.semester.campus_id],
+                audience_key=notice_audience_key(slot.id, sg_id, n % 3 == 2),
+            ))
+    ClassNotice.objects.bulk_create(notices, batch_size=batch)
+    all_groups = [gid for groups in subgroups_by_slot.values() for gid in groups]
+    LearningResource.objects.bulk_create([
+        LearningResource(sub_group_id=gid, title=f"Resource {gid}") for gid in all_groups
+    ], batch_size=batch)
+    resources = list(LearningResource.objects.filter(sub_group_id__in=all_groups).values_list("id", flat=True))
+    LearningResourceItem.objects.bulk_create([
+        LearningResourceItem(learning_resource_id=rid, type="LINK", ext_url=f"https://example.com/{rid}/{k}", order_no=k)
+        for rid in resources for k in range(2)
+    ], batch_size=batch)
+
+    enrollment_of_group = {}
+    for eid, pid, gid in (Enrollment.objects.filter(sub_group_id__in=all_groups, status="APPROVED")
+                          .values_list("id", "parent_id", "sub_group_id")):
+        enrollment_of_group.setdefault(gid, []).append((eid, pid))
+    comments = []
+    for slot in slots:
+        for gid in subgroups_by_slot[slot.id]:
+            members = enrollment_of_group.get(gid, [])
+            for k in range(opts["comments_per_subgroup"]):
+                if k % 2 and members:
+                    eid, pid = rnd.choice(members)
+                    comments.append(Comment(role="PARENT", user_id=pid, sub_group_id=gid, enrollment_id=eid,
+                                            content=f"Parent comment {k}"))
+                else:
+                    comments.append(Comment(role="ASSISTANT", user_id=assistant_of[slot.semester.campus_id],
+                                            sub_group_id=gid, content=f"Assistant comment {k}"))
+    Comment.objects.bulk_create(comments, batch_size=batch)
+    counts.update(notices=len(notices), resources=len(resources), comments=len(comments))
+
+    # —— 公告收件箱（bulk_create 不发 signal，直接全量扇出） ——
+    counts["notice_deliveries"] = rebuild_notice_inbox(log=log)[0]
+    log(f"notice deliveries: {counts['notice_deliveries']}")
+    counts["search_documents"] = rebuild_search_index(log=log)
+
+    bump_timetable_version()
+    bump_campus_choices()
+    bump_all_parent_contexts()
+    return counts
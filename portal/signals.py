@@ -0,0 +1,226 @@
+# portal/signals.py
+"""
+模型写入后让相关缓存失效（admin 保存/删除、视图里的 save 都会走到这里；
+bulk_create/bulk_update 不发 signal，由调用方自己 bump）
+"""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .attendance import bump_matrix_for_enrollment, bump_matrix_version, refresh_attendance_summaries
+from .comments import bump_campus_choices
+from .lookups import bump_timetable_version
+from .notices import fanout_notice, schedule_inbox_task, sync_parent_inboxes, update_notice_flags
+from .parent_context import bump_parent_context
+from .search import reindex_objects
+from .models import (AssistantComment, Attendance, Campus, ClassNotice, Comment, Course, CourseSlot, Enrollment,
+                     LearningResource, ParentComment, Semester, Student, SubGroup)
+
+
+def _on_commit(fn, *args):
+    transaction.on_commit(lambda: fn(*args))
+
+
+# —— 签到矩阵 ——
+@receiver(pre_save, sender=Enrollment)
+def _enrollment_remember_old(sender, instance, **kwargs):
+    # 记住修改前的 时段/课程/学期（改时段时旧时段也要失效）和家长（改挂到别的家长时旧家长也要失效）
+    instance._old_matrix_keys = instance._old_parent_id = None
+    if instance.pk:
+        old = (Enrollment.objects.filter(pk=instance.pk)
+               .values_list("course_slot_id", "course_id", "semester_id", "parent_id").first())
+        if old:
+            instance._old_matrix_keys, instance._old_parent_id = old[:3], old[3]
+
+
+@receiver(post_save, sender=Enrollment)
+@receiver(post_delete, sender=Enrollment)
+def _enrollment_changed(sender, instance, **kwargs):
+    _on_commit(bump_matrix_for_enrollment, instance.course_slot_id, instance.course_id, instance.semester_id)
+    old = getattr(instance, "_old_matrix_keys", None)
+    if old and old != (instance.course_slot_id, instance.course_id, instance.semester_id):
+        _on_commit(bump_matrix_for_enrollment, *old)
+    # 家长端上下文（报名状态 / 缴费 / 细分班都会影响）
+    parent_ids = {instance.parent_id, getattr(instance, "_old_parent_id", None)} - {None}
+    for parent_id in parent_ids:
+        _on_commit(bump_parent_context, parent_id)
+    # 公告收件箱（能看到哪些公告同样取决于状态 / 缴费 / 细分班）
+    if parent_ids:
+        schedule_inbox_task(sync_parent_inboxes, sorted(parent_ids))
+
+
+# —— 公告收件箱 ——
+@receiver(pre_save, sender=ClassNotice)
+def _notice_remember_old(sender, instance, **kwargs):
+    instance._old_audience = None
+    if instance.pk:
+        instance._old_audience = (ClassNotice.objects.filter(pk=instance.pk)
+                                  .values_list("audience_key", "is_active", "is_pinned").first())
+
+
+@receiver(post_save, sender=ClassNotice)
+def _notice_changed(sender, instance, created, **kwargs):
+    old = getattr(instance, "_old_audience", None)
+    if created or old is None or old[0] != instance.audience_key:
+        # 新公告 / 换了时段、细分班或可见范围：后台重算收件人
+        schedule_inbox_task(fanout_notice, instance.pk)
+    elif old[1:] != (instance.is_active, instance.is_pinned):
+        _on_commit(update_notice_flags, instance.pk, instance.is_active, instance.is_pinned)
+
+
+@receiver(pre_save, sender=Attendance)
+def _attendance_remember_old(sender, instance, **kwargs):
+    # 后台把出勤改挂到别的报名时，旧报名的汇总也要重算
+    instance._old_enrollment_id = None
+    if instance.pk:
+        instance._old_enrollment_id = (
+            Attendance.objects.filter(pk=instance.pk).values_list("enrollment_id", flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Attendance)
+@receiver(post_delete, sender=Attendance)
+def _attendance_changed(sender, instance, **kwargs):
+    _on_commit(bump_matrix_version, instance.course_slot_id)
+    # 出勤汇总（后台编辑 / 删除；批量写入由 upsert_attendance 自己刷新）
+    # 提交后再算：级联删除报名时，报名已不存在就跳过
+    enrollment_ids = {instance.enrollment_id, getattr(instance, "_old_enrollment_id", None)} - {None}
+    _on_commit(refresh_attendance_summaries, enrollment_ids)
+
+
+@receiver(post_save, sender=Student)
+def _student_changed(sender, instance, created, **kwargs):
+    # 家长端的孩子列表
+    _on_commit(bump_parent_context, instance.parent_id)
+    # 名单里显示学生姓名
+    if created:
+        return
+    for slot_id, course_id, sem_id in instance.enrollments.values_list("course_slot_id", "course_id", "semester_id"):
+        _on_commit(bump_matrix_for_enrollment, slot_id, course_id, sem_id)
+
+
+@receiver(post_delete, sender=Student)
+def _student_deleted(sender, instance, **kwargs):
+    _on_commit(bump_parent_context, instance.parent_id)
+
+
+@receiver(post_save, sender=SubGroup)
+@receiver(post_delete, sender=SubGroup)
+def _subgroup_changed(sender, instance, **kwargs):
+    _on_commit(bump_matrix_version, instance.course_slot_id)
+
+
+@receiver(post_save, sender=Semester)
+def _semester_changed(sender, instance, **kwargs):
+    # week_count / start_date 变了，矩阵的周数也跟着变
+    for slot_id in CourseSlot.objects.filter(semester=instance).values_list("id", flat=True):
+        _on_commit(bump_matrix_version, slot_id)
+
+
+# —— 级联下拉（时段 / 细分班） ——
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+@receiver(post_save, sender=CourseSlot)
+@receiver(post_delete, sender=CourseSlot)
+@receiver(post_save, sender=SubGroup)
+@receiver(post_delete, sender=SubGroup)
+def _timetable_changed(sender, instance, **kwargs):
+    _on_commit(bump_timetable_version)
+
+
+# —— 评论后台的校区筛选项（后台经由两个 proxy 模型保存，signal 的 sender 是 proxy） ——
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=ParentComment)
+@receiver(post_delete, sender=ParentComment)
+@receiver(post_save, sender=AssistantComment)
+@receiver(post_delete, sender=AssistantComment)
+def _comment_changed(sender, instance, **kwargs):
+    _on_commit(bump_campus_choices)
+
+
+@receiver(pre_save, sender=Course)
+def _course_remember_old(sender, instance, **kwargs):
+    # 校区（评论后台的校区筛选）和标题（检索文档）
+    instance._old_campus_id = instance._old_title = None
+    if instance.pk:
+        old = Course.objects.filter(pk=instance.pk).values_list("campus_id", "title").first()
+        if old:
+            instance._old_campus_id, instance._old_title = old
+
+
+@receiver(post_save, sender=Course)
+def _course_campus_changed(sender, instance, created, **kwargs):
+    # 课程改挂到别的校区：它下面的评论跟着换校区（新课程还没有评论，不用管）
+    old = getattr(instance, "_old_campus_id", None)
+    if not created and old is not None and old != instance.campus_id:
+        _on_commit(bump_campus_choices)
+
+
+@receiver(post_save, sender=Campus)
+@receiver(post_delete, sender=Campus)
+def _campus_changed(sender, instance, **kwargs):
+    # 筛选项里带校区名
+    _on_commit(bump_campus_choices)
+
+
+# —— 全文检索文档（portal/search.py） ——
+@receiver(post_save, sender=ClassNotice)
+@receiver(post_delete, sender=ClassNotice)
+@receiver(post_save, sender=LearningResource)
+@receiver(post_delete, sender=LearningResource)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=ParentComment)
+@receiver(post_delete, sender=ParentComment)
+@receiver(post_save, sender=AssistantComment)
+@receiver(post_delete, sender=AssistantComment)
+def _search_source_changed(sender, instance, **kwargs):
+    _on_commit(reindex_objects, sender._meta.concrete_model.__name__, [instance.pk])
+
+
+def _reindex_related(model, **filters):
+    ids = list(model.objects.filter(**filters).values_list("id", flat=True))
+    if ids:
+        _on_commit(reindex_objects, model.__name__, ids)
+
+
+# 文档里带了细分班 / 课程 / 学生的名字：只在改名时连带重建（停用 / 改其它字段不动检索文档）
+def _remember_old_name(instance, field):
+    instance._old_name = None
+    if instance.pk:
+        instance._old_name = type(instance).objects.filter(pk=instance.pk).values_list(field, flat=True).first()
+
+
+def _renamed(instance, created, field, old_attr="_old_name"):
+    old = getattr(instance, old_attr, None)
+    return not created and old is not None and old != getattr(instance, field)
+
+
+@receiver(pre_save, sender=SubGroup)
+def _search_subgroup_remember_name(sender, instance, **kwargs):
+    _remember_old_name(instance, "name")
+
+
+@receiver(post_save, sender=SubGroup)
+def _search_subgroup_renamed(sender, instance, created, **kwargs):
+    if _renamed(instance, created, "name"):
+        for model in (ClassNotice, LearningResource, Comment):
+            _reindex_related(model, sub_group=instance)
+
+
+@receiver(post_save, sender=Course)
+def _search_course_renamed(sender, instance, created, **kwargs):
+    if _renamed(instance, created, "title", "_old_title"):
+        _reindex_related(ClassNotice, course_slot__course=instance)
+
+
+@receiver(pre_save, sender=Student)
+def _search_student_remember_name(sender, instance, **kwargs):
+    _remember_old_name(instance, "full_name")
+
+
+@receiver(post_save, sender=Student)
+def _search_student_renamed(sender, instance, created, **kwargs):
+    if _renamed(instance, created, "full_name"):
+        _reindex_related(Comment, enrollment__student=instance)
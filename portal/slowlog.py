@@ -0,0 +1,256 @@
+# portal/slowlog.py
+"""
+慢查询记录：超过 SLOW_QUERY_THRESHOLD_MS 的 SQL 连同参数、触发它的代码位置（portal/ 或 accounts/ 里
+最近的一帧）写进 SlowQuery 表，后台直接看是哪个 ORM 调用缺索引，不用开 MySQL slow log
+
+- SlowQueryMiddleware：阈值为 0 时不挂载；请求内只在内存里收集，响应后才写库
+- 同步 / 异步（ASGI）调用链都支持；异步视图的查询在 sync_to_async 的线程里执行，
+  采集走 metrics.request_execute_wrapper，栈上没有视图的帧：调用位置退回到视图函数本身
+  （往外找到 Django 请求处理的帧就停，不会把发起请求的代码——测试、管理命令——当成调用位置）
+- 按归一化 SQL 的指纹去重：同一条语句只累加 次数 / 总耗时 / 最大耗时
+- 新指纹第一次出现时在后台线程里跑 EXPLAIN（SLOW_QUERY_EXPLAIN_ASYNC=False 时同步执行）
+- 参数里的字符串（姓名、用户名、评论内容……）落库前脱敏成 "<str:长度>"，只保留数字 / 日期 / 布尔；
+  新指纹的 EXPLAIN 用内存里的原始参数，补跑（explain_pending）用脱敏后的参数
+- 表行数上限 SLOW_QUERY_MAX_ROWS，超出时删最久没出现的（环形缓冲）
+"""
+import datetime
+import decimal
+import hashlib
+import inspect
+import json
+import os
+import re
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import django.core.handlers
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .metrics import install_request_hooks, request_execute_wrapper
+from .models import SlowQuery
+
+PARAMS_LIMIT = 4000
+EXPLAIN_PREFIX = {"sqlite": "EXPLAIN QUERY PLAN ", "mysql": "EXPLAIN ", "postgresql": "EXPLAIN "}
+
+_APP_DIRS = tuple(os.path.join(str(settings.BASE_DIR), d) + os.sep for d in ("portal", "accounts"))
+# 请求处理的边界：再往外是调用 handler 的代码（测试客户端、服务器），不属于这个请求
+_HANDLER_DIR = os.path.dirname(os.path.abspath(django.core.handlers.__file__)) + os.sep
+# 自己和计时中间件的帧不算调用位置
+_SKIP_FILES = {os.path.abspath(__file__),
+               os.path.join(os.path.dirname(os.path.abspath(__file__)), "metrics.py")}
+# 原样保存的参数类型；其余（字符串、bytes、UUID……）脱敏
+_PLAIN_PARAM_TYPES = (bool, int, float, decimal.Decimal, datetime.date, datetime.time, datetime.timedelta)
+_executor = None
+
+
+# —— 指纹 ——
+def normalize_sql(sql):
+    """字面量 / 占位符换成 ?，IN (?, ?, ...) 合并成 IN (?+)，空白压缩"""
+    s = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    s = re.sub(r"\b\d+(?:\.\d+)?\b", "?", s)
+    s = s.replace("%s", "?")
+    s = re.sub(r"\(\s*\?(?:\s*,\s*\?)*\s*\)", "(?+)", s)
+    return re.sub(r"\s+", " ", s).strip()
+
+
+def fingerprint(sql):
+    return hashlib.sha1(normalize_sql(sql).encode("utf-8")).hexdigest()
+
+
+def call_site():
+    """
+    调用栈里离 SQL 最近的一帧 portal/ 或 accounts/ 代码：'portal/views.py:123 in parent_notices'
+    往外走到 django/core/handlers 就停：请求里的 SQL 只认请求内部的帧（找不到时由调用方退回视图位置）
+    """
+    for frame in reversed(traceback.extract_stack()):
+        filename = os.path.abspath(frame.filename)
+        if filename.startswith(_HANDLER_DIR):
+            break
+        if filename.startswith(_APP_DIRS) and filename not in _SKIP_FILES:
+            return f"{os.path.relpath(filename, settings.BASE_DIR)}:{frame.lineno} in {frame.name}"[:255]
+    return ""
+
+
+def view_site(view):
+    """视图函数（去掉装饰器）的定义位置，格式同 call_site；不在 portal/ accounts/ 里时返回空串"""
+    try:
+        func = inspect.unwrap(view)
+        filename = os.path.abspath(inspect.getsourcefile(func) or "")
+        lineno = inspect.getsourcelines(func)[1]
+    except (TypeError, OSError):
+        return ""
+    if not filename.startswith(_APP_DIRS):
+        return ""
+    return f"{os.path.relpath(filename, settings.BASE_DIR)}:{lineno} in {func.__name__}"[:255]
+
+
+def redact_params(params):
+    """落库用的参数：数字 / 日期 / 布尔 / None 原样，其余换成 "<类型:长度>"（不保存个人信息）"""
+    def one(value):
+        if value is None or isinstance(value, _PLAIN_PARAM_TYPES):
+            return value
+        if isinstance(value, (list, tuple)):
+            return [one(v) for v in value]
+        try:
+            return f"<{type(value).__name__}:{len(value)}>"
+        except TypeError:
+            return f"<{type(value).__name__}>"
+    return [one(v) for v in params]
+
+
+# —— 采集 ——
+class SlowQueryCapture:
+    """execute_wrapper：只记录超过阈值的语句（不在这里写库，避免递归和打断调用方的事务）"""
+
+    def __init__(self, threshold_ms):
+        self.threshold_ms = threshold_ms
+        self.samples = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            ms = (time.perf_counter() - started) * 1000
+            if ms >= self.threshold_ms:
+                self.samples.append((sql, None if many else params, ms, call_site()))
+
+
+def record_slow_queries(samples, url_name="", fallback_site=""):
+    """按指纹 upsert；新指纹安排 EXPLAIN，并把表裁到上限。栈上找不到调用位置的样本记为 fallback_site"""
+    created = False
+    for sql, params, ms, site in samples:
+        site = site or fallback_site
+        fp = fingerprint(sql)
+        try:
+            params_text = (json.dumps(redact_params(params), default=str, ensure_ascii=False)
+                           if params is not None else "")
+        except TypeError:
+            params_text = ""
+        fields = {"sql": sql, "params": params_text[:PARAMS_LIMIT], "call_site": site,
+                  "url_name": url_name[:200], "last_ms": ms, "last_seen": timezone.now()}
+        updated = SlowQuery.objects.filter(fingerprint=fp).update(
+            count=F("count") + 1, total_ms=F("total_ms") + ms, max_ms=Greatest(F("max_ms"), ms), **fields)
+        if updated:
+            continue
+        try:
+            with transaction.atomic():
+                obj = SlowQuery.objects.create(fingerprint=fp, count=1, total_ms=ms, max_ms=ms, **fields)
+        except IntegrityError:
+            # 另一个 worker 刚插入同一指纹
+            SlowQuery.objects.filter(fingerprint=fp).update(count=F("count") + 1, total_ms=F("total_ms") + ms)
+            continue
+        created = True
+        if params is not None:
+            schedule_explain(obj.pk, sql, params)
+    if created:
+        prune_slow_queries()
+
+
+def prune_slow_queries(max_rows=None):
+    max_rows = getattr(settings, "SLOW_QUERY_MAX_ROWS", 500) if max_rows is None else max_rows
+    stale = list(SlowQuery.objects.order_by("-last_seen", "-id").values_list("id", flat=True)[max_rows:])
+    if stale:
+        SlowQuery.objects.filter(id__in=stale).delete()
+    return len(stale)
+
+
+# —— EXPLAIN ——
+def explain_sql(sql, params):
+    """只对 SELECT 执行；返回执行计划文本（失败时返回错误说明）"""
+    if not sql.lstrip().upper().startswith(("SELECT", "WITH")):
+        return "（非 SELECT 语句，不执行 EXPLAIN）"
+    prefix = EXPLAIN_PREFIX.get(connection.vendor, "EXPLAIN ")
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            columns = [c[0] for c in cursor.description or ()]
+            lines = [" | ".join(columns)] if columns else []
+            lines += [" | ".join("" if v is None else str(v) for v in row) for row in cursor.fetchall()]
+        return "\n".join(lines)
+    except Exception as exc:
+        return f"EXPLAIN 失败：{type(exc).__name__}: {exc}"
+
+
+def _explain_and_save(pk, sql, params, *, close_connection):
+    try:
+        SlowQuery.objects.filter(pk=pk).update(explain=explain_sql(sql, params), explained_at=timezone.now())
+    finally:
+        if close_connection:
+            connection.close()    # 后台线程自己的连接，用完就关
+
+
+def schedule_explain(pk, sql, params):
+    if not getattr(settings, "SLOW_QUERY_EXPLAIN_ASYNC", True):
+        _explain_and_save(pk, sql, params, close_connection=False)
+        return
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slowlog-explain")
+    # 行提交后才能被另一个连接看到
+    transaction.on_commit(lambda: _executor.submit(_explain_and_save, pk, sql, params, close_connection=True))
+
+
+def explain_pending(limit=100):
+    """
+    补跑还没有执行计划的行（参数完整保存、没被截断的才行）；manage.py explain_slow_queries 用
+    参数是脱敏后的：字符串条件用占位值，执行计划（走哪个索引）一般不受影响
+    """
+    n = 0
+    for obj in SlowQuery.objects.filter(explained_at__isnull=True).order_by("-max_ms")[:limit]:
+        try:
+            params = json.loads(obj.params) if obj.params else []
+        except ValueError:
+            continue
+        _explain_and_save(obj.pk, obj.sql, params, close_connection=False)
+        n += 1
+    return n
+
+
+class SlowQueryMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.threshold_ms = getattr(settings, "SLOW_QUERY_THRESHOLD_MS", 0)
+        if not self.threshold_ms:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+            install_request_hooks()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        capture = SlowQueryCapture(self.threshold_ms)
+        with connection.execute_wrapper(capture):
+            response = self.get_response(request)
+        self._record(request, capture)
+        return response
+
+    async def __acall__(self, request):
+        capture = SlowQueryCapture(self.threshold_ms)
+        with request_execute_wrapper(capture):
+            response = await self.get_response(request)
+        if capture.samples:
+            await sync_to_async(self._record)(request, capture)
+        return response
+
+    def _record(self, request, capture):
+        if capture.samples:
+            match = getattr(request, "resolver_match", None)
+            # 记录失败不能影响请求
+            try:
+                record_slow_queries(capture.samples, match.view_name if match else request.path,
+                                    view_site(match.func) if match else "")
+            except Exception:
+                pass
@@ -0,0 +1,56 @@
+# portal/storage.py
+"""
+不对外公开的文件存储：导入暂存的名单、后台导出的出勤表（都含学生个人信息）
+
+MEDIA_ROOT 由 Caddy 以 /media/* 直接对外提供，这类文件不能放那里：
+存到 PRIVATE_MEDIA_ROOT（默认 BASE_DIR/private，不在任何静态路由下），没有 URL，只能经后台视图读取
+"""
+import os
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils import timezone
+from django.utils.functional import cached_property
+
+
+class PrivateStorage(FileSystemStorage):
+    @cached_property
+    def base_location(self):
+        return self._value_or_setting(self._location, settings.PRIVATE_MEDIA_ROOT)
+
+    def _clear_cached_properties(self, setting, **kwargs):
+        super()._clear_cached_properties(setting, **kwargs)
+        if setting == "PRIVATE_MEDIA_ROOT":
+            self.__dict__.pop("base_location", None)
+            self.__dict__.pop("location", None)
+
+    def url(self, name):
+        raise ValueError("私有文件没有公开 URL，经后台视图下载")
+
+
+private_storage = PrivateStorage()
+
+
+def get_private_storage():
+    """FileField(storage=...) 用：迁移里序列化成这个函数的引用"""
+    return private_storage
+
+
+def purge_older_than(directory, max_age, *, storage=private_storage):
+    """删掉 directory 下修改时间早于 max_age 之前的文件；返回删除个数"""
+    try:
+        _, files = storage.listdir(directory)
+    except FileNotFoundError:
+        return 0
+    cutoff = timezone.now() - max_age
+    removed = 0
+    for name in files:
+        path = os.path.join(directory, name)
+        try:
+            if storage.get_modified_time(path) < cutoff:
+                storage.delete(path)
+                removed += 1
+        except FileNotFoundError:
+            pass    # 另一个进程刚删掉
+    return removed
+
@@ -1,3 +1,1429 @@
-from django.test import TestCase
+import importlib
+import json
+import os
+import tempfile
+import zipfile
+from datetime import date, time, timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.db.models import Q
+from django.http import HttpResponse
+from django.contrib import admin
+from django.contrib.auth.models import Group
+from django.test import LiveServerTestCase, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User
+from . import attendance as attendance_module
+from .attendance import (aget_attendance_matrix, attendance_queryset, refresh_attendance_summaries,
+                         roster_attendance_rows, roster_queryset, upsert_attendance)
+from .comments import COMMENTS_PAGE_SIZE, campus_choices_for_comments, comment_page, decode_cursor
+from .exports import COLUMNAR_FORMAT, XlsxExporter, get_exporter
+from .export_jobs import TASK_KINDS, TASK_MAX_ATTEMPTS, claim_next_job, requeue_stale_jobs, run_job
+from .benchmarks import BenchmarkContext, compare_reports
+from .caching import STATS_PREFIX
+from .imports import ImportFileError, import_enrollments
+from .loadtest import auth_headers, build_requests, run_load
+from .metrics import RequestMetricsMiddleware, percentile, summarize
+from .notices import NOTICES_PER_PAGE, fanout_notice
+from .search import PostgresBackend, search
+from .seeding import flush_scale_data, seed_scale
+from .slowlog import explain_pending, fingerprint, prune_slow_queries, record_slow_queries
+from .storage import private_storage
+from .models import (Campus, Semester, Course, CourseSlot, SubGroup, Student, Enrollment, Attendance, Comment,
+                     ClassNotice, LearningResource, LearningResourceItem, EnrollmentAttendanceSummary,
+                     ExportJob, NoticeDelivery, ParentComment, SearchDocument, SlowQuery, notice_audience_key)
+
+
+class AttendanceFixtureMixin:
+    """最小的 校区/学期/课程/时段/细分班 + 助教 数据"""
+
+    def setUp(self):
+        cache.clear()
+        # 公告收件箱扇出默认登记给 worker：测试里改为提交后同步执行（要测队列的用例自己打开）
+        self.enterContext(override_settings(NOTICE_FANOUT_ASYNC=False))
+        self.campus = Campus.objects.create(name="Auburn")
+        self.sem = Semester.objects.create(campus=self.campus, name="Term 3",
+                                           start_date=date(2025, 7, 21), week_count=10)
+        self.course = Course.objects.create(campus=self.campus, title="Basketball")
+        self.slot = CourseSlot.objects.create(course=self.course, semester=self.sem, weekday=2,
+                                              start_time=time(16, 0), end_time=time(18, 0))
+        self.sg = SubGroup.objects.create(course_slot=self.slot, name="7-10 basic")
+        self.assistant = User.objects.create_user(username="assistant1", password="x",
+                                                  role="ASSISTANT", approval_status="APPROVED")
+        self.client.force_login(self.assistant)
+        self._n = 0
+
+    def add_students(self, n, *, sub_group=None):
+        for _ in range(n):
+            self._n += 1
+            parent = User.objects.create(username=f"parent{self._n}", role="PARENT")
+            st = Student.objects.create(parent=parent, full_name=f"Kid {self._n}")
+            Enrollment.objects.create(parent=parent, student=st, course=self.course, semester=self.sem,
+                                      course_slot=self.slot, sub_group=sub_group or self.sg,
+                                      status="APPROVED")
+
+
+class ExplainAssertionsMixin:
+    """用 EXPLAIN 断言查询走了指定索引（SQLite: "USING INDEX x"；MySQL: key 列）"""
+
+    def assertUsesIndex(self, queryset, *index_names):
+        plan = queryset.explain()
+        if connection.vendor not in ("sqlite", "mysql"):
+            self.skipTest(f"EXPLAIN 断言只覆盖 SQLite / MySQL，当前 {connection.vendor}")
+        for name in index_names:
+            self.assertIn(name, plan, f"expected index {name} in plan:\n{plan}")
+
+
+class BulkWeekUpsertTests(AttendanceFixtureMixin, TestCase):
+    def post_bulk(self, name, week_no, subgroup_id=None):
+        return self.client.post(
+            reverse(name),
+            data=json.dumps({"slot_id": self.slot.id, "subgroup_id": subgroup_id, "week_no": week_no}),
+            content_type="application/json",
+        )
+
+    def test_mark_then_clear_keeps_one_row_per_cell(self):
+        self.add_students(3)
+        resp = self.post_bulk("attendance_mark_week_bulk", 2, self.sg.id)
+        self.assertEqual(resp.json(), {"ok": True, "updated": 3})
+        resp = self.post_bulk("attendance_clear_week_bulk", 2, self.sg.id)
+        self.assertEqual(resp.json(), {"ok": True, "updated": 3})
+
+        rows = Attendance.objects.filter(course_slot=self.slot, week_no=2, sub_group=self.sg)
+        self.assertEqual(rows.count(), 3)
+        self.assertEqual(set(rows.values_list("status", flat=True)), {"ABSENT"})
+        self.assertEqual(rows.first().date, date(2025, 7, 29))
+
+    def test_null_subgroup_rows_are_upserted_not_duplicated(self):
+        self.add_students(2)
+        self.post_bulk("attendance_mark_week_bulk", 1)
+        self.post_bulk("attendance_mark_week_bulk", 1)
+        self.assertEqual(Attendance.objects.filter(sub_group__isnull=True).count(), 2)
+
+    def test_query_count_independent_of_roster_size(self):
+        def count_queries(week_no):
+            with CaptureQueriesContext(connection) as ctx:
+                self.post_bulk("attendance_mark_week_bulk", week_no, self.sg.id)
+            return len(ctx.captured_queries)
+
+        self.add_students(3)
+        small_insert, small_update = count_queries(1), count_queries(1)
+        self.add_students(30)
+        large_insert, large_update = count_queries(2), count_queries(2)
+
+        self.assertEqual(small_insert, large_insert)
+        self.assertEqual(small_update, large_update)
+
+
+    def test_concurrent_insert_is_retried_as_update(self):
+        """另一个请求在我们读完、写入前插入了同一格：撞唯一约束后重读，改成 UPDATE"""
+        self.add_students(1)
+        en = Enrollment.objects.get()
+        other = Attendance.objects.create(enrollment=en, course_slot=self.slot, sub_group=self.sg, week_no=3,
+                                          date=date(2025, 8, 5), status="ABSENT", marked_by=self.assistant)
+        real = attendance_module._locked_existing
+        reads = []
+
+        def racy_read(*args):
+            reads.append(args)
+            return {} if len(reads) == 1 else real(*args)    # 第一次读时对方的行还没提交
+
+        with mock.patch("portal.attendance._locked_existing", side_effect=racy_read):
+            n = upsert_attendance(slot=self.slot, sub_group_id=self.sg.id, marks={(en.id, 3): True},
+                                  user=self.assistant, date_for_week=lambda wk: date(2025, 8, 5))
+        self.assertEqual((n, len(reads)), (1, 2))
+        other.refresh_from_db()
+        self.assertEqual(other.status, "PRESENT")
+        self.assertEqual(Attendance.objects.count(), 1)
+
+class MarkBatchTests(AttendanceFixtureMixin, TestCase):
+    def post_batch(self, cells, subgroup_id=None):
+        return self.client.post(
+            reverse("assistant_attendance_mark_batch"),
+            data=json.dumps({"course_slot_id": self.slot.id, "sub_group_id": subgroup_id, "cells": cells}),
+            content_type="application/json",
+        )
+
+    def test_batch_applies_cells_and_last_toggle_wins(self):
+        self.add_students(2)
+        e1, e2 = Enrollment.objects.order_by("id").values_list("id", flat=True)
+        resp = self.post_batch([
+            {"enrollment_id": e1, "week_no": 1, "present": True},
+            {"enrollment_id": e2, "week_no": 3, "present": True},
+            {"enrollment_id": e1, "week_no": 1, "present": False},
+        ], self.sg.id)
+        self.assertEqual(resp.json(), {"ok": True, "updated": 2})
+        got = dict(((a.enrollment_id, a.week_no), a.status) for a in Attendance.objects.all())
+        self.assertEqual(got, {(e1, 1): "ABSENT", (e2, 3): "PRESENT"})
+        self.assertEqual(Attendance.objects.get(enrollment_id=e2).date, date(2025, 8, 5))
+
+    def test_invalid_body(self):
+        self.assertEqual(self.post_batch([{"enrollment_id": "x", "week_no": 1, "present": True}]).status_code, 400)
+
+
+class StreamingExportTests(AttendanceFixtureMixin, TestCase):
+    def test_assistant_export_streams_rows(self):
+        self.add_students(2)
+        e1 = Enrollment.objects.order_by("id").first()
+        Attendance.objects.create(enrollment=e1, course_slot=self.slot, sub_group=self.sg, week_no=1,
+                                  date=date(2025, 7, 22), status="PRESENT", marked_by=self.assistant)
+        resp = self.client.get(reverse("attendance_export_csv"), {"slot_id": self.slot.id})
+        self.assertTrue(resp.streaming)
+        lines = b"".join(resp.streaming_content).decode("utf-8-sig").splitlines()
+        self.assertEqual(lines[0].split(",")[:4], ["Student", "Parent", "Paid", "W1 (Tue 07/22)"])
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[1].startswith("Kid 1,parent1,UNPAID,PRESENT,ABSENT"))
+
+    def test_assistant_export_joins_roster_with_attendance(self):
+        self.add_students(3)
+        e1, e2, e3 = Enrollment.objects.order_by("id")
+        other = CourseSlot.objects.create(course=self.course, semester=self.sem, weekday=4,
+                                          start_time=time(16, 0), end_time=time(18, 0))
+        for en, slot, wk in ((e1, self.slot, 3), (e1, self.slot, 1), (e3, other, 2)):
+            Attendance.objects.create(enrollment=en, course_slot=slot, sub_group=None, week_no=wk,
+                                      date=date(2025, 7, 22), status="PRESENT", marked_by=self.assistant)
+        # 一条 LEFT JOIN 查询，按 (报名, 周) 排序；没有记录的报名也出一行，其他时段的记录不进来
+        with self.assertNumQueries(1):
+            grid = [(eid, wk, st) for eid, *_, wk, st in roster_attendance_rows(self.slot, self.sg.id)]
+        self.assertEqual(grid, [(e1.id, 1, "PRESENT"), (e1.id, 3, "PRESENT"), (e2.id, None, None), (e3.id, None, None)])
+
+        resp = self.client.get(reverse("attendance_export_csv"), {"slot_id": self.slot.id, "subgroup_id": self.sg.id})
+        lines = b"".join(resp.streaming_content).decode("utf-8-sig").splitlines()
+        self.assertEqual([ln.split(",")[3:6] for ln in lines[1:]],
+                         [["PRESENT", "ABSENT", "PRESENT"], ["ABSENT"] * 3, ["ABSENT"] * 3])
+
+    def test_assistant_export_formats(self):
+        self.add_students(2)
+        resp = self.client.get(reverse("attendance_export_csv"), {"slot_id": self.slot.id, "format": "xlsx"})
+        self.assertIn('.xlsx"', resp["Content-Disposition"])
+        with zipfile.ZipFile(BytesIO(b"".join(resp.streaming_content))) as zf:
+            self.assertEqual(zf.read("xl/worksheets/sheet1.xml").count(b"<row "), 3)
+        resp = self.client.get(reverse("attendance_export_csv"), {"slot_id": self.slot.id, "format": "pdf"})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_admin_export_streams_rows(self):
+        self.add_students(1)
+        Attendance.objects.create(enrollment=Enrollment.objects.get(), course_slot=self.slot, sub_group=self.sg,
+                                  week_no=1, date=date(2025, 7, 22), status="PRESENT", marked_by=self.assistant)
+        admin_user = User.objects.create_superuser(username="boss", password="x")
+        self.client.force_login(admin_user)
+        # 「导出当前筛选」改为后台任务（见 ExportJobTests）；勾选本页行的批量操作仍直接流式返回
+        resp = self.client.post(reverse("admin:portal_attendance_changelist"), {
+            "action": "export_selected_csv", "_selected_action": [Attendance.objects.get().pk],
+        })
+        self.assertTrue(resp.streaming)
+        lines = b"".join(resp.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].startswith("Auburn,Basketball,Term 3,Tue 16:00-18:00,7-10 basic,Kid 1,parent1,1,2025-07-22,PRESENT,UNPAID,assistant1,"))
+
+
+class AttendanceGridTests(AttendanceFixtureMixin, TestCase):
+    def get_grid(self, **extra):
+        params = {"campus_id": self.campus.id, "semester_id": self.sem.id, "weekday": 2,
+                  "slot_id": self.slot.id, "subgroup_id": self.sg.id, **extra}
+        return self.client.get(reverse("assistant_attendance_table"), params).json()
+
+    def test_grid_is_compact_status_strings(self):
+        self.add_students(2)
+        e1 = Enrollment.objects.order_by("id").first()
+        Attendance.objects.create(enrollment=e1, course_slot=self.slot, sub_group=self.sg, week_no=2,
+                                  date=date(2025, 7, 29), status="PRESENT", marked_by=self.assistant)
+        data = self.get_grid()
+        self.assertEqual(data["weeks"], list(range(1, 11)))
+        self.assertEqual(data["header"][0], {"week": 1, "date": "Tue 07/22"})
+        self.assertEqual([r["status"] for r in data["rows"]], ["0100000000", "0000000000"])
+        self.assertEqual(data["rows"][0]["student_name"], "Kid 1")
+
+    def test_weeks_param_returns_only_requested_columns(self):
+        self.add_students(1)
+        data = self.get_grid(weeks="2,99")
+        self.assertEqual(data["weeks"], [2])
+        self.assertEqual(data["rows"][0]["status"], "0")
+
+
+class AttendanceMatrixCacheTests(AttendanceFixtureMixin, TestCase):
+    def get_grid(self):
+        params = {"campus_id": self.campus.id, "semester_id": self.sem.id, "weekday": 2,
+                  "slot_id": self.slot.id, "subgroup_id": self.sg.id}
+        return self.client.get(reverse("assistant_attendance_table"), params).json()
+
+    def test_second_load_is_served_from_cache(self):
+        self.add_students(3)
+        self.get_grid()
+        with CaptureQueriesContext(connection) as ctx:
+            self.get_grid()
+        # 只剩 session/user/slot 查询，不再查 Enrollment/Attendance
+        self.assertFalse([q for q in ctx.captured_queries if "portal_attendance" in q["sql"]])
+
+    def test_mark_invalidates_matrix(self):
+        self.add_students(1)
+        en = Enrollment.objects.get()
+        self.assertEqual(self.get_grid()["rows"][0]["status"][0], "0")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("assistant_attendance_mark"), content_type="application/json",
+                             data=json.dumps({"enrollment_id": en.id, "course_slot_id": self.slot.id,
+                                              "sub_group_id": self.sg.id, "week_no": 1, "present": True}))
+        self.assertEqual(self.get_grid()["rows"][0]["status"][0], "1")
+
+    def test_enrollment_save_invalidates_roster(self):
+        self.add_students(1)
+        self.assertEqual(len(self.get_grid()["rows"]), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            Enrollment.objects.update(status="CANCELLED")  # update() 不发 signal
+            Enrollment.objects.get().save()
+        self.assertEqual(self.get_grid()["rows"], [])
+
+
+class CacheStatsTests(AttendanceFixtureMixin, TestCase):
+    def test_counters_are_off_by_default(self):
+        params = {"campus_id": self.campus.id, "semester_id": self.sem.id, "weekday": 2, "slot_id": self.slot.id}
+        self.client.get(reverse("assistant_attendance_table"), params)
+        self.assertFalse([k for k in cache._cache if STATS_PREFIX in k])     # 热路径上没有额外的 incr
+
+    @override_settings(CACHE_STATS_ENABLED=True)
+    def test_stats_page_reports_matrix_namespace(self):
+        params = {"campus_id": self.campus.id, "semester_id": self.sem.id, "weekday": 2, "slot_id": self.slot.id}
+        self.client.get(reverse("assistant_attendance_table"), params)
+        self.client.get(reverse("assistant_attendance_table"), params)
+
+        self.client.force_login(User.objects.create_superuser(username="boss", password="x"))
+        resp = self.client.get(reverse("ops_cache_stats"))
+        row = next(r for r in resp.context["rows"] if r["namespace"] == "attmx")
+        self.assertEqual((row["hits"], row["misses"], row["sets"], row["keys"]), (1, 1, 1, 1))
+
+
+class LookupCacheTests(AttendanceFixtureMixin, TestCase):
+    def test_subgroups_etag_and_invalidation(self):
+        url = reverse("assistant_api_subgroups")
+        resp = self.client.get(url, {"slot_id": self.slot.id})
+        self.assertEqual(resp.json(), {"subgroups": [{"id": self.sg.id, "label": "7-10 basic"}]})
+        self.assertIn("private", resp["Cache-Control"])
+        etag = resp["ETag"]
+
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get(url, {"slot_id": self.slot.id}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+        self.assertFalse([q for q in ctx.captured_queries if "portal_subgroup" in q["sql"]])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            SubGroup.objects.create(course_slot=self.slot, name="11-14 advanced")
+        resp = self.client.get(url, {"slot_id": self.slot.id}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.json()["subgroups"]), 2)
+
+    def test_slots_bad_params(self):
+        resp = self.client.get(reverse("assistant_api_slots"), {"campus_id": "x"})
+        self.assertEqual(resp.json(), {"slots": []})
+
+
+class SemesterCalendarTests(AttendanceFixtureMixin, TestCase):
+    def test_labels_and_holiday_weeks(self):
+        cal = self.sem.calendar(2)
+        self.assertEqual(cal.label_of(1), "Tue 07/22")
+        self.assertIs(cal, self.sem.calendar(2))    # 同一学期字段值 → 同一个对象
+
+        self.sem.holiday_weeks = "2"
+        cal = self.sem.calendar(2)
+        self.assertEqual(cal.date_of(1), date(2025, 7, 22))
+        self.assertEqual(cal.date_of(2), date(2025, 8, 5))   # 第 2 个日历周放假，顺延
+        self.assertTrue(cal.is_future(1, today=date(2025, 7, 21)))
+        self.assertFalse(cal.is_future(1, today=date(2025, 7, 22)))
+
+
+class HotQueryIndexTests(ExplainAssertionsMixin, AttendanceFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_students(3)
+
+    def test_attendance_table_queries(self):
+        self.assertUsesIndex(roster_queryset(self.slot, self.sg.id),
+                             "enroll_status_slot_idx", "enroll_status_course_sem_idx")
+        self.assertUsesIndex(attendance_queryset(self.slot, self.sg.id).filter(week_no__lte=10),
+                             "att_slot_sg_week_idx")
+
+    def test_export_query(self):
+        qs = roster_queryset(self.slot).values_list("id", "student__full_name", "parent__username", "paid_status")
+        self.assertUsesIndex(qs, "enroll_status_slot_idx")
+
+    def test_bulk_and_parent_queries(self):
+        self.assertUsesIndex(Enrollment.objects.filter(status="APPROVED", course_slot_id=self.slot.id),
+                             "enroll_status_slot_idx")
+        parent = Enrollment.objects.first().parent
+        self.assertUsesIndex(Enrollment.objects.filter(parent=parent, status="APPROVED"),
+                             "enroll_parent_status_idx")
+
+
+class BackfillEnrollmentSlotTests(ExplainAssertionsMixin, AttendanceFixtureMixin, TestCase):
+    def test_backfill_and_strict_path(self):
+        self.add_students(2)
+        e1, e2 = Enrollment.objects.order_by("id")
+        Enrollment.objects.filter(pk=e1.pk).update(course_slot=None, sub_group=None)
+        Enrollment.objects.filter(pk=e2.pk).update(sub_group=None)
+        Attendance.objects.create(enrollment=e2, course_slot=self.slot, sub_group=None, week_no=1,
+                                  date=date(2025, 7, 22), status="PRESENT", marked_by=self.assistant)
+        # 同课程同学期的第二个时段 → 无 sub_group 的 e1 无法确定时段
+        other = CourseSlot.objects.create(course=self.course, semester=self.sem, weekday=4,
+                                          start_time=time(16, 0), end_time=time(18, 0))
+
+        out = StringIO()
+        call_command("backfill_enrollment_slots", "--dry-run", stdout=out)
+        self.assertIn(f"Enrollment#{e1.pk}", out.getvalue())
+        self.assertIsNone(Enrollment.objects.get(pk=e2.pk).sub_group_id)
+
+        other.delete()
+        call_command("backfill_enrollment_slots", stdout=StringIO())
+        e1.refresh_from_db(); e2.refresh_from_db()
+        self.assertEqual((e1.course_slot_id, e1.sub_group_id), (self.slot.id, self.sg.id))
+        self.assertEqual(e2.sub_group_id, self.sg.id)
+        self.assertEqual(Attendance.objects.get().sub_group_id, self.sg.id)
+
+        with self.settings(ENROLLMENT_STRICT_SLOT_FILTER=True):
+            qs = roster_queryset(self.slot, self.sg.id)
+            self.assertEqual(qs.count(), 2)
+            self.assertNotIn(" OR ", str(qs.query))
+            self.assertUsesIndex(attendance_queryset(self.slot, self.sg.id), "att_slot_sg_week_idx")
+
+    def test_backfill_invalidates_cached_matrix(self):
+        self.add_students(2)
+        e1 = Enrollment.objects.order_by("id").first()
+        Enrollment.objects.filter(pk=e1.pk).update(course_slot=None, sub_group=None)
+        slot = CourseSlot.objects.select_related("semester", "course").get(pk=self.slot.pk)
+        matrix = async_to_sync(aget_attendance_matrix)
+        subgroup_of = lambda m: {r["enrollment_id"]: r["subgroup_id"] for r in m["rows"]}
+        self.assertEqual(subgroup_of(matrix(slot, None))[e1.pk], "")    # 旧报名：还没分班，结果进了缓存
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("backfill_enrollment_slots", stdout=StringIO())
+        self.assertEqual(subgroup_of(matrix(slot, None))[e1.pk], self.sg.id)
+
+    def test_migration_invalidates_cached_matrix(self):
+        self.add_students(1)
+        Enrollment.objects.update(sub_group=None)
+        slot = CourseSlot.objects.select_related("semester", "course").get(pk=self.slot.pk)
+        matrix = async_to_sync(aget_attendance_matrix)
+        before = matrix(slot, None)
+        migration = importlib.import_module("portal.migrations.0013_backfill_enrollment_slots")
+        with self.captureOnCommitCallbacks(execute=True):
+            migration.forwards(django_apps, connection.schema_editor())
+        self.assertNotEqual(matrix(slot, None), before)
+
+
+class CommentAdminCampusFilterTests(AttendanceFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_students(5)
+        self.admin_user = User.objects.create_superuser(username="root", password="x", email="r@x.io")
+        self.client.force_login(self.admin_user)
+        with self.captureOnCommitCallbacks(execute=True):
+            for en in Enrollment.objects.all():
+                Comment.objects.create(role="PARENT", user=en.parent, sub_group=self.sg,
+                                       enrollment=en, content="hi")
+
+    def changelist(self):
+        return self.client.get(reverse("admin:portal_parentcomment_changelist"))
+
+    def test_changelist_queries_do_not_grow_with_comments(self):
+        self.changelist()    # 预热校区筛选缓存 / session
+        with CaptureQueriesContext(connection) as few:
+            self.assertEqual(self.changelist().status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            for en in Enrollment.objects.all():
+                Comment.objects.create(role="PARENT", user=en.parent, sub_group=self.sg,
+                                       enrollment=en, content="again")
+        self.changelist()
+        with CaptureQueriesContext(connection) as many:
+            self.changelist()
+        self.assertEqual(len(few), len(many))
+
+    def test_campus_choices_are_cached_and_invalidated_on_comment_write(self):
+        other = Campus.objects.create(name="Strathfield")
+        self.assertEqual(campus_choices_for_comments("PARENT"), [(self.campus.id, "Auburn")])
+        with self.assertNumQueries(0):
+            campus_choices_for_comments("PARENT")
+        self.assertEqual(campus_choices_for_comments("ASSISTANT"), [])
+
+        course = Course.objects.create(campus=other, title="Soccer")
+        slot = CourseSlot.objects.create(course=course, semester=self.sem, weekday=3,
+                                         start_time=time(16, 0), end_time=time(17, 0))
+        sg = SubGroup.objects.create(course_slot=slot, name="A")
+        with self.captureOnCommitCallbacks(execute=True):
+            Comment.objects.create(role="ASSISTANT", user=self.assistant, sub_group=sg, content="ok")
+        self.assertEqual(campus_choices_for_comments("ASSISTANT"), [(other.id, "Strathfield")])
+        self.assertEqual(campus_choices_for_comments(), [(self.campus.id, "Auburn"), (other.id, "Strathfield")])
+
+    def test_campus_choices_follow_course_campus_and_name(self):
+        other = Campus.objects.create(name="Strathfield")
+        self.assertEqual(campus_choices_for_comments("PARENT"), [(self.campus.id, "Auburn")])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.course.campus = other
+            self.course.save()
+        self.assertEqual(campus_choices_for_comments("PARENT"), [(other.id, "Strathfield")])
+        with self.captureOnCommitCallbacks(execute=True):
+            other.name = "Strathfield North"
+            other.save()
+        self.assertEqual(campus_choices_for_comments("PARENT"), [(other.id, "Strathfield North")])
+
+    def test_filter_by_campus(self):
+        resp = self.client.get(reverse("admin:portal_parentcomment_changelist"), {"campus": self.campus.id})
+        self.assertContains(resp, "5 Parent Comments")
+
+
+class AdminQueryBudgetTests(AttendanceFixtureMixin, TestCase):
+    """
+    每个注册的 ModelAdmin：列表页 / 编辑页的查询数有固定上限，且不随行数增长
+    （__str__ 链式访问外键、下拉选项、inline 行都会在这里暴露 N+1）
+    """
+    QUERY_BUDGET = 25
+    AUTOCOMPLETE = [("classnotice", "course_slot"), ("learningresource", "sub_group")]
+
+    def setUp(self):
+        super().setUp()
+        self.admin_user = User.objects.create_superuser(username="root", password="x", email="r@x.io")
+        self.client.force_login(self.admin_user)
+        self.notice = ClassNotice.objects.create(course_slot=self.slot, sub_group=self.sg, title="Welcome",
+                                                 created_by=self.admin_user)
+        self.resource = LearningResource.objects.create(sub_group=self.sg, title="Drills", created_by=self.admin_user)
+        LearningResourceItem.objects.create(learning_resource=self.resource, type="LINK", ext_url="https://x.io")
+        Group.objects.create(name="Assistants")
+        ExportJob.objects.create(kind="attendance_admin", created_by=self.admin_user)
+        SlowQuery.objects.create(fingerprint="0" * 40, sql="SELECT 1", count=1, total_ms=5, max_ms=5)
+        self.grow(2)
+
+    def grow(self, n):
+        """新增 n 套 校区→学期→课程→时段→细分班，并给 self.sg 和新细分班各加学生、出勤、评论"""
+        for _ in range(n):
+            self._n += 1
+            campus = Campus.objects.create(name=f"Campus {self._n}")
+            sem = Semester.objects.create(campus=campus, name=f"Term {self._n}",
+                                          start_date=date(2025, 7, 21), week_count=10)
+            course = Course.objects.create(campus=campus, title=f"Course {self._n}")
+            slot = CourseSlot.objects.create(course=course, semester=sem, weekday=3,
+                                             start_time=time(16, 0), end_time=time(17, 0))
+            sg = SubGroup.objects.create(course_slot=slot, name=f"Group {self._n}")
+            ClassNotice.objects.create(course_slot=slot, sub_group=sg, title=f"Notice {self._n}")
+            res = LearningResource.objects.create(sub_group=sg, title=f"Res {self._n}")
+            LearningResourceItem.objects.create(learning_resource=res, type="LINK", ext_url="https://x.io")
+            for target in (self.sg, sg):
+                self.add_students(1, sub_group=target)
+                en = Enrollment.objects.latest("id")
+                if target is not self.sg:
+                    Enrollment.objects.filter(pk=en.pk).update(course=course, semester=sem, course_slot=slot)
+                    en.refresh_from_db()
+                Attendance.objects.create(enrollment=en, course_slot=en.course_slot, sub_group=target,
+                                          week_no=1, date=date(2025, 7, 22), marked_by=self.assistant)
+                Comment.objects.create(role="PARENT", user=en.parent, sub_group=target, enrollment=en, content="p")
+                Comment.objects.create(role="ASSISTANT", user=self.assistant, sub_group=target, content="a")
+
+    def admin_urls(self):
+        request = RequestFactory().get("/")
+        request.user = self.admin_user
+        urls = []
+        for model, model_admin in admin.site._registry.items():
+            info = (model._meta.app_label, model._meta.model_name)
+            urls.append(reverse("admin:%s_%s_changelist" % info))
+            obj = model_admin.get_queryset(request).order_by("pk").first()
+            urls.append(reverse("admin:%s_%s_change" % info, args=[obj.pk]))
+        base = reverse("admin:autocomplete")
+        for model_name, field in self.AUTOCOMPLETE:
+            urls.append(f"{base}?app_label=portal&model_name={model_name}&field_name={field}")
+        return urls
+
+    def count_queries(self):
+        counts = {}
+        for url in self.admin_urls():
+            self.client.get(url)   # 预热缓存（校区筛选项等）
+            with CaptureQueriesContext(connection) as ctx:
+                resp = self.client.get(url)
+            self.assertEqual(resp.status_code, 200, url)
+            counts[url] = len(ctx)
+        return counts
+
+    def test_every_admin_page_has_constant_query_count(self):
+        before = self.count_queries()
+        self.grow(3)
+        after = self.count_queries()
+        for url, n in after.items():
+            with self.subTest(url=url):
+                self.assertLessEqual(n, self.QUERY_BUDGET)
+                self.assertEqual(n, before[url], "query count grows with row count")
+
+    def test_list_select_related_only_joins_on_changelist(self):
+        model_admin = admin.site._registry[Enrollment]
+        request = RequestFactory().get("/")
+        request.user = self.admin_user
+        # 编辑页 / 自动补全 / 批量操作：只带 __str__ 需要的外键
+        self.assertNotIn("semester", model_admin.get_queryset(request).query.select_related)
+        related = model_admin.get_changelist_instance(request).get_queryset(request).query.select_related
+        self.assertEqual(set(related), {"student", "parent", "course", "course_slot", "semester", "sub_group",
+                                        "attendance_summary"})
+
+
+class AttendanceSummaryTests(AttendanceFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_students(2)
+        self.e1, self.e2 = Enrollment.objects.order_by("id")
+
+    def mark(self, cells):
+        return self.client.post(reverse("assistant_attendance_mark_batch"), data=json.dumps({
+            "course_slot_id": self.slot.id, "sub_group_id": self.sg.id, "cells": cells,
+        }), content_type="application/json")
+
+    def summary(self, en):
+        return EnrollmentAttendanceSummary.objects.get(enrollment=en)
+
+    def test_marking_updates_summary(self):
+        self.mark([{"enrollment_id": self.e1.id, "week_no": 1, "present": True},
+                   {"enrollment_id": self.e1.id, "week_no": 3, "present": False},
+                   {"enrollment_id": self.e2.id, "week_no": 1, "present": False}])
+        s = self.summary(self.e1)
+        self.assertEqual((s.present, s.absent, s.late, s.weeks, s.rate), (1, 1, 0, "P-A", 50.0))
+        self.mark([{"enrollment_id": self.e1.id, "week_no": 3, "present": True}])
+        self.assertEqual(self.summary(self.e1).weeks, "P-P")
+        self.assertEqual(self.summary(self.e2).weeks, "A")
+
+        self.client.post(reverse("attendance_mark_week_bulk"), data=json.dumps(
+            {"slot_id": self.slot.id, "subgroup_id": self.sg.id, "week_no": 2}), content_type="application/json")
+        self.assertEqual(self.summary(self.e2).weeks, "AP")
+
+    def test_admin_edits_and_rebuild_check(self):
+        self.mark([{"enrollment_id": self.e1.id, "week_no": 1, "present": True}])
+        att = Attendance.objects.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            att.status = "LATE"
+            att.save()
+        self.assertEqual(self.summary(self.e1).weeks, "L")
+
+        # update() 绕过 signal → --check 能发现，重算后恢复一致
+        Attendance.objects.update(status="ABSENT")
+        with self.assertRaises(CommandError):
+            call_command("rebuild_attendance_summaries", "--check", stdout=StringIO())
+        call_command("rebuild_attendance_summaries", stdout=StringIO())
+        call_command("rebuild_attendance_summaries", "--check", stdout=StringIO())
+        self.assertEqual((self.summary(self.e1).absent, self.summary(self.e2).marked), (1, 0))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            att.delete()
+        self.assertEqual(self.summary(self.e1).weeks, "")
+
+    def test_refresh_without_conflict_target(self):
+        """MySQL：不支持指定冲突列（ON DUPLICATE KEY UPDATE），或干脆不支持 upsert"""
+        self.mark([{"enrollment_id": self.e1.id, "week_no": 1, "present": True}])
+        features = connection.features
+        Summary = EnrollmentAttendanceSummary
+        with mock.patch.object(features, "supports_update_conflicts_with_target", False), \
+                mock.patch.object(Summary.objects, "bulk_create") as bulk_create:
+            refresh_attendance_summaries([self.e1.id])
+        self.assertNotIn("unique_fields", bulk_create.call_args.kwargs)
+        self.assertTrue(bulk_create.call_args.kwargs["update_conflicts"])
+
+        Attendance.objects.create(enrollment=self.e2, course_slot=self.slot, sub_group=self.sg, week_no=2,
+                                  date=date(2025, 7, 29), status="ABSENT", marked_by=self.assistant)
+        with mock.patch.object(features, "supports_update_conflicts_with_target", False), \
+                mock.patch.object(features, "supports_update_conflicts", False):
+            self.mark([{"enrollment_id": self.e1.id, "week_no": 2, "present": False}])
+            self.assertEqual(refresh_attendance_summaries([self.e1.id, self.e2.id]), 2)
+        self.assertEqual((self.summary(self.e1).weeks, self.summary(self.e2).weeks), ("PA", "-A"))
+
+    def test_parent_dashboard_and_admin_list_show_counts(self):
+        self.mark([{"enrollment_id": self.e1.id, "week_no": 1, "present": True},
+                   {"enrollment_id": self.e1.id, "week_no": 2, "present": False}])
+        self.client.force_login(self.e1.parent)
+        resp = self.client.get(reverse("parent"))
+        self.assertContains(resp, "50.0%")
+
+        self.client.force_login(User.objects.create_superuser(username="root", password="x"))
+        resp = self.client.get(reverse("admin:portal_enrollment_changelist"))
+        self.assertContains(resp, "1 / 1 / 0")
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(prefix="exports-test-"),
+                   PRIVATE_MEDIA_ROOT=tempfile.mkdtemp(prefix="exports-private-test-"))
+class ExportJobTests(AttendanceFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_students(3)
+        upsert_attendance(slot=self.slot, sub_group_id=self.sg.id, user=self.assistant,
+                          marks={(e.id, wk): True for e in Enrollment.objects.all() for wk in (1, 2)},
+                          date_for_week=self.sem.calendar(self.slot.weekday).date_of)
+        self.client.force_login(User.objects.create_superuser(username="root", password="x"))
+
+    def test_filtered_export_is_queued_and_built_by_worker(self):
+        url = reverse("admin:portal_attendance_export") + "?week_no=2"
+        self.assertEqual(self.client.get(url).status_code, 405)     # GET（链接 / 图片标签）不会登记任务
+        self.assertFalse(ExportJob.objects.exists())
+        resp = self.client.post(url)
+        self.assertRedirects(resp, reverse("admin:portal_exportjob_changelist"))
+        job = ExportJob.objects.get()
+        self.assertEqual((job.status, job.params), (ExportJob.Status.PENDING, {"query": "week_no=2", "format": "csv"}))
+
+        call_command("run_export_worker", "--once", stdout=StringIO())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.row_count, job.error), (ExportJob.Status.DONE, 3, ""))
+        # 文件在私有目录，公开的 MEDIA_ROOT 下没有
+        self.assertTrue(os.path.isfile(os.path.join(settings.PRIVATE_MEDIA_ROOT, job.file.name)))
+        self.assertFalse(os.path.exists(os.path.join(settings.MEDIA_ROOT, job.file.name)))
+        with self.assertRaises(ValueError):
+            job.file.url
+
+        resp = self.client.get(reverse("admin:portal_exportjob_download", args=[job.pk]))
+        body = b"".join(resp.streaming_content).decode("utf-8-sig")
+        self.assertEqual(len(body.strip().splitlines()), 4)
+        self.assertTrue(body.startswith("Campus,Course"))
+        self.assertContains(self.client.get(reverse("admin:portal_exportjob_changelist")), job.filename)
+
+    def test_select_across_action_is_queued_and_page_selection_streams(self):
+        url = reverse("admin:portal_attendance_changelist")
+        ids = list(Attendance.objects.values_list("id", flat=True))
+        resp = self.client.post(url + "?status__exact=PRESENT", {
+            "action": "export_selected_csv", "_selected_action": ids[:1], "select_across": "1",
+        })
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(ExportJob.objects.get().params, {"query": "status__exact=PRESENT", "format": "csv"})
+
+        resp = self.client.post(url, {"action": "export_selected_csv", "_selected_action": ids[:2],
+                                      "select_across": "0"})
+        self.assertEqual(len(b"".join(resp.streaming_content).splitlines()), 3)
+
+    def test_failed_job_records_error(self):
+        job = ExportJob.objects.create(kind="attendance_admin", created_by=None)
+        call_command("run_export_worker", "--once", stdout=StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.status, ExportJob.Status.FAILED)
+        self.assertIn("RuntimeError", job.error)
+
+    def test_filtered_export_in_xlsx(self):
+        self.client.post(reverse("admin:portal_attendance_export") + "?week_no=1", {"_format": "xlsx"})
+        job = ExportJob.objects.get()
+        self.assertEqual(job.params, {"query": "week_no=1", "format": "xlsx"})
+        call_command("run_export_worker", "--once", stdout=StringIO())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.row_count), (ExportJob.Status.DONE, 3))
+        self.assertTrue(job.filename.endswith(".xlsx"))
+        with job.file.open("rb") as fp, zipfile.ZipFile(fp) as zf:
+            self.assertEqual(zf.read("xl/worksheets/sheet1.xml").count(b"<row "), 4)
+
+    def test_unknown_format_is_rejected(self):
+        resp = self.client.post(reverse("admin:portal_attendance_export"), {"_format": "pdf"})
+        self.assertEqual(resp.status_code, 302)
+        self.assertFalse(ExportJob.objects.exists())
+
+    def test_toolbar_posts_export_with_csrf(self):
+        resp = self.client.get(reverse("admin:portal_attendance_changelist"), {"week_no": "1"})
+        self.assertContains(resp, 'method="post"')
+        self.assertContains(resp, f'action="{reverse("admin:portal_attendance_export")}?week_no=1"')
+        self.assertContains(resp, "csrfmiddlewaretoken")
+
+    def test_only_jobs_with_expired_heartbeat_are_requeued(self):
+        now = timezone.now()
+        live = ExportJob.objects.create(kind="attendance_admin", status=ExportJob.Status.RUNNING, worker="a:1",
+                                        started_at=now - timedelta(hours=2), heartbeat_at=now - timedelta(seconds=10))
+        dead = ExportJob.objects.create(kind="attendance_admin", status=ExportJob.Status.RUNNING, worker="b:2",
+                                        started_at=now - timedelta(minutes=6), heartbeat_at=now - timedelta(minutes=6))
+        self.assertEqual(requeue_stale_jobs(timedelta(minutes=5)), 1)
+        live.refresh_from_db(); dead.refresh_from_db()
+        self.assertEqual((live.status, live.worker), (ExportJob.Status.RUNNING, "a:1"))
+        self.assertEqual((dead.status, dead.worker, dead.heartbeat_at), (ExportJob.Status.PENDING, "", None))
+
+    def test_worker_drops_result_of_a_job_it_lost(self):
+        job = ExportJob.objects.create(kind="attendance_admin", params={"query": "", "format": "csv"},
+                                       created_by=User.objects.get(username="root"))
+        job = claim_next_job("a:1")
+        requeue_stale_jobs(timedelta(seconds=-1))              # 心跳刚过期就被放回队列
+        before = set(os.listdir(private_storage.path("exports"))) if private_storage.exists("exports") else set()
+        self.assertIsNone(run_job(job))
+        self.assertEqual(set(os.listdir(private_storage.path("exports"))), before)    # 生成的文件已删掉
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.file.name or ""), (ExportJob.Status.PENDING, ""))
+
+
+class ExportFormatTests(TestCase):
+    ROWS = [["Name", "Week", "Paid"], ["Kid <1>", 3, True], ["Kid\x02 2", None, ""]]
+
+    def test_xlsx_is_a_valid_workbook(self):
+        body = b"".join(get_exporter("xlsx").chunks(self.ROWS))
+        with zipfile.ZipFile(BytesIO(body)) as zf:
+            self.assertIsNone(zf.testzip())
+            self.assertIn("[Content_Types].xml", zf.namelist())
+            sheet = zf.read("xl/worksheets/sheet1.xml").decode()
+        self.assertEqual(sheet.count("<row "), 3)
+        self.assertIn("Kid &lt;1&gt;", sheet)
+        self.assertIn('<c><v>3</v></c><c t="b"><v>1</v></c>', sheet)
+        self.assertNotIn("\x02", sheet)
+
+    def test_xlsx_streams_in_chunks(self):
+        rows = [["n"]] + [[i] for i in range(XlsxExporter.FLUSH_EVERY * 3)]
+        self.assertGreater(len(list(get_exporter("xlsx").chunks(rows))), 3)
+
+    def test_columnar_falls_back_to_ndjson(self):
+        exporter = get_exporter("columnar")
+        self.assertEqual(exporter.name, COLUMNAR_FORMAT)
+        if exporter.name == "ndjson":
+            lines = b"".join(exporter.chunks(self.ROWS)).decode().splitlines()
+            self.assertEqual(json.loads(lines[0]), {"Name": "Kid <1>", "Week": 3, "Paid": True})
+
+    def test_unknown_and_default_formats(self):
+        self.assertIsNone(get_exporter("pdf"))
+        self.assertEqual(get_exporter(None).name, "csv")
+        self.assertEqual(get_exporter("csv").write(self.ROWS, BytesIO()), 2)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(prefix="imports-test-"))
+@override_settings(PRIVATE_MEDIA_ROOT=tempfile.mkdtemp(prefix="private-test-"))
+class EnrollmentImportTests(AttendanceFixtureMixin, TestCase):
+    HEADER = "parent,student,campus,course,semester,weekday,start_time,sub_group,paid_status\n"
+
+    def setUp(self):
+        super().setUp()
+        self.add_students(1)                     # parent1 / Kid 1 已报名
+        User.objects.create(username="parent2", role="PARENT")
+
+    def run_import(self, body, **kwargs):
+        return import_enrollments(BytesIO((self.HEADER + body).encode()), "roster.csv", **kwargs)
+
+    def test_dry_run_reports_without_writing(self):
+        report = self.run_import(
+            "parent1,Kid 1,Auburn,Basketball,Term 3,Tue,16:00,7-10 basic,\n"      # 已存在
+            "parent1,Kid 1b,Auburn,Basketball,Term 3,2,16:00,,PAID\n"            # 新学生
+            "parent2,Amy,auburn,basketball,term 3,Tue,16:00,,\n"
+            "parent2,Amy,Auburn,Basketball,Term 3,Tue,16:00,,\n"                 # 文件内重复
+            "nobody,Bob,Auburn,Basketball,Term 3,Tue,16:00,,\n"
+            "parent2,Amy,Auburn,Basketball,Term 3,Wed,16:00,,\n"
+        )
+        self.assertFalse(report.committed)
+        self.assertEqual((report.new_students, report.new_enrollments), (2, 2))
+        self.assertEqual([(line, action) for line, action, _ in report.rows],
+                         [(2, "exists"), (3, "create"), (4, "create"), (5, "exists"), (6, "error"), (7, "error")])
+        self.assertIn("nobody", report.rows[4][2])
+        self.assertEqual((Student.objects.count(), Enrollment.objects.count()), (1, 1))
+
+    def test_errors_block_commit_unless_skipped(self):
+        body = "parent2,Amy,Auburn,Basketball,Term 3,Tue,16:00,,\nparent2,Amy,Auburn,Soccer,Term 3,Tue,16:00,,\n"
+        self.assertFalse(self.run_import(body, commit=True).committed)
+        self.assertEqual(Enrollment.objects.count(), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            report = self.run_import(body, commit=True, allow_errors=True)
+        self.assertTrue(report.committed)
+        en = Enrollment.objects.get(student__full_name="Amy")
+        # 时段下只有一个细分班 → 自动分班；状态默认 APPROVED
+        self.assertEqual((en.parent.username, en.course_slot_id, en.sub_group_id, en.status),
+                         ("parent2", self.slot.id, self.sg.id, "APPROVED"))
+
+    def test_commit_reuses_existing_students_with_bounded_queries(self):
+        rows = "".join(f"parent2,Kid {i % 3},Auburn,Basketball,Term 3,Tue,16:00,,\n" for i in range(3))
+        with CaptureQueriesContext(connection) as ctx:
+            report = self.run_import(rows * 20, commit=True)
+        self.assertEqual((report.new_students, report.new_enrollments, len(report.skipped)), (3, 3, 57))
+        self.assertLess(len(ctx.captured_queries), 20)
+        Student.objects.create(parent=User.objects.get(username="parent2"), full_name="Kid 9")
+        report = self.run_import("parent2,kid 9,Auburn,Basketball,Term 3,Tue,16:00,,\n", commit=True)
+        self.assertEqual((report.new_students, report.new_enrollments), (0, 1))
+        self.assertEqual(Student.objects.filter(full_name__iexact="kid 9").count(), 1)
+
+    def test_xlsx_upload_through_admin(self):
+        rows = [self.HEADER.strip().split(","), ["parent2", "Amy", "Auburn", "Basketball", "Term 3", 2, "16:00", "", ""]]
+        body = b"".join(get_exporter("xlsx").chunks(rows))
+        self.client.force_login(User.objects.create_superuser(username="root", password="x"))
+        url = reverse("admin:portal_enrollment_import")
+        resp = self.client.post(url, {"file": SimpleUploadedFile("roster.xlsx", body)})
+        self.assertContains(resp, "新报名 1")
+        self.assertEqual(Enrollment.objects.count(), 1)
+        token = resp.context["token"]
+        # 暂存在私有目录，不在公开的 MEDIA_ROOT 下
+        self.assertTrue(private_storage.exists(token))
+        self.assertTrue(private_storage.path(token).startswith(str(settings.PRIVATE_MEDIA_ROOT)))
+        resp = self.client.post(url, {"token": token, "confirm": "1"})
+        self.assertRedirects(resp, reverse("admin:portal_enrollment_changelist"))
+        self.assertTrue(Enrollment.objects.filter(student__full_name="Amy").exists())
+        self.assertFalse(private_storage.exists(token))
+
+    def test_admin_rejects_foreign_tokens_and_purges_stale_uploads(self):
+        self.client.force_login(User.objects.create_superuser(username="root", password="x"))
+        url = reverse("admin:portal_enrollment_import")
+        stale = private_storage.save("imports/0123456789abcdef-old.csv", BytesIO(self.HEADER.encode()))
+        old = timezone.now().timestamp() - 2 * 24 * 3600
+        os.utime(private_storage.path(stale), (old, old))
+        for token in ("imports/../../core/settings.py", "imports/0123456789abcdef-..", "exports/x.csv"):
+            resp = self.client.post(url, {"token": token, "confirm": "1"})
+            self.assertRedirects(resp, url, fetch_redirect_response=False)
+        self.assertFalse(private_storage.exists(stale))
+
+    def test_corrupt_xlsx_rows_are_file_errors(self):
+        buf = BytesIO()
+        ns = 'xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+        header = "".join(f'<c t="inlineStr"><is><t>{c}</t></is></c>' for c in self.HEADER.strip().split(","))
+        with zipfile.ZipFile(buf, "w") as zf:
+            # 第二行引用了不存在的共享字符串
+            zf.writestr("xl/worksheets/sheet1.xml", f'<worksheet {ns}><sheetData><row>{header}</row>'
+                                                     f'<row><c t="s"><v>99</v></c></row></sheetData></worksheet>')
+        buf.seek(0)
+        with self.assertRaisesMessage(ImportFileError, "文件无法解析"):
+            import_enrollments(buf, "roster.xlsx")
+
+    def test_command_rejects_missing_columns(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".csv") as fp:
+            fp.write("parent,student\nparent2,Amy\n")
+            fp.flush()
+            with self.assertRaisesMessage(CommandError, "缺少列"):
+                call_command("import_enrollments", fp.name, "--dry-run", stdout=StringIO())
+
+
+class SeedScaleBenchmarkTests(TestCase):
+    SMALL = {"campuses": 2, "terms": 2, "courses": 2, "slots": 1, "subgroups": 2, "parents": 12,
+             "notices_per_slot": 2, "comments_per_subgroup": 2}
+
+    def test_seed_is_deterministic_and_flushable(self):
+        counts = seed_scale(today=date(2025, 8, 13), **self.SMALL)
+        self.assertEqual((counts["slots"], counts["students"], counts["enrollments"]), (8, 24, 96))
+        self.assertEqual(Attendance.objects.count(), counts["attendance"])
+        self.assertEqual(EnrollmentAttendanceSummary.objects.count(),
+                         Enrollment.objects.filter(status="APPROVED").count())
+        first = list(Enrollment.objects.order_by("id").values_list("course_slot__start_time", "status", "paid_status"))
+        flush_scale_data("scale")
+        self.assertFalse(Enrollment.objects.exists() or User.objects.exists())
+        seed_scale(today=date(2025, 8, 13), **self.SMALL)
+        again = list(Enrollment.objects.order_by("id").values_list("course_slot__start_time", "status", "paid_status"))
+        self.assertEqual(first, again)
+
+    def test_benchmark_report_covers_hot_paths(self):
+        seed_scale(**self.SMALL)
+        User.objects.create_superuser(username="root", password="x")
+        with tempfile.NamedTemporaryFile(suffix=".json") as fp:
+            call_command("run_benchmarks", "--repeat", "2", "-o", fp.name, stdout=StringIO())
+            report = json.load(fp)
+        results = report["results"]
+        for key in ("attendance_table", "attendance_export_csv.csv", "parent_pages.parent_notices",
+                    "parent_pages.parent_resources", "attendance_mark.mark_batch", "admin_changelists.attendance"):
+            self.assertEqual(results[key]["status"], 200, key)
+            self.assertGreater(results[key]["queries"], 0)
+        # 打勾类场景在事务里回滚，不改数据
+        self.assertEqual(report["meta"]["rows"]["attendance"], Attendance.objects.count())
+        name, key, before, after = compare_reports(report, report)[0]
+        self.assertEqual((name, key, before), ("attendance_table", "queries", after))
+
+
+@override_settings(REQUEST_METRICS_ENABLED=True, REQUEST_METRICS_SERVER_TIMING=True, REQUEST_METRICS_WINDOW=3)
+class RequestMetricsTests(AttendanceFixtureMixin, TestCase):
+    def get_grid(self):
+        return self.client.get(reverse("assistant_attendance_table"), {
+            "campus_id": self.campus.id, "semester_id": self.sem.id, "weekday": 2,
+            "slot_id": self.slot.id, "subgroup_id": self.sg.id})
+
+    def test_samples_are_aggregated_per_url_name(self):
+        self.add_students(2)
+        resp = self.get_grid()
+        self.assertRegex(resp["Server-Timing"], r'^app;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries"$')
+        for _ in range(4):
+            self.get_grid()
+        row = summarize("assistant_attendance_table")
+        # 5 个请求，只保留最近 3 个样本
+        self.assertEqual((row["count"], row["window"]), (5, 3))
+        self.assertGreater(row["queries_max"], 0)
+        self.assertLessEqual(row["wall_p50"], row["wall_p99"])
+
+        self.client.force_login(User.objects.create_superuser(username="boss", password="x"))
+        resp = self.client.get(reverse("ops_request_metrics"))
+        self.assertIn("assistant_attendance_table", [r["name"] for r in resp.context["rows"]])
+        self.client.post(reverse("ops_request_metrics"), {"reset": "1"})
+        self.assertIsNone(summarize("assistant_attendance_table"))
+
+    async def test_async_chain_is_timed_without_thread_adaptation(self):
+        async def view(request):
+            return HttpResponse()
+        self.assertTrue(iscoroutinefunction(RequestMetricsMiddleware(view)))
+
+        await self.async_client.aforce_login(self.assistant)
+        resp = await self.async_client.get(reverse("assistant_attendance_table"), {
+            "campus_id": self.campus.id, "semester_id": self.sem.id, "weekday": 2,
+            "slot_id": self.slot.id, "subgroup_id": self.sg.id})
+        # 查询在 sync_to_async 的线程里执行，也要计进来
+        self.assertRegex(resp["Server-Timing"], r'desc="[1-9]\d* queries"$')
+        row = await sync_to_async(summarize)("assistant_attendance_table")
+        self.assertEqual(row["count"], 1)
+        self.assertGreater(row["queries_max"], 0)
+
+    def test_percentile_nearest_rank(self):
+        values = list(range(1, 101))
+        self.assertEqual((percentile(values, 50), percentile(values, 95), percentile([7], 99)), (50, 95, 7))
+
+    @override_settings(REQUEST_METRICS_ENABLED=False)
+    def test_disabled_middleware_is_not_loaded(self):
+        self.assertFalse(self.get_grid().has_header("Server-Timing"))
+
+
+@override_settings(SLOW_QUERY_THRESHOLD_MS=0.0001, SLOW_QUERY_EXPLAIN_ASYNC=False)
+class SlowQueryLogTests(AttendanceFixtureMixin, TestCase):
+    def get_grid(self):
+        return self.client.get(reverse("assistant_attendance_table"), {
+            "campus_id": self.campus.id, "semester_id": self.sem.id, "weekday": 2,
+            "slot_id": self.slot.id, "subgroup_id": self.sg.id})
+
+    def test_fingerprint_ignores_literals_and_in_list_length(self):
+        self.assertEqual(fingerprint("SELECT * FROM t WHERE id IN (%s, %s) AND x = 'a'"),
+                         fingerprint("SELECT  *  FROM t WHERE id IN (%s) AND x = 'bb'"))
+        self.assertNotEqual(fingerprint("SELECT * FROM t1"), fingerprint("SELECT * FROM t2"))
+
+    def test_slow_queries_are_deduplicated_with_call_site_and_plan(self):
+        self.add_students(2)
+        self.get_grid()     # 测试客户端同步调用异步视图：栈上只有 tests.py 的帧，调用位置要退回视图本身
+        rows = SlowQuery.objects.filter(sql__contains="portal_courseslot")
+        self.assertEqual(rows.count(), 1)
+        first = rows.get()
+        self.assertEqual(first.url_name, "assistant_attendance_table")
+        self.assertRegex(first.call_site, r"^portal/views\.py:\d+ in attendance_table$")
+        self.assertIsNotNone(first.explained_at)
+        self.assertTrue(first.explain)
+
+        cache.clear()
+        self.get_grid()
+        first.refresh_from_db()
+        self.assertEqual(first.count, 2)
+        self.assertEqual(SlowQuery.objects.filter(sql__contains="portal_courseslot").count(), 1)
+
+    async def test_async_views_are_captured(self):
+        await self.async_client.aforce_login(self.assistant)
+        await self.async_client.get(reverse("assistant_attendance_table"), {
+            "campus_id": self.campus.id, "semester_id": self.sem.id, "weekday": 2,
+            "slot_id": self.slot.id, "subgroup_id": self.sg.id})
+        first = await SlowQuery.objects.filter(sql__contains="portal_courseslot").aget()
+        self.assertEqual(first.url_name, "assistant_attendance_table")
+        self.assertRegex(first.call_site, r"^portal/views\.py:\d+ in attendance_table$")
+
+    def test_params_are_redacted_but_still_explainable(self):
+        sql = "SELECT id FROM portal_student WHERE full_name = %s AND id > %s"
+        with override_settings(SLOW_QUERY_EXPLAIN_ASYNC=False):
+            record_slow_queries([(sql, ["Kid Secret", 7], 500.0, "")])
+        row = SlowQuery.objects.get()
+        self.assertEqual(json.loads(row.params), ["<str:10>", 7])
+        self.assertNotIn("Secret", row.params)
+        SlowQuery.objects.update(explain="", explained_at=None)
+        self.assertEqual(explain_pending(), 1)                    # 脱敏后的参数照样能跑 EXPLAIN
+        self.assertNotIn("失败", SlowQuery.objects.get().explain)
+
+    @override_settings(SLOW_QUERY_MAX_ROWS=2)
+    def test_table_is_bounded(self):
+        self.get_grid()
+        self.assertEqual(SlowQuery.objects.count(), 2)
+        self.assertEqual(prune_slow_queries(max_rows=1), 1)
+        self.assertEqual(SlowQuery.objects.count(), 1)
+
+
+class ParentContextTests(AttendanceFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_students(1)
+        self.enrollment = Enrollment.objects.get()
+        self.parent = self.enrollment.parent
+        self.other_sg = SubGroup.objects.create(course_slot=self.slot, name="11-14 advanced")
+        with self.captureOnCommitCallbacks(execute=True):
+            for title, sg, visible in [("all", None, "ALL"), ("paid", None, "PAID"), ("paid-sg", self.sg, "PAID"),
+                                       ("paid-other-sg", self.other_sg, "PAID"), ("other-sg", self.other_sg, "ALL")]:
+                ClassNotice.objects.create(course_slot=self.slot, sub_group=sg, title=title, visible_to=visible)
+        self.client.force_login(self.parent)
+
+    def notice_titles(self):
+        return sorted(n.title for n in self.client.get(reverse("parent_notices")).context["items"])
+
+    def test_paid_visibility_and_invalidation(self):
+        self.assertEqual(self.notice_titles(), ["all"])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.enrollment.paid_status = "PAID"
+            self.enrollment.save()
+        # 已分班的缴费报名：只看得到本班的付费公告（与原 Exists 子查询一致）
+        self.assertEqual(self.notice_titles(), ["all", "paid-sg"])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.enrollment.sub_group = None
+            self.enrollment.save()
+        self.assertEqual(self.notice_titles(), ["all", "paid"])
+
+    def test_parent_pages_reuse_cached_context(self):
+        self.client.get(reverse("parent"))
+        for name in ("parent", "parent_notices", "parent_resources", "parent_enroll"):
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(self.client.get(reverse(name)).status_code, 200)
+            own = [q["sql"] for q in ctx.captured_queries
+                   if "django_session" not in q["sql"] and "accounts_user" not in q["sql"]]
+            self.assertLessEqual(len(own), 3, (name, own))
+            self.assertFalse([q for q in own if q.startswith('SELECT "portal_student"')], name)
+
+    def test_new_child_shows_up_on_enroll_page(self):
+        self.assertEqual([s["full_name"] for s in self.client.get(reverse("parent_enroll")).context["students"]],
+                         ["Kid 1"])
+        with self.captureOnCommitCallbacks(execute=True):
+            Student.objects.create(parent=self.parent, full_name="Amy")
+        self.assertEqual([s["full_name"] for s in self.client.get(reverse("parent_enroll")).context["students"]],
+                         ["Amy", "Kid 1"])
+
+
+class NoticeAudienceTests(AttendanceFixtureMixin, ExplainAssertionsMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_students(1)
+        self.enrollment = Enrollment.objects.get()
+        self.parent = self.enrollment.parent
+        self.client.force_login(self.parent)
+
+    def notice(self, title, sub_group=None, visible_to="ALL", **kw):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ClassNotice.objects.create(course_slot=self.slot, sub_group=sub_group, title=title,
+                                              visible_to=visible_to, **kw)
+
+    def titles(self, **params):
+        return [n.title for n in self.client.get(reverse("parent_notices"), params).context["items"]]
+
+    def test_save_normalizes_visible_to_and_sets_audience_key(self):
+        n = self.notice("legacy", sub_group=self.sg, visible_to="paid_only")
+        self.assertEqual((n.visible_to, n.audience_key), ("PAID", f"{self.slot.id}:{self.sg.id}:P"))
+        n.sub_group = None
+        n.save(update_fields=["sub_group"])
+        n.refresh_from_db()
+        self.assertEqual(n.audience_key, f"{self.slot.id}:*:P")
+
+    def test_migration_backfills_legacy_rows(self):
+        migration = importlib.import_module("portal.migrations.0017_notice_audience_key")
+        n = self.notice("legacy", visible_to="PAID")
+        ClassNotice.objects.filter(pk=n.pk).update(visible_to="PAID_ONLY", audience_key="")
+        migration.forwards(django_apps, None)
+        n.refresh_from_db()
+        self.assertEqual((n.visible_to, n.audience_key), ("PAID", f"{self.slot.id}:*:P"))
+
+    def test_unassigned_paid_enrollment_unlocks_parents_subgroups(self):
+        other = SubGroup.objects.create(course_slot=self.slot, name="other")
+        self.notice("paid-sg", sub_group=self.sg, visible_to="PAID")
+        self.notice("paid-other", sub_group=other, visible_to="PAID")
+        self.notice("hidden", is_active=False)
+        self.assertEqual(self.titles(), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Enrollment.objects.create(parent=self.parent, student=self.enrollment.student, course=self.course,
+                                      semester=self.sem, course_slot=self.slot, status="APPROVED",
+                                      paid_status="PAID")
+        # 未分班的缴费报名：家长报了的细分班（self.sg）的付费公告可见，其它细分班不可见
+        self.assertEqual(self.titles(), ["paid-sg"])
+
+    def test_paginates_with_constant_queries(self):
+        for i in range(NOTICES_PER_PAGE + 5):
+            self.notice(f"n{i:02d}")
+        with CaptureQueriesContext(connection) as ctx:
+            first = self.titles()
+        own = [q for q in ctx.captured_queries if "portal_noticedelivery" in q["sql"]]
+        self.assertEqual(len(own), 3, own)    # COUNT + 当前页 + 标记已读
+        self.assertEqual(len(first), NOTICES_PER_PAGE)
+        self.assertEqual(first[0], f"n{NOTICES_PER_PAGE + 4:02d}")
+        self.assertEqual(len(self.titles(page=2)), 5)
+        self.assertUsesIndex(ClassNotice.objects.filter(audience_key__in=["1:*:A", "1:2:A"], is_active=True),
+                             "notice_audience_idx")
+
+
+class NoticeInboxTests(AttendanceFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_students(2)
+        self.parent1, self.parent2 = (e.parent for e in Enrollment.objects.order_by("id"))
+
+    def inbox(self, parent):
+        return set(NoticeDelivery.objects.filter(parent=parent, is_active=True)
+                   .values_list("notice__title", flat=True))
+
+    def unread(self, parent):
+        self.client.force_login(parent)
+        return self.client.get(reverse("parent_notices_unread")).json()["unread"]
+
+    def test_fanout_on_create_and_audience_change(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            n = ClassNotice.objects.create(course_slot=self.slot, title="Welcome", visible_to="PAID")
+        self.assertEqual(NoticeDelivery.objects.count(), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            en = Enrollment.objects.get(parent=self.parent1)
+            en.paid_status, en.sub_group = "PAID", None
+            en.save()
+        self.assertEqual((self.inbox(self.parent1), self.inbox(self.parent2)), ({"Welcome"}, set()))
+        self.assertEqual(self.unread(self.parent1), 1)
+        self.client.get(reverse("parent_notices"))
+        self.assertEqual(self.unread(self.parent1), 0)
+        # 改成全员可见：只给 parent2 补一行，parent1 的已读状态保留
+        with self.captureOnCommitCallbacks(execute=True):
+            n.visible_to = "ALL"
+            n.save()
+        self.assertEqual((self.inbox(self.parent1), self.inbox(self.parent2)), ({"Welcome"}, {"Welcome"}))
+        self.assertEqual((self.unread(self.parent1), self.unread(self.parent2)), (0, 1))
+
+    def test_flag_changes_update_in_place(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            n = ClassNotice.objects.create(course_slot=self.slot, title="Welcome")
+        ids = set(NoticeDelivery.objects.values_list("id", flat=True))
+        with CaptureQueriesContext(connection) as ctx, self.captureOnCommitCallbacks(execute=True):
+            n.is_active = False
+            n.title = "Edited"
+            n.save()
+        self.assertEqual(set(NoticeDelivery.objects.values_list("id", flat=True)), ids)
+        self.assertFalse(NoticeDelivery.objects.filter(is_active=True).exists())
+        self.assertFalse([q for q in ctx.captured_queries if "portal_noticedelivery" in q["sql"]
+                          and ("INSERT" in q["sql"] or "DELETE" in q["sql"])])
+        self.assertEqual(self.unread(self.parent1), 0)
+
+    @override_settings(NOTICE_FANOUT_ASYNC=True)
+    def test_fanout_is_a_durable_job_run_by_the_worker(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            n = ClassNotice.objects.create(course_slot=self.slot, title="Welcome")
+            en = Enrollment.objects.get(parent=self.parent1)
+            en.paid_status = "PAID"
+            en.save()
+        # 和业务写入同一事务登记，提交后由 worker 执行
+        self.assertEqual(sorted(ExportJob.objects.values_list("kind", "params")),
+                         [("notice_fanout", {"args": [n.pk]}), ("notice_sync_parents", {"args": [[self.parent1.pk]]})])
+        self.assertFalse(NoticeDelivery.objects.exists())
+        call_command("run_export_worker", "--once", stdout=StringIO())
+        self.assertEqual((self.inbox(self.parent1), self.inbox(self.parent2)), ({"Welcome"}, {"Welcome"}))
+        self.assertEqual(set(ExportJob.objects.values_list("status", flat=True)), {ExportJob.Status.DONE})
+
+    @override_settings(NOTICE_FANOUT_ASYNC=True)
+    def test_failed_inbox_task_is_retried(self):
+        calls = []
+
+        def flaky(notice_id):
+            calls.append(notice_id)
+            if len(calls) == 1:
+                raise OperationalError("connection lost")
+            return fanout_notice(notice_id)
+
+        with mock.patch.dict(TASK_KINDS, {"notice_fanout": flaky}):
+            ClassNotice.objects.create(course_slot=self.slot, title="Welcome")
+            call_command("run_export_worker", "--once", stdout=StringIO())
+        job = ExportJob.objects.get()
+        self.assertEqual((job.status, job.attempts, len(calls)), (ExportJob.Status.DONE, 2, 2))
+        self.assertEqual(self.inbox(self.parent2), {"Welcome"})
+
+        job = ExportJob.objects.create(kind="notice_fanout", params={"args": [0]})
+        with mock.patch.dict(TASK_KINDS, {"notice_fanout": mock.Mock(side_effect=OperationalError("down"))}):
+            call_command("run_export_worker", "--once", stdout=StringIO())
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (ExportJob.Status.FAILED, TASK_MAX_ATTEMPTS))
+        self.assertIn("OperationalError", job.error)
+
+    def test_rebuild_command_repairs_bulk_writes(self):
+        ClassNotice.objects.bulk_create([ClassNotice(course_slot=self.slot, title="Bulk",
+                                                     audience_key=notice_audience_key(self.slot.id, None, False))])
+        out = StringIO()
+        call_command("rebuild_notice_inbox", stdout=out)
+        self.assertIn("新增 2", out.getvalue())
+        self.assertEqual(self.inbox(self.parent2), {"Bulk"})
+
+
+class CommentHistoryPaginationTests(ExplainAssertionsMixin, AttendanceFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_students(1)
+        self.enrollment = Enrollment.objects.get()
+        Comment.objects.bulk_create(
+            [Comment(role="ASSISTANT", user=self.assistant, sub_group=self.sg, content=f"a{i}") for i in range(25)]
+            + [Comment(role="PARENT", user=self.enrollment.parent, sub_group=self.sg, enrollment=self.enrollment,
+                       content=f"p{i}") for i in range(COMMENTS_PAGE_SIZE + 3)])
+        # 时间戳全部相同：翻页只能靠 id 决胜负
+        Comment.objects.update(created_at=timezone.now())
+
+    def fetch(self, **params):
+        return self.client.get(reverse("assistant_comments_api"), {"subgroup_id": self.sg.id, **params})
+
+    def test_api_walks_all_pages_with_constant_queries(self):
+        seen, cursor = [], None
+        while True:
+            with CaptureQueriesContext(connection) as ctx:
+                data = self.fetch(limit=10, **({"cursor": cursor} if cursor else {})).json()
+            own = [q for q in ctx.captured_queries if "portal_comment" in q["sql"]]
+            self.assertEqual(len(own), 1)
+            seen += [c["id"] for c in data["comments"]]
+            cursor = data["next_cursor"]
+            if not cursor:
+                break
+        expected = list(Comment.objects.filter(role="ASSISTANT").order_by("-id").values_list("id", flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_bad_cursor_is_rejected(self):
+        self.assertEqual(self.fetch(cursor="not-a-cursor").status_code, 400)
+        self.assertEqual(self.fetch(limit="x").status_code, 400)
+
+    def test_parent_dashboard_pages_comments(self):
+        self.client.force_login(self.enrollment.parent)
+        resp = self.client.get(reverse("parent"))
+        self.assertEqual(len(resp.context["comments"]), COMMENTS_PAGE_SIZE)
+        older = self.client.get(reverse("parent"), {"comments_cursor": resp.context["comments_next_cursor"]})
+        self.assertEqual(len(older.context["comments"]), 3)
+        self.assertIsNone(older.context["comments_next_cursor"])
+        self.assertContains(older, "Newest comments")
+
+    def test_keyset_queries_use_composite_indexes(self):
+        _, cursor = comment_page(Comment.objects.filter(role="ASSISTANT", sub_group=self.sg), size=5)
+        created_at, pk = decode_cursor(cursor)
+        after = Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+        self.assertUsesIndex(Comment.objects.filter(after, role="ASSISTANT", sub_group=self.sg)
+                             .order_by("-created_at", "-id"), "comment_sg_role_created_idx")
+        self.assertUsesIndex(Comment.objects.filter(role="PARENT", user=self.enrollment.parent)
+                             .order_by("-created_at", "-id"), "comment_user_role_created_idx")
+
+
+class FullTextSearchTests(AttendanceFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.add_students(1)
+        self.enrollment = Enrollment.objects.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.by_title = ClassNotice.objects.create(course_slot=self.slot, title="Dribbling drills",
+                                                       content="Bring a ball.")
+            self.by_body = ClassNotice.objects.create(course_slot=self.slot, title="Week 3",
+                                                      content="More dribbling drills next week; 周六集合时间改为九点")
+            self.resource = LearningResource.objects.create(sub_group=self.sg, title="Passing video")
+            self.comment = Comment.objects.create(role="PARENT", user=self.enrollment.parent, sub_group=self.sg,
+                                                  enrollment=self.enrollment, content="Can we practise dribbling?")
+            Comment.objects.create(role="ASSISTANT", user=self.assistant, sub_group=self.sg, content="dribbling ok")
+
+    def test_ranked_hits_per_kind(self):
+        result = search("dribbling drills", kinds=["notice"])
+        self.assertFalse(result.timed_out)
+        self.assertEqual([h.object_id for h in result.hits], [self.by_title.id, self.by_body.id])
+        self.assertEqual({h.kind for h in search("dribbling").hits},
+                         {"notice", "parent_comment", "assistant_comment"})
+        # trigram：中文子串；两个字符的短词走 LIKE
+        self.assertEqual([h.object_id for h in search("集合时间").hits], [self.by_body.id])
+        self.assertEqual([h.object_id for h in search("九点").hits], [self.by_body.id])
+
+    def test_documents_follow_writes_and_renames(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sg.name = "Elite squad"
+            self.sg.save()
+        self.assertEqual({h.kind for h in search("elite squad").hits},
+                         {"resource", "parent_comment", "assistant_comment"})
+        # 没改名的保存不重建检索文档
+        with CaptureQueriesContext(connection) as ctx, self.captureOnCommitCallbacks(execute=True):
+            self.sg.save()
+            self.course.is_active = False
+            self.course.save()
+            self.enrollment.student.save()
+        self.assertFalse([q["sql"] for q in ctx.captured_queries if "portal_searchdocument" in q["sql"]])
+        with self.captureOnCommitCallbacks(execute=True):
+            ParentComment.objects.get(pk=self.comment.pk).delete()
+        self.assertFalse(SearchDocument.objects.filter(kind="parent_comment").exists())
+
+    def test_admin_search_uses_index(self):
+        admin_user = User.objects.create_superuser(username="root", password="x", email="r@x.io")
+        self.client.force_login(admin_user)
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get(reverse("admin:portal_classnotice_changelist"), {"q": "drills"})
+        # 相关度顺序（标题命中在前），不是后台默认的新公告在前
+        self.assertEqual([n.pk for n in resp.context["cl"].result_list], [self.by_title.id, self.by_body.id])
+        self.assertFalse([q["sql"] for q in ctx.captured_queries
+                          if "portal_classnotice" in q["sql"] and "LIKE" in q["sql"]])
+        resp = self.client.get(reverse("admin:portal_classnotice_changelist"), {"q": "drills", "o": "-1"})
+        self.assertEqual(len(resp.context["cl"].result_list), 2)    # 点了列头：按列头排序
+        with self.settings(SEARCH_MAX_RESULTS=1):
+            resp = self.client.get(reverse("admin:portal_classnotice_changelist"), {"q": "drills"})
+        self.assertEqual([n.pk for n in resp.context["cl"].result_list], [self.by_title.id])
+        self.assertIn("只显示相关度最高的 1 条", " ".join(str(m) for m in resp.context["messages"]))
+        resp = self.client.get(reverse("admin:portal_parentcomment_changelist"), {"q": "dribbling"})
+        self.assertEqual([c.pk for c in resp.context["cl"].result_list], [self.comment.pk])
+        resp = self.client.get(reverse("ops_search"), {"q": "dribbling", "kind": "notice"})
+        self.assertEqual([h["hit"].object_id for h in resp.context["hits"]], [self.by_title.id, self.by_body.id])
+        self.assertContains(resp, reverse("admin:portal_classnotice_change", args=[self.by_title.id]))
+
+    def test_query_is_interrupted_after_timeout(self):
+        with mock.patch("portal.search.time.monotonic", side_effect=[0.0] + [10.0] * 1000):
+            result = search("dribbling drills", timeout_ms=100)
+        self.assertTrue(result.timed_out)
+        self.assertEqual(result.hits, [])
+        self.assertEqual(len(search("dribbling").hits), 4)    # 连接 / 事务还能继续用
+
+    def test_postgres_matches_cjk_terms_as_substrings(self):
+        # 'simple' tsvector 不切中文：含中日韩文字的词走 LIKE，其余仍走 tsquery
+        backend = PostgresBackend()
+        with mock.patch.object(PostgresBackend, "_execute", return_value=[]) as execute:
+            backend.query(["集合时间", "drills"], ["notice"], 10, 500)
+            backend.query(["集合时间"], None, 10, 500)
+        (mixed_sql, mixed_params, _), (cjk_sql, cjk_params, _) = (c.args for c in execute.call_args_list)
+        self.assertIn("plainto_tsquery('simple', %s)", mixed_sql)
+        self.assertIn("LIKE", mixed_sql)
+        self.assertEqual(mixed_params[0], "drills")
+        self.assertIn("%集合时间%", mixed_params)
+        self.assertNotIn("search_vector", cjk_sql)
+        self.assertEqual(cjk_params, ["%集合时间%"] * 3 + [10])
+
+    def test_rebuild_command(self):
+        SearchDocument.objects.all().delete()
+        out = StringIO()
+        call_command("rebuild_search_index", stdout=out)
+        self.assertIn("已写入 5 个检索文档", out.getvalue())
+
+
+class AsyncJsonEndpointTests(AttendanceFixtureMixin, TestCase):
+    """JSON 接口是异步视图：走 ASGI handler（async_client）"""
+
+    def setUp(self):
+        super().setUp()
+        self.add_students(2)
+        self.enrollment = Enrollment.objects.select_related("parent").order_by("id").first()
+        Comment.objects.create(role="ASSISTANT", user=self.assistant, sub_group=self.sg, content="good pass")
+
+    async def test_endpoints_under_asgi(self):
+        await self.async_client.aforce_login(self.assistant)
+        resp = await self.async_client.get(reverse("assistant_api_slots"), {
+            "campus_id": self.campus.id, "semester_id": self.sem.id, "weekday": 2})
+        self.assertEqual([s["id"] for s in resp.json()["slots"]], [self.slot.id])
+        resp = await self.async_client.get(reverse("assistant_api_subgroups"), {"slot_id": self.slot.id},
+                                           headers={"if-none-match": resp["ETag"]})
+        self.assertEqual(resp.json(), {"subgroups": [{"id": self.sg.id, "label": "7-10 basic"}]})
+        resp = await self.async_client.get(reverse("assistant_api_subgroups"), {"slot_id": self.slot.id},
+                                           headers={"if-none-match": resp["ETag"]})
+        self.assertEqual(resp.status_code, 304)
+
+        resp = await self.async_client.post(reverse("assistant_attendance_mark"), data=json.dumps({
+            "enrollment_id": self.enrollment.id, "course_slot_id": self.slot.id, "sub_group_id": self.sg.id,
+            "week_no": 2, "present": True}), content_type="application/json")
+        self.assertEqual(resp.json(), {"ok": True})
+        self.assertEqual((await Attendance.objects.aget(enrollment=self.enrollment)).marked_by_id, self.assistant.id)
+
+        resp = await self.async_client.get(reverse("assistant_attendance_table"), {
+            "campus_id": self.campus.id, "semester_id": self.sem.id, "weekday": 2,
+            "slot_id": self.slot.id, "subgroup_id": self.sg.id, "weeks": "1,2"})
+        rows = {r["enrollment_id"]: r["status"] for r in resp.json()["rows"]}
+        self.assertEqual(rows[self.enrollment.id], "01")
+        self.assertEqual(len(rows), 2)
+
+        resp = await self.async_client.get(reverse("assistant_comments_api"), {"subgroup_id": self.sg.id})
+        self.assertEqual([c["content"] for c in resp.json()["comments"]], ["good pass"])
+        self.assertIsNone(resp.json()["next_cursor"])
+
+    async def test_role_checks_still_apply(self):
+        url = reverse("assistant_attendance_table")
+        resp = await self.async_client.get(url)
+        self.assertEqual(resp.status_code, 302)
+        await self.async_client.aforce_login(self.enrollment.parent)
+        self.assertEqual((await self.async_client.get(url)).status_code, 302)
+        resp = await self.async_client.get(reverse("assistant_api_subgroups"), {"slot_id": self.slot.id})
+        self.assertEqual(resp.status_code, 200)
+
+
+class LoadBenchmarkTests(AttendanceFixtureMixin, LiveServerTestCase):
+    def test_load_run_against_live_server(self):
+        self.add_students(3)
+        Comment.objects.create(role="ASSISTANT", user=self.assistant, sub_group=self.sg, content="x")
+        ctx = BenchmarkContext()
+        reqs = build_requests(ctx, include_writes=True)
+        self.assertEqual({r[0] for r in reqs}, {"api_slots", "api_subgroups", "attendance_table",
+                                                "assistant_comments_api", "attendance_mark"})
+        self.assertNotIn("attendance_mark", {r[0] for r in build_requests(ctx)})
+
+        # 内存 SQLite 与测试线程共用一条连接：这里只串行发，验证登录态 / CSRF / 统计
+        result = run_load(self.live_server_url, reqs, auth_headers(ctx.assistant), concurrency=1, total=16)
+        self.assertEqual((result["requests"], result["errors"]), (16, 0))
+        self.assertEqual(result["status"], {"200": 16})
+        self.assertEqual(set(result["per_target"]), {r[0] for r in reqs})
+        self.assertEqual(Attendance.objects.filter(week_no=1, status="PRESENT").count(), 3)
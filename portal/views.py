@@ -1,4 +1,5 @@
 # portal/views.py
+from itertools import groupby
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.auth import get_user_model
@@ -6,23 +7,30 @@ from django.shortcuts import render, redirect
 from django.views.decorators.http import require_http_methods
 from django.urls import reverse, reverse_lazy
 from django.http import JsonResponse, HttpResponseBadRequest
-from django.template.loader import render_to_string
 from django.db.models import Q
 from django.conf import settings
-import csv
-from django.http import HttpResponse
-from io import StringIO
-import calendar
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from django.core.paginator import Paginator
 from django.views.decorators.csrf import ensure_csrf_cookie
 from .models import (
     Campus, Semester, Course, CourseSlot, SubGroup,Student,Comment,ParentComment,
-    Enrollment, Attendance, compute_date_for_week,ClassNotice, LearningResource
+    Enrollment, Attendance, ClassNotice, LearningResource
 )
-from django.db.models import Q, Exists, OuterRef
 from django.db import IntegrityError
+from asgiref.sync import sync_to_async
 from django.contrib.auth import login, get_user_model
 from django.views.decorators.http import require_http_methods
 from .forms import RegisterForm
+from .attendance import upsert_attendance, aget_attendance_matrix, roster_attendance_rows
+from .exports import EXPORT_CHUNK_SIZE, available_formats, get_exporter
+from .caching import NamespacedCache, backend_info
+from .metrics import all_summaries, reset_metrics
+from .comments import COMMENTS_PAGE_SIZE, MAX_COMMENTS_PAGE_SIZE, acomment_page, comment_page
+from .parent_context import get_parent_context
+from .search import SEARCH_KINDS, search
+from .notices import NOTICES_PER_PAGE, inbox_for_parent, mark_read, unread_count
+from .lookups import acached_lookup, aslots_payload, asubgroups_payload
 from django.http import HttpResponseForbidden
 from django.contrib.admin.sites import site as admin_site
 from django.contrib.admin.views.decorators import staff_member_required
@@ -120,32 +128,91 @@ def logout_view(request):
 def custom_admin_view(request):
     return admin_site.index(request)
 
+
+# 后台：各缓存命名空间的命中率 / key 数，Redis 的全局淘汰数（挂在 ops-a9d4b1/cache-stats/）
+def ops_cache_stats(request):
+    if request.method == "POST" and request.POST.get("reset"):
+        for ns in NamespacedCache.registry.values():
+            ns.reset_stats()
+        return redirect("ops_cache_stats")
+    rows = [{"namespace": name, "description": ns.description, "timeout": ns.timeout, **ns.stats()}
+            for name, ns in sorted(NamespacedCache.registry.items())]
+    return render(request, "admin/portal/cache_stats.html", {
+        **admin_site.each_context(request),
+        "title": "Cache stats",
+        "rows": rows,
+        "info": backend_info(),
+        "stats_enabled": getattr(settings, "CACHE_STATS_ENABLED", False),
+    })
+
+
+# 后台：各 URL 的耗时 / SQL 条数分位数（挂在 ops-a9d4b1/request-metrics/，见 portal/metrics.py）
+def ops_request_metrics(request):
+    if request.method == "POST" and request.POST.get("reset"):
+        reset_metrics()
+        return redirect("ops_request_metrics")
+    return render(request, "admin/portal/request_metrics.html", {
+        **admin_site.each_context(request),
+        "title": "Request metrics",
+        "rows": all_summaries(),
+        "enabled": getattr(settings, "REQUEST_METRICS_ENABLED", False),
+        "server_timing": getattr(settings, "REQUEST_METRICS_SERVER_TIMING", False),
+        "window": getattr(settings, "REQUEST_METRICS_WINDOW", 200),
+    })
+
+# 后台：评论 / 公告 / 学习资料的全文检索（挂在 ops-a9d4b1/search/，见 portal/search.py）
+def ops_search(request):
+    q = request.GET.get("q", "").strip()
+    kind = request.GET.get("kind") or None
+    if kind not in SEARCH_KINDS:
+        kind = None
+    result = search(q, kinds=[kind] if kind else None)
+    hits = [{
+        "hit": hit,
+        "label": SEARCH_KINDS[hit.kind].label,
+        "url": reverse(f"admin:portal_{SEARCH_KINDS[hit.kind].admin_model.lower()}_change", args=[hit.object_id]),
+    } for hit in result.hits if hit.kind in SEARCH_KINDS]
+    return render(request, "admin/portal/search.html", {
+        **admin_site.each_context(request),
+        "title": "Search",
+        "q": q,
+        "kind": kind,
+        "kinds": [(k.name, k.label) for k in SEARCH_KINDS.values()],
+        "hits": hits,
+        "result": result,
+        "max_results": getattr(settings, "SEARCH_MAX_RESULTS", 200),
+    })
+
 @login_required
 @role_required("PARENT")
 def parent_dashboard(request):
-    # 1. 拿到该 parent 的所有 APPROVED enrollments，用于下拉
+    # 1. 该 parent 的所有 APPROVED enrollments（ID 来自缓存的家长上下文），用于出勤汇总和下拉
+    pctx = get_parent_context(request.user.id)
     enrolls = (
         Enrollment.objects
-        .filter(parent=request.user, status="APPROVED")
-        .select_related("student", "sub_group")
+        .filter(pk__in=pctx.enrollment_ids)
+        .select_related("student", "sub_group", "course", "attendance_summary")
         .order_by("-created_at")
-    )
+    ) if pctx.enrollment_ids else Enrollment.objects.none()
 
     # 2. 准备一个空的提交表单
     form = CommentForm()
 
-    # 3. 拿到这个 parent 已经提交过的所有评论
-    comments = (
-        Comment.objects
-        .filter(user=request.user, role="PARENT")
-        .select_related("sub_group", "enrollment__student")
-        .order_by("-created_at")
-    )
+    # 3. 这个 parent 提交过的评论：游标分页，?comments_cursor= 翻到更早的
+    my_comments = (Comment.objects.filter(user=request.user, role="PARENT")
+                   .select_related("sub_group", "enrollment__student"))
+    try:
+        comments, next_cursor = comment_page(my_comments, request.GET.get("comments_cursor"))
+    except ValueError:
+        # 游标被改坏了：回到第一页
+        comments, next_cursor = comment_page(my_comments)
 
     return render(request, "portal/parent.html", {
         "enrolls": enrolls,
         "form": form,
         "comments": comments,
+        "comments_next_cursor": next_cursor,
+        "comments_paged": bool(request.GET.get("comments_cursor")),
     })
 
 @login_required
@@ -164,12 +231,7 @@ def parent_comment_submit(request):
         return redirect("parent")
 
     # 取该家长在这个 sub_group 下最新一个 APPROVED 的 enrollment（可能为 None）
-    enrollment = (
-        Enrollment.objects
-        .filter(parent=request.user, sub_group=sub, status="APPROVED")
-        .order_by("-created_at")
-        .first()
-    )
+    enrollment_id = get_parent_context(request.user.id).latest_enrollment_in(sub.id)
 
     form = CommentForm(request.POST)
     if form.is_valid():
@@ -177,7 +239,7 @@ def parent_comment_submit(request):
         comment.role = "PARENT"
         comment.user = request.user
         comment.sub_group = sub
-        comment.enrollment = enrollment
+        comment.enrollment_id = enrollment_id
         comment.save()
         messages.success(request, "评论已提交。")
     else:
@@ -211,38 +273,52 @@ def assistant_attendance(request):
         "semesters": semesters,
         "weekdays": weekdays,
         "form": CommentForm(),
+        "export_formats": available_formats(),
     })
 
 # 顶部 import 已有，无需改
 
 # ---- A) 放开级联接口权限：助教 + 家长 ----
+# 以下 JSON 接口（级联、签到表、打勾、评论历史）是异步视图：ASGI 部署（SERVER_MODE=asgi）时
+# 等数据库 / 缓存不占 worker 线程；WSGI 下 Django 自动包一层，行为不变
 @login_required
 @role_required("ASSISTANT","PARENT")
-def api_slots(request):
-    campus_id = request.GET.get("campus_id")
-    semester_id = request.GET.get("semester_id")
-    weekday = request.GET.get("weekday")
-    if not (campus_id and semester_id and weekday):
+async def api_slots(request):
+    try:
+        campus_id = int(request.GET.get("campus_id"))
+        semester_id = int(request.GET.get("semester_id"))
+        weekday = int(request.GET.get("weekday"))
+    except (TypeError, ValueError):
         return JsonResponse({"slots": []})
-    qs = CourseSlot.objects.filter(
-        semester_id=semester_id,
-        weekday=int(weekday),
-        course__campus_id=campus_id
-    ).select_related("course")
-    data = [{"id": s.id,
-             "label": f"{s.course.title} {s.start_time.strftime('%H:%M')}–{s.end_time.strftime('%H:%M')}"}
-            for s in qs.order_by("start_time")]
-    return JsonResponse({"slots": data})
+    return await _lookup_response(
+        request, f"slots:{campus_id}:{semester_id}:{weekday}",
+        lambda: aslots_payload(campus_id, semester_id, weekday),
+    )
 
 @login_required
 @role_required("ASSISTANT","PARENT")
-def api_subgroups(request):
-    slot_id = request.GET.get("slot_id")
-    if not slot_id:
+async def api_subgroups(request):
+    try:
+        slot_id = int(request.GET.get("slot_id"))
+    except (TypeError, ValueError):
         return JsonResponse({"subgroups": []})
-    qs = SubGroup.objects.filter(course_slot_id=slot_id).order_by("id")
-    data = [{"id": g.id, "label": g.name} for g in qs]
-    return JsonResponse({"subgroups": data})
+    return await _lookup_response(request, f"subgroups:{slot_id}", lambda: asubgroups_payload(slot_id))
+
+LOOKUP_MAX_AGE = 60
+
+async def _lookup_response(request, suffix, builder):
+    """
+    级联接口共用：结果走缓存，带 ETag；浏览器带 If-None-Match 命中则 304
+    private：接口需要登录，不让中间代理跨用户共享
+    """
+    body, etag = await acached_lookup(suffix, builder)
+    if etag in request.headers.get("If-None-Match", ""):
+        resp = HttpResponseNotModified()
+    else:
+        resp = HttpResponse(body, content_type="application/json")
+    resp["ETag"] = etag
+    patch_cache_control(resp, private=True, max_age=LOOKUP_MAX_AGE)
+    return resp
 
 # ---- B) 家长发起报名 ----
 
@@ -322,7 +398,8 @@ def _parent_enroll_ctx(request):
     campuses  = Campus.objects.all().order_by("name")
     semesters = Semester.objects.filter(is_active=True).order_by("-start_date")
     weekdays  = [(i, ["Mon","Tue","Wed","Thu","Fri","Sat","Sun"][i-1]) for i in range(1,8)]
-    students  = Student.objects.filter(parent=request.user, is_active=True).order_by("full_name")
+    # 孩子列表来自缓存的家长上下文（模板只用 id / full_name）
+    students  = [{"id": sid, "full_name": name} for sid, name in get_parent_context(request.user.id).students]
     return {"campuses": campuses, "semesters": semesters, "weekdays": weekdays, "students": students}
 
 
@@ -356,7 +433,7 @@ def cancel_enrollment(request, enrollment_id):
 # ---- C) 助教表：名单过滤优先使用 course_slot（兼容旧数据）----
 @login_required
 @role_required("ASSISTANT")
-def attendance_table(request):
+async def attendance_table(request):
     try:
         campus_id   = int(request.GET.get("campus_id"))
         semester_id = int(request.GET.get("semester_id"))
@@ -368,7 +445,7 @@ def attendance_table(request):
         return HttpResponseBadRequest("missing or invalid params")
 
     try:
-        slot = CourseSlot.objects.select_related("course","semester").get(
+        slot = await CourseSlot.objects.select_related("course","semester").aget(
             id=slot_id, semester_id=semester_id, weekday=weekday, course__campus_id=campus_id
         )
     except CourseSlot.DoesNotExist:
@@ -377,51 +454,35 @@ def attendance_table(request):
     sem  = slot.semester
     week_count = sem.week_count
 
-    header = []
-    for w in range(1, week_count + 1):
-        d = compute_date_for_week(sem.start_date, w, slot.weekday)
-        # 生成 "Tue 07/22"
-        dow = calendar.day_abbr[d.weekday()]          # Mon/Tue/...
-        header.append({"week": w, "date": f"{dow} {d.strftime('%m/%d')}"})
-
-
-    # 优先筛选选中时段的报名；兼容旧数据（还未写入 course_slot 的）
-    enrollments = (Enrollment.objects.filter(status="APPROVED")
-                   .filter(Q(course_slot_id=slot.id) | (Q(course_slot__isnull=True) & Q(course_id=slot.course_id) & Q(semester_id=sem.id))))
-    if subgroup_id:
-        enrollments = enrollments.filter(Q(sub_group_id=subgroup_id) | Q(sub_group_id__isnull=True))
-
-    enrollments = enrollments.select_related("parent","sub_group").order_by("id")
+    # 可选 weeks=3 或 weeks=3,4：只返回这些周（局部刷新用）
+    weeks = list(range(1, week_count + 1))
+    weeks_param = request.GET.get("weeks")
+    if weeks_param:
+        try:
+            wanted = {int(w) for w in weeks_param.split(",") if w}
+        except ValueError:
+            return HttpResponseBadRequest("invalid weeks")
+        weeks = [w for w in weeks if w in wanted]
 
-    existing_qs = Attendance.objects.filter(course_slot=slot, week_no__lte=week_count)
-    if subgroup_id:
-        existing_qs = existing_qs.filter(Q(sub_group_id=subgroup_id) | Q(sub_group_id__isnull=True))
+    # 表头 "Tue 07/22" 来自预计算的学期周历（含放假顺延）
+    cal = sem.calendar(slot.weekday)
+    header = [{"week": w, "date": cal.label_of(w)} for w in weeks]
 
-    ex_map = {(a.enrollment_id, a.week_no, a.sub_group_id or 0): (a.status == "PRESENT") for a in existing_qs}
 
-    rows = []
-    for en in enrollments:
-        row_subgroup_id = en.sub_group_id or (subgroup_id or None)
-        cells = [{"week": h["week"], "present": ex_map.get((en.id, h["week"], row_subgroup_id or 0), False)} for h in header]
-        rows.append({
-            "enrollment_id": en.id,
-            "student_name": en.student.full_name if en.student else en.parent.username,
-            "parent_name": en.parent.username,
-            "paid": (en.paid_status == "PAID"),
-            "subgroup_name": en.sub_group.name if en.sub_group else "",
-            "subgroup_id": row_subgroup_id or "",
-            "slot_id": slot.id,
-            "cells": cells,
-        })
+    # 名单 + 出勤矩阵走缓存；局部刷新时按列截取状态串
+    matrix = await aget_attendance_matrix(slot, subgroup_id)
+    rows = matrix["rows"]
+    if len(weeks) != len(matrix["weeks"]):
+        idx = [w - 1 for w in weeks]
+        rows = [{**r, "status": "".join(r["status"][i] for i in idx)} for r in rows]
 
-    html = render_to_string("portal/_attendance_table.html", {"slot": slot, "sem": sem, "header": header, "rows": rows}, request=request)
-    return JsonResponse({"html": html})
+    return JsonResponse({"slot_id": slot.id, "weeks": weeks, "header": header, "rows": rows})
 
 
 @login_required
 @role_required("ASSISTANT")
 @require_http_methods(["POST"])
-def attendance_mark(request):
+async def attendance_mark(request):
     """
     打勾/取消勾：Upsert 到 Attendance
     JSON:
@@ -440,31 +501,64 @@ def attendance_mark(request):
         return HttpResponseBadRequest("invalid body")
 
     try:
-        slot = CourseSlot.objects.select_related("semester").get(id=slot_id)
+        slot = await CourseSlot.objects.select_related("semester").aget(id=slot_id)
     except CourseSlot.DoesNotExist:
         return HttpResponseBadRequest("invalid slot")
 
     sem  = slot.semester
-    d    = compute_date_for_week(sem.start_date, week_no, slot.weekday)
-
-    obj, created = Attendance.objects.get_or_create(
-        enrollment_id=enrollment_id,
-        course_slot_id=slot_id,
-        week_no=week_no,
+    # 写入要在一个事务里（select_for_update + 汇总刷新 + 提交后 bump 矩阵缓存），事务只能在同步代码里开
+    await sync_to_async(upsert_attendance)(
+        slot=slot,
         sub_group_id=subgroup_id,
-        defaults={
-            "date": d,
-            "status": "PRESENT" if present else "ABSENT",
-            "marked_by_id": request.user.id,
-        },
+        marks={(enrollment_id, week_no): present},
+        user=await request.auser(),
+        date_for_week=sem.calendar(slot.weekday).date_of,
     )
-    if not created:
-        obj.status = "PRESENT" if present else "ABSENT"
-        obj.date = d
-        obj.marked_by_id = request.user.id
-        obj.save(update_fields=["status", "date", "marked_by_id"])
 
     return JsonResponse({"ok": True})
+
+
+MARK_BATCH_MAX_CELLS = 1000
+
+@login_required
+@role_required("ASSISTANT")
+@require_http_methods(["POST"])
+def attendance_mark_batch(request):
+    """
+    批量打勾：前端把多次点击合并成一次请求，同一事务内一次 Upsert
+    JSON:
+      {course_slot_id, sub_group_id|null,
+       cells: [{enrollment_id, week_no, present: true/false}, ...]}
+    同一格子出现多次时，以最后一次为准
+    """
+    import json
+    try:
+        payload = json.loads(request.body.decode("utf-8"))
+        slot_id     = int(payload["course_slot_id"])
+        subgroup_id = payload.get("sub_group_id")
+        subgroup_id = int(subgroup_id) if subgroup_id else None
+        marks = {}
+        for c in payload["cells"]:
+            marks[(int(c["enrollment_id"]), int(c["week_no"]))] = bool(c["present"])
+    except Exception:
+        return HttpResponseBadRequest("invalid body")
+    if len(marks) > MARK_BATCH_MAX_CELLS:
+        return HttpResponseBadRequest("too many cells")
+
+    try:
+        slot = CourseSlot.objects.select_related("semester").get(id=slot_id)
+    except CourseSlot.DoesNotExist:
+        return HttpResponseBadRequest("invalid slot")
+
+    sem = slot.semester
+    count = upsert_attendance(
+        slot=slot,
+        sub_group_id=subgroup_id,
+        marks=marks,
+        user=request.user,
+        date_for_week=sem.calendar(slot.weekday).date_of,
+    )
+    return JsonResponse({"ok": True, "updated": count})
 # --------- 批量：本周全员出勤 / 清空 ----------
 
 @login_required
@@ -500,32 +594,22 @@ def _bulk_update_week(request, *, present: bool):
 
     slot = CourseSlot.objects.select_related("semester").get(id=slot_id)
     sem  = slot.semester
-    date_obj = compute_date_for_week(sem.start_date, week_no, slot.weekday)
+    date_obj = sem.calendar(slot.weekday).date_of(week_no)
 
-    # 找到需要更新的报名
+    # 找到需要更新的报名（只取 id，一次查询）
     enrollments = Enrollment.objects.filter(status="APPROVED", course_slot_id=slot.id)
     if subgroup_id:
         enrollments = enrollments.filter(Q(sub_group_id=subgroup_id) | Q(sub_group_id__isnull=True))
+    enrollment_ids = list(enrollments.values_list("id", flat=True))
 
-    count = 0
-    for en in enrollments:
-        obj, created = Attendance.objects.get_or_create(
-            enrollment=en,
-            course_slot_id=slot.id,
-            week_no=week_no,
-            sub_group_id=subgroup_id,
-            defaults={
-                "date": date_obj,
-                "status": "PRESENT" if present else "ABSENT",
-                "marked_by": request.user,
-            }
-        )
-        if not created:
-            obj.status = "PRESENT" if present else "ABSENT"
-            obj.date = date_obj
-            obj.marked_by = request.user
-            obj.save(update_fields=["status","date","marked_by"])
-        count += 1
+    # 集合式 Upsert：一次读 + bulk_update + bulk_create，同一事务
+    count = upsert_attendance(
+        slot=slot,
+        sub_group_id=subgroup_id,
+        marks={(eid, week_no): present for eid in enrollment_ids},
+        user=request.user,
+        date_for_week=lambda wk: date_obj,
+    )
 
     return JsonResponse({"ok": True, "updated": count})
 
@@ -540,12 +624,11 @@ def attendance_export_csv(request):
       subgroup_id (可空)
       strict=1/0        # 严格导出：无记录 => ABSENT；默认 1
       future_blank=0/1  # 将“未来周”保留为空（不标记 ABSENT），默认 0=也标记为 ABSENT
+      format=csv|xlsx|ndjson|arrow|columnar  # 默认 csv，见 portal/exports.py
     说明：
       - 兼容旧数据：course_slot 为空但 course/semester 匹配的报名也导出
       - 严格模式下，所有空格会被写成 ABSENT（除非 future_blank=1 且该周在未来）
     """
-    from datetime import date
-
     try:
         slot_id = int(request.GET.get("slot_id"))
         subgroup_id = request.GET.get("subgroup_id")
@@ -554,122 +637,62 @@ def attendance_export_csv(request):
         future_blank = bool(int(request.GET.get("future_blank", "0"))) # 默认未来周也记为 ABSENT
     except (TypeError, ValueError):
         return HttpResponseBadRequest("missing params")
+    exporter = get_exporter(request.GET.get("format"))
+    if exporter is None:
+        return HttpResponseBadRequest("unknown format")
 
     slot = CourseSlot.objects.select_related("course","semester").get(id=slot_id)
     sem  = slot.semester
-    week_count = sem.week_count
-    today = date.today()
-
-    def is_future_week(w:int)->bool:
-        d = compute_date_for_week(sem.start_date, w, slot.weekday)
-        return d > today
-
-    # —— 与签到表一致：兼容旧报名
-    enrollments = (
-        Enrollment.objects.filter(status="APPROVED")
-        .filter(
-            Q(course_slot_id=slot.id) |
-            (Q(course_slot__isnull=True) & Q(course_id=slot.course_id) & Q(semester_id=sem.id))
-        )
-        .select_related("student","parent","sub_group")
-        .order_by("id")
-    )
-    if subgroup_id:
-        enrollments = enrollments.filter(Q(sub_group_id=subgroup_id) | Q(sub_group_id__isnull=True))
-
-    # 出勤记录
-    atts = Attendance.objects.filter(course_slot=slot)
-    if subgroup_id:
-        atts = atts.filter(Q(sub_group_id=subgroup_id) | Q(sub_group_id__isnull=True))
-    att_map = {(a.enrollment_id, a.week_no): a.status for a in atts}
-
-    # 写 CSV
-    buf = StringIO()
-    w = csv.writer(buf)
-    #w.writerow(["Student", "Parent", "Paid"] + [f"W{wk}" for wk in range(1, week_count+1)])
-    # 添加表头（含日期）
-    header = ["Student", "Parent", "Paid"]
-    for wk in range(1, week_count+1):
-        d = compute_date_for_week(sem.start_date, wk, slot.weekday)
-        dow = calendar.day_abbr[d.weekday()]
-        date_str = d.strftime("%m/%d")
-        header.append(f"W{wk} ({dow} {date_str})")
-    w.writerow(header)
-
-    for en in enrollments:
-        student_name = en.student.full_name if en.student else en.parent.username
-        row = [student_name, en.parent.username, en.paid_status]
-
-        for wk in range(1, week_count+1):
-            status = att_map.get((en.id, wk))  # "PRESENT"/"ABSENT"/None
-            if status is None:
-                #if strict:
-                    # 未来周是否保留空白由 future_blank 控制
-                  #  if future_blank and is_future_week(wk):
-                   #     status = ""
-                    #else:
-                     #   status = "ABSENT"
-                #else:
-                    status = "ABSENT"
-            row.append(status)
-        w.writerow(row)
-
-    filename = f"{slot.course.title}_{sem.name}_Week.csv".replace(" ", "_")
-    resp = HttpResponse(buf.getvalue(), content_type="text/csv; charset=utf-8-sig")
-    resp["Content-Disposition"] = f'attachment; filename="{filename}"'
-    return resp
+    cal = sem.calendar(slot.weekday)
+
+    # —— 与签到表一致：兼容旧报名；名单 LEFT JOIN 出勤，按 (报名, 周) 排序流式读取
+    grid = roster_attendance_rows(slot, subgroup_id).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+    def rows():
+        # 添加表头（含日期）
+        header = ["Student", "Parent", "Paid"] + [f"W{wk} ({cal.label_of(wk)})" for wk in cal.weeks]
+        yield header
+
+        # 同一报名的记录相邻：读完一组就拼一行，只缓存这一人的各周状态
+        for (_, student_name, parent_name, paid_status), cells in groupby(grid, key=lambda r: r[:4]):
+            statuses = {}
+            for *_, wk, st in cells:
+                statuses.setdefault(wk, st)
+            row = [student_name or parent_name, parent_name, paid_status]
+
+            # 表头和格子都按同一份周历
+            for wk in cal.weeks:
+                row.append(statuses.get(wk) or "ABSENT")    # 没有记录 = ABSENT
+            yield row
+
+    basename = f"{slot.course.title}_{sem.name}_Week".replace(" ", "_")
+    return exporter.response(rows(), basename)
 # ---- 家长端：课程通知 ----
 @login_required(login_url="/portal/auth/login/")
 @role_required("PARENT")
 def parent_notices(request):
-    parent = request.user
-
-    # 该家长的报名（只看 APPROVED）
-    enroll_qs = (Enrollment.objects
-                 .filter(parent=parent, status="APPROVED")
-                 .select_related("course_slot", "sub_group"))
-
-    course_slot_ids = {e.course_slot_id for e in enroll_qs if e.course_slot_id}
-    subgroup_ids     = {e.sub_group_id  for e in enroll_qs if e.sub_group_id}
+    # 只读收件箱（发布时已扇出）；本页显示的标记为已读
+    page = Paginator(inbox_for_parent(request.user.id), NOTICES_PER_PAGE).get_page(request.GET.get("page"))
+    items = []
+    for d in page.object_list:
+        d.notice.is_unread = d.read_at is None
+        items.append(d.notice)
+    mark_read([d.pk for d in page.object_list if d.read_at is None])
+    return render(request, "portal/parent_notices.html", {"items": items, "page_obj": page})
 
-    # 如果家长一个课都没报，直接空
-    if not course_slot_ids:
-        return render(request, "portal/parent_notices.html", {"items": []})
 
-    # “付费可见”匹配（按相同 course_slot，且子班相同或 notice 不限定子班）
-    paid_enrolls = (Enrollment.objects
-        .filter(parent=parent, status="APPROVED", paid_status="PAID",
-                course_slot_id=OuterRef("course_slot_id"))
-        .filter(Q(sub_group__isnull=True) | Q(sub_group_id=OuterRef("sub_group_id")))
-    )
-
-    # 兼容 visible_to 的多种存储（ALL/PAID_ONLY/空）
-    V_ALL  = ["ALL", "all", "", None]
-    V_PAID = ["PAID_ONLY", "PAID", "paid_only"]
-
-    qs = (ClassNotice.objects
-          # 先限定在家长报名过的课时段
-          .filter(course_slot_id__in=course_slot_ids)
-          # 如果公告限定了子班，则必须命中家长孩子的子班；未限定子班（null）则表示整个时段都可见
-          .filter(Q(sub_group__isnull=True) | Q(sub_group_id__in=subgroup_ids))
-          # 付费限制
-          .annotate(paid_match=Exists(paid_enrolls))
-          .filter(Q(visible_to__in=V_ALL) | Q(visible_to__in=V_PAID, paid_match=True))
-          .select_related("course_slot", "course_slot__course",
-                          "course_slot__semester", "sub_group")
-          .order_by("-is_pinned", "-created_at")
-    )
-
-    return render(request, "portal/parent_notices.html", {"items": qs})
+@login_required
+@role_required("PARENT")
+def parent_notices_unread(request):
+    """导航栏的未读角标"""
+    return JsonResponse({"unread": unread_count(request.user.id)})
 
 
 # ---- 家长端：学习资料 ----
 @login_required(login_url="/portal/auth/login/")
 @role_required("PARENT")
 def parent_resources(request):
-    parent = request.user
-    enrolls = Enrollment.objects.filter(parent=parent, status="APPROVED")
-    subgroup_ids = {e.sub_group_id for e in enrolls if e.sub_group_id}
+    subgroup_ids = get_parent_context(request.user.id).subgroup_ids
 
     qs = (LearningResource.objects
         .filter(is_active=True, sub_group_id__in=subgroup_ids)
@@ -712,23 +735,27 @@ def assistant_comment_submit(request):
 
 @login_required
 @role_required("ASSISTANT")
-def assistant_comments_api(request):
+async def assistant_comments_api(request):
+    """某细分班的助教评论，游标分页：?subgroup_id=&cursor=&limit=，返回 next_cursor（没有更多时为 null）"""
     subgroup_id = request.GET.get("subgroup_id")
     if not subgroup_id:
-        return JsonResponse({"comments": []})
-    comments = (
-        Comment.objects
-        .filter(role="ASSISTANT", sub_group_id=subgroup_id)
-        .select_related("user")
-        .order_by("-created_at")
-    )
+        return JsonResponse({"comments": [], "next_cursor": None})
+    try:
+        limit = min(max(int(request.GET.get("limit") or COMMENTS_PAGE_SIZE), 1), MAX_COMMENTS_PAGE_SIZE)
+        comments, next_cursor = await acomment_page(
+            Comment.objects.filter(role="ASSISTANT", sub_group_id=int(subgroup_id)).select_related("user"),
+            request.GET.get("cursor"), limit,
+        )
+    except ValueError:
+        return HttpResponseBadRequest("invalid subgroup_id / cursor / limit")
     data = [
         {
+            "id": c.id,
             "content": c.content,
             "created_at": c.created_at.strftime("%Y-%m-%d %H:%M"),
             "author": c.user.get_full_name() or c.user.username,
         }
         for c in comments
     ]
-    return JsonResponse({"comments": data})
+    return JsonResponse({"comments": data, "next_cursor": next_cursor})
 